@@ -0,0 +1,398 @@
+# almacen_plantillas.py
+"""
+Almacén empaquetado de plantillas biométricas (reemplaza un .pkl por RUT).
+
+Formato en 'rostros/':
+  - galeria.json          tabla versionada RUT -> (inicio, n) + generación vigente
+  - galeria_<gen>_<id>.npy  matriz float32 (N x 128), mapeable en memoria
+  - galeria.lock          candado entre procesos de los escritores
+
+Cada escritura genera una matriz nueva con nombre único y luego reemplaza
+'galeria.json' con os.replace, así los lectores ven la versión anterior o la
+nueva completa, nunca una mezcla. Un arranque en frío abre solo esos dos
+archivos y no deserializa ningún pickle.
+
+La app, enrolar_funcionaria, reconstruir_galeria y condensacion_plantillas pueden
+escribir desde procesos distintos: leer la generación -> escribir -> publicar se
+hace con 'galeria.lock' tomado (fcntl.flock / msvcrt.locking), no basta el RLock.
+
+Uso manual (migrar los .pkl existentes):
+    python almacen_plantillas.py --migrar
+"""
+import os
+import sys
+import json
+import uuid
+import pickle
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:          # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:          # POSIX
+    msvcrt = None
+
+FORMATO_VERSION = 1
+ENCODING_DIM = 128
+INDICE_NOMBRE = "galeria.json"
+BLOQUEO_NOMBRE = "galeria.lock"
+REINTENTOS_LECTURA = 3       # la matriz leída del índice puede borrarse justo antes de abrirla
+
+
+# ============== RUTAS ==============
+def _base_dir():
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+ROSTROS_DIR = os.path.join(_base_dir(), "rostros")
+
+
+# ============== HELPERS DE RUT / MATRICES ==============
+def clave_rut(rut: str) -> str:
+    """Clave canónica para indexar: solo alfanuméricos, DV en mayúscula (12345678K)."""
+    return "".join(ch for ch in (rut or "") if ch.isalnum()).upper()
+
+def rut_desde_clave(clave: str) -> str:
+    if len(clave) < 2 or not clave[:-1].isdigit():
+        return clave
+    return f"{clave[:-1]}-{clave[-1]}"
+
+def a_matriz(encodings) -> np.ndarray:
+    """Lista/array de encodings (o uno solo) -> matriz float32 (k x 128)."""
+    if encodings is None:
+        return np.empty((0, ENCODING_DIM), dtype=np.float32)
+    if isinstance(encodings, np.ndarray):
+        return np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+    if not isinstance(encodings, (list, tuple)):
+        encodings = [encodings]
+    if len(encodings) == 0:
+        return np.empty((0, ENCODING_DIM), dtype=np.float32)
+    return np.asarray(np.vstack(encodings), dtype=np.float32).reshape(-1, ENCODING_DIM)
+
+
+# ============== CANDADO ENTRE PROCESOS ==============
+class _BloqueoArchivo:
+    """Candado exclusivo sobre un archivo (flock en POSIX, msvcrt.locking en Windows)."""
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._f = None
+
+    def adquirir(self):
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        f = open(self.ruta, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)   # reintenta ~10 s y lanza OSError
+                        break
+                    except OSError:
+                        continue
+        except BaseException:
+            f.close()
+            raise
+        self._f = f
+
+    def liberar(self):
+        f, self._f = self._f, None
+        if f is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            f.close()
+
+
+# ============== ALMACÉN ==============
+class AlmacenPlantillas:
+    def __init__(self, carpeta: str = ROSTROS_DIR):
+        self.carpeta = carpeta
+        self.ruta_indice = os.path.join(carpeta, INDICE_NOMBRE)
+        self._lock = threading.RLock()
+        self._bloqueo = _BloqueoArchivo(os.path.join(carpeta, BLOQUEO_NOMBRE))
+        self._profundidad = 0
+
+    @contextmanager
+    def _exclusivo(self):
+        """Sección crítica de escritura entre hilos (RLock) y entre procesos (galeria.lock)."""
+        with self._lock:
+            if self._profundidad == 0:
+                self._bloqueo.adquirir()
+            self._profundidad += 1
+            try:
+                yield
+            finally:
+                self._profundidad -= 1
+                if self._profundidad == 0:
+                    self._bloqueo.liberar()
+
+    # ---------- lectura ----------
+    def existe(self) -> bool:
+        return os.path.isfile(self.ruta_indice)
+
+    def firma(self):
+        """(mtime_ns, tamaño) del índice; None si no existe. Sirve para invalidar cachés."""
+        try:
+            st = os.stat(self.ruta_indice)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _leer_indice(self) -> dict:
+        with open(self.ruta_indice, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("formato") != FORMATO_VERSION:
+            raise ValueError(f"Formato de galería no soportado: {meta.get('formato')}")
+        if int(meta.get("dim", ENCODING_DIM)) != ENCODING_DIM:
+            raise ValueError(f"Dimensión de encodings inesperada: {meta.get('dim')}")
+        return meta
+
+    def cargar(self):
+        """
+        Devuelve (matriz, personas):
+          matriz   -> float32 (N x 128), mapeada en memoria (solo lectura)
+          personas -> {clave: (rut, inicio, n)} ordenado por clave
+        """
+        with self._lock:
+            for intento in range(REINTENTOS_LECTURA):
+                if not self.existe():
+                    return np.empty((0, ENCODING_DIM), dtype=np.float32), {}
+                meta = self._leer_indice()
+                filas = int(meta.get("filas", 0))
+                if not filas:
+                    matriz = np.empty((0, ENCODING_DIM), dtype=np.float32)
+                    break
+                try:
+                    matriz = np.load(os.path.join(self.carpeta, meta["matriz"]), mmap_mode="r")
+                    break
+                except FileNotFoundError:
+                    # Otro proceso publicó y limpió entre leer el índice y abrir la matriz
+                    if intento == REINTENTOS_LECTURA - 1:
+                        raise
+            if filas and (matriz.shape != (filas, ENCODING_DIM) or matriz.dtype != np.float32):
+                raise ValueError(f"Matriz de galería inconsistente: {matriz.shape} {matriz.dtype}")
+            personas = {
+                k: (p["rut"], int(p["inicio"]), int(p["n"]))
+                for k, p in sorted(meta.get("personas", {}).items())
+            }
+            return matriz, personas
+
+    def _cargar_dict(self):
+        """{clave: (rut, matriz k x 128)} en memoria (copia), para reescribir."""
+        matriz, personas = self.cargar()
+        return {k: (rut, np.array(matriz[ini:ini + n], dtype=np.float32))
+                for k, (rut, ini, n) in personas.items()}, self._generacion_actual()
+
+    def instantanea(self):
+        """
+        ({clave: (rut, matriz)}, generación) leídos juntos (copias en memoria).
+        Base para reemplazar_todo(..., base=) cuando la galería nueva tarda en prepararse.
+        """
+        with self._exclusivo():
+            return self._cargar_dict()
+
+    def _generacion_actual(self) -> int:
+        if not self.existe():
+            return 0
+        try:
+            return int(self._leer_indice().get("generacion", 0))
+        except Exception:
+            return 0
+
+    # ---------- escritura atómica ----------
+    def _escribir(self, datos: dict, gen_anterior: int):
+        """
+        datos: {clave: (rut, matriz)}. Escribe una generación nueva y la publica.
+        Llamar dentro de _exclusivo(), con gen_anterior leída ahí mismo.
+        """
+        os.makedirs(self.carpeta, exist_ok=True)
+        gen = gen_anterior + 1
+        nombre_npy = f"galeria_{gen:06d}_{os.getpid()}_{uuid.uuid4().hex[:8]}.npy"
+        ruta_npy = os.path.join(self.carpeta, nombre_npy)
+
+        personas, bloques, ini = {}, [], 0
+        for k in sorted(datos):
+            rut, m = datos[k]
+            m = a_matriz(m)
+            if not len(m):
+                continue
+            personas[k] = {"rut": rut, "inicio": ini, "n": int(len(m))}
+            bloques.append(m)
+            ini += len(m)
+        matriz = np.vstack(bloques).astype(np.float32) if bloques \
+            else np.empty((0, ENCODING_DIM), dtype=np.float32)
+
+        tmp_npy = ruta_npy + ".tmp"
+        with open(tmp_npy, "wb") as f:
+            np.save(f, np.ascontiguousarray(matriz))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_npy, ruta_npy)
+
+        meta = {
+            "formato": FORMATO_VERSION,
+            "dim": ENCODING_DIM,
+            "dtype": "float32",
+            "generacion": gen,
+            "matriz": nombre_npy,
+            "filas": int(len(matriz)),
+            "personas": personas,
+        }
+        tmp_idx = self.ruta_indice + ".tmp"
+        with open(tmp_idx, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_idx, self.ruta_indice)
+
+        self._limpiar_generaciones(nombre_npy)
+
+    def _limpiar_generaciones(self, vigente: str):
+        """
+        Borra matrices de generaciones anteriores y temporales huérfanos (si siguen
+        mapeadas en Windows, se reintenta luego). Solo dentro de _exclusivo().
+        """
+        try:
+            for e in os.scandir(self.carpeta):
+                if e.name.startswith("galeria_") and e.name.endswith((".npy", ".npy.tmp")) and e.name != vigente:
+                    try:
+                        os.remove(e.path)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+
+    def reemplazar(self, rut: str, encodings, transformar=None):
+        """
+        Reemplaza todas las plantillas de un RUT. transformar(matriz) -> matriz se
+        aplica al resultado antes de escribir (p.ej. condensar), con el candado tomado.
+        """
+        with self._exclusivo():
+            datos, gen = self._cargar_dict()
+            m = a_matriz(encodings)
+            if transformar is not None:
+                m = a_matriz(transformar(m))
+            datos[clave_rut(rut)] = (rut_desde_clave(clave_rut(rut)), m)
+            self._escribir(datos, gen)
+
+    def agregar(self, rut: str, encodings, transformar=None):
+        """Agrega plantillas al final de las existentes del RUT (transformar: como en reemplazar)."""
+        with self._exclusivo():
+            datos, gen = self._cargar_dict()
+            k = clave_rut(rut)
+            previas = datos[k][1] if k in datos else np.empty((0, ENCODING_DIM), dtype=np.float32)
+            m = np.vstack([previas, a_matriz(encodings)])
+            if transformar is not None:
+                m = a_matriz(transformar(m))
+            datos[k] = (rut_desde_clave(k), m)
+            self._escribir(datos, gen)
+
+    def eliminar(self, rut: str):
+        with self._exclusivo():
+            datos, gen = self._cargar_dict()
+            if datos.pop(clave_rut(rut), None) is not None:
+                self._escribir(datos, gen)
+
+    def reemplazar_todo(self, por_rut: dict, base=None) -> list:
+        """
+        Reescribe la galería completa: {rut: encodings}.
+
+        base: instantanea() tomada antes de preparar por_rut. Si otro proceso escribió
+        desde entonces, lo que cambió para una persona (enrolamiento, edición, baja)
+        gana sobre por_rut. Devuelve los RUT tomados así de la galería vigente.
+        """
+        with self._exclusivo():
+            datos = {clave_rut(r): (rut_desde_clave(clave_rut(r)), a_matriz(e)) for r, e in por_rut.items()}
+            respetados = []
+            if base is None:
+                gen = self._generacion_actual()
+            else:
+                actuales, gen = self._cargar_dict()
+            if base is not None and gen != base[1]:
+                previos = base[0]
+                for k in set(previos) | set(actuales):
+                    antes, ahora = previos.get(k), actuales.get(k)
+                    if antes is not None and ahora is not None and np.array_equal(antes[1], ahora[1]):
+                        continue
+                    if ahora is None:
+                        datos.pop(k, None)
+                    else:
+                        datos[k] = ahora
+                    respetados.append(rut_desde_clave(k))
+            self._escribir(datos, gen)
+            return sorted(respetados)
+
+    def reescribir(self, transformar) -> bool:
+        """
+        Aplica transformar(rut, matriz) -> matriz a cada persona y publica el
+        resultado en UNA generación, solo si algo cambió. Devuelve si escribió.
+        """
+        with self._exclusivo():
+            datos, gen = self._cargar_dict()
+            nuevos, cambio = {}, False
+            for k, (rut, m) in datos.items():
+                t = a_matriz(transformar(rut, m))
+                cambio = cambio or t.shape != m.shape or not np.array_equal(t, m)
+                nuevos[k] = (rut, t)
+            if cambio:
+                self._escribir(nuevos, gen)
+            return cambio
+
+    # ---------- migración desde .pkl ----------
+    def pkl_existentes(self):
+        """{clave: ruta} de los .pkl heredados (si hay variantes de nombre, gana el más reciente)."""
+        vistos = {}
+        try:
+            entradas = list(os.scandir(self.carpeta))
+        except FileNotFoundError:
+            return {}
+        for e in entradas:
+            if not e.name.endswith(".pkl") or not e.is_file():
+                continue
+            k = clave_rut(e.name[:-4])
+            mtime = e.stat().st_mtime
+            if k not in vistos or mtime > vistos[k][1]:
+                vistos[k] = (e.path, mtime)
+        return {k: p for k, (p, _m) in vistos.items()}
+
+    def migrar_desde_pkl(self) -> tuple[int, int]:
+        """
+        Importa todos los rostros/<rut>.pkl al almacén (los .pkl no se borran).
+        Devuelve (personas, plantillas) migradas.
+        """
+        with self._exclusivo():
+            datos, gen = self._cargar_dict()
+            for k, path in self.pkl_existentes().items():
+                try:
+                    with open(path, "rb") as f:
+                        m = a_matriz(pickle.load(f))
+                except Exception as e:
+                    print(f"[almacen] no se pudo migrar {path}: {e}")
+                    continue
+                if len(m):
+                    datos[k] = (rut_desde_clave(k), m)
+            self._escribir(datos, gen)
+            return len(datos), sum(len(m) for _r, m in datos.values())
+
+
+if __name__ == "__main__":
+    if "--migrar" in sys.argv:
+        personas, plantillas = AlmacenPlantillas().migrar_desde_pkl()
+        print(f"✅ Migradas {plantillas} plantillas de {personas} personas a {ROSTROS_DIR}")
+    else:
+        print(__doc__)
@@ -1,5 +1,9 @@
 # asistencia_diaria.py
-import os, sys, sqlite3, calendar, datetime as dt, tkinter as tk
+import os, sys, calendar, datetime as dt, tkinter as tk
+from db import conectar, capacidades
+from despacho_ui import ejecutar
+from feriados import feriados_en_rango
+from hechos_asistencia import leer_rango, SALIDA_AUTORIZADA
 from tkinter import ttk, messagebox
 import customtkinter as ctk
 
@@ -47,24 +51,9 @@ def _mes_range(year, month):
     last_day = calendar.monthrange(year, month)[1]
     return dt.date(year, month, 1), dt.date(year, month, last_day), last_day
 
-def _feriados_set_range(con, d1: dt.date, d2: dt.date):
-    cur = con.cursor()
-    cur.execute(
-        "SELECT fecha FROM feriados WHERE fecha BETWEEN ? AND ?",
-        (d1.strftime("%Y-%m-%d"), d2.strftime("%Y-%m-%d"))
-    )
-    return {row[0] for row in cur.fetchall()}
-
-def _panel_salida_autorizada_set(con, d1: dt.date, d2: dt.date):
-    cur = con.cursor()
-    try:
-        cur.execute(
-            "SELECT fecha FROM panel_flags WHERE fecha BETWEEN ? AND ? AND salida_anticipada=1",
-            (d1.strftime("%Y-%m-%d"), d2.strftime("%Y-%m-%d"))
-        )
-        return {row[0] for row in cur.fetchall()}
-    except Exception:
-        return set()
+def _feriados_set_range(d1: dt.date, d2: dt.date):
+    # Solo la tabla 'feriados', como siempre en esta matriz (la librería holidays no cuenta aquí)
+    return {f.isoformat() for f, _n, _irr in feriados_en_rango(d1, d2, solo_tabla=True)}
 
 def _maximize_without_covering_taskbar(win):
     ok = False
@@ -137,80 +126,59 @@ def _leer_funcionarios(con):
     """)
     return cur.fetchall()
 
-# ---------- NUEVO: detección de observación de ingreso ----------
-def _obs_ingreso_en_fecha(con, rut: str, fecha: dt.date) -> bool:
-    f_iso = fecha.strftime("%Y-%m-%d")
-    cur = con.cursor()
-    try:
-        cur.execute("PRAGMA table_info(registros)")
-        cols = {c[1].lower() for c in cur.fetchall()}
-    except Exception:
-        cols = set()
-
-    cand_obs = ["obs_ingreso", "observacion_ingreso", "observacion", "observaciones", "obs", "motivo", "justificacion"]
-    obs_col = next((c for c in cand_obs if c in cols), None)
-    if not obs_col:
-        return False
-
-    tiene_hora_ing = "hora_ingreso" in cols
-    tiene_tipo = "tipo" in cols
-    tiene_hora = "hora" in cols
-
-    where = ["rut = ?", "DATE(fecha) = DATE(?)"]
-    params = [rut, f_iso]
-
-    cond_ing = []
-    if tiene_hora_ing:
-        cond_ing.append("(hora_ingreso IS NOT NULL AND TRIM(hora_ingreso) <> '')")
-    if tiene_tipo and tiene_hora:
-        cond_ing.append("((lower(IFNULL(tipo,'')) LIKE 'ing%%' OR lower(IFNULL(tipo,'')) LIKE 'ent%%') AND hora IS NOT NULL AND TRIM(hora) <> '')")
-    elif tiene_tipo:
-        cond_ing.append("(lower(IFNULL(tipo,'')) LIKE 'ing%%' OR lower(IFNULL(tipo,'')) LIKE 'ent%%')")
-
-    if not cond_ing:
-        return False
-
-    where.append("(" + " OR ".join(cond_ing) + ")")
-    where.append(f"( {obs_col} IS NOT NULL AND TRIM({obs_col}) <> '' )")
-
-    sql = f"SELECT 1 FROM registros WHERE {' AND '.join(where)} LIMIT 1"
-    cur.execute(sql, params)
-    return cur.fetchone() is not None
-
-def _estado_y_obs_en_fecha(con, rut: str, fecha: dt.date, salida_autorizada_set):
-    f_iso = fecha.strftime("%Y-%m-%d")
-    cur = con.cursor()
-    cur.execute("""
-        SELECT
-            MAX(CASE
-                WHEN hora_ingreso IS NOT NULL AND TRIM(hora_ingreso) <> '' THEN 1
-                WHEN ( (lower(IFNULL(tipo,'')) LIKE 'ing%%' OR lower(IFNULL(tipo,'')) LIKE 'ent%%')
-                       AND hora IS NOT NULL AND TRIM(hora) <> '' ) THEN 1
-                ELSE 0
-            END) AS tiene_ing,
-            MAX(CASE
-                WHEN hora_salida IS NOT NULL AND TRIM(hora_salida) <> '' THEN 1
-                WHEN ( (lower(IFNULL(tipo,'')) LIKE 'sal%%' OR lower(IFNULL(tipo,'')) LIKE 'ret%%')
-                       AND hora IS NOT NULL AND TRIM(hora) <> '' ) THEN 1
-                ELSE 0
-            END) AS tiene_sal
-        FROM registros
-        WHERE rut = ? AND DATE(fecha) = DATE(?)
-    """, (rut, f_iso))
-    row = cur.fetchone()
-    ing, sal = (row or (0, 0))
-    ing = int(ing or 0); sal = int(sal or 0)
-
-    obs_ing = False
-    if ing:
-        obs_ing = _obs_ingreso_en_fecha(con, rut, fecha)
-
-    if ing:
-        if sal:
-            return "OK", obs_ing
+# ---------- Matriz funcionario × día (una consulta para todo el período) ----------
+ESTADOS = ("-", "OK", "OK_OBS", "SI", "PS")          # código = posición en la tupla
+TEXTO_CELDA = {"OK": "✓", "OK_OBS": "✓●", "SI": "S/I", "PS": "P/S", "-": "-"}
+def _day_types(date_list, set_fer):
+    tipos = []
+    for d in date_list:
+        if d.strftime("%Y-%m-%d") in set_fer: tipos.append("F")
+        else:
+            wd = d.weekday()
+            tipos.append("S" if wd==5 else ("D" if wd==6 else "N"))
+    return tipos
+
+class MatrizAsistencia:
+    """
+    Estados de asistencia en un bytearray denso: fila = funcionario, columna = día,
+    valor = índice en ESTADOS. La usan la vista previa, el PDF y el correo.
+    """
+    def __init__(self, funcionarios, date_list, day_types, celdas):
+        self.funcionarios = funcionarios      # [(rut, nombre)]
+        self.date_list = date_list
+        self.day_types = day_types
+        self.celdas = celdas                  # bytearray(len(funcionarios) * len(date_list))
+
+    def flags(self, i):
+        n = len(self.date_list)
+        return [ESTADOS[c] for c in self.celdas[i * n:(i + 1) * n]]
+
+    def filas(self):
+        return [{"nombre": n, "rut": r, "flags": self.flags(i)} for i, (r, n) in enumerate(self.funcionarios)]
+
+def construir_matriz(funcionarios, date_list, db_path=None) -> MatrizAsistencia:
+    """
+    Estados de todo el período desde asistencia_dia (un escaneo por rango): ya trae
+    ingreso/salida/observación por (rut, fecha) y el estado SI/PS según panel_flags.
+    """
+    d1, d2 = date_list[0], date_list[-1]
+    set_fer = _feriados_set_range(d1, d2)
+    hechos = leer_rango(d1, d2, db_path=db_path)
+
+    fila_de = {r: i for i, (r, _n) in enumerate(funcionarios)}
+    col_de = {d.strftime("%Y-%m-%d"): j for j, d in enumerate(date_list)}
+    n = len(date_list)
+    celdas = bytearray(len(funcionarios) * n)       # 0 = "-"
+    for (rut, f_iso), h in hechos.items():
+        i, j = fila_de.get(rut), col_de.get(f_iso)
+        if i is None or j is None or not h["hora_ingreso"]:
+            continue
+        if h["hora_salida"]:
+            estado = "OK_OBS" if h["observacion"] else "OK"
         else:
-            return ("PS" if (f_iso in salida_autorizada_set) else "SI"), obs_ing
-    return "-", obs_ing
+            estado = "PS" if h["estado"] == SALIDA_AUTORIZADA else "SI"
+        celdas[i * n + j] = ESTADOS.index(estado)
+    return MatrizAsistencia(funcionarios, date_list, _day_types(date_list, set_fer), celdas)
 
 # ===== Iconos vectoriales (PDF) =====
 from reportlab.lib import colors as _rl_colors
@@ -279,7 +247,16 @@ def _send_email_pdf_bioaccess(to_list, cc_list, subject, text_body, html_body, a
     if not USAR_SMTP:
         messagebox.showinfo("Correo (simulado)", f"Para: {', '.join(to_list)}\nCC: {', '.join(cc_list)}\nAsunto: {subject}")
         return True
+    try:
+        _smtp_enviar_pdf(to_list, cc_list, subject, text_body, html_body, attach_path)
+        return True
+    except Exception as e:
+        traceback.print_exc()
+        messagebox.showerror("Correo", f"No fue posible enviar el correo:\n{e}")
+        return False
 
+def _smtp_enviar_pdf(to_list, cc_list, subject, text_body, html_body, attach_path):
+    """Solo SMTP (sin diálogos): apto para un hilo trabajador. Lanza la excepción si falla."""
     msg = EmailMessage()
     msg["Subject"] = subject
     msg["From"] = SMTP_USER
@@ -297,15 +274,9 @@ def _send_email_pdf_bioaccess(to_list, cc_list, subject, text_body, html_body, a
         with open(attach_path, "rb") as f:
             msg.add_attachment(f.read(), maintype=maintype, subtype=subtype, filename=os.path.basename(attach_path))
 
-    try:
-        with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=20) as s:
-            s.login(SMTP_USER, SMTP_PASS)
-            s.send_message(msg)
-        return True
-    except Exception as e:
-        traceback.print_exc()
-        messagebox.showerror("Correo", f"No fue posible enviar el correo:\n{e}")
-        return False
+    with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=20) as s:
+        s.login(SMTP_USER, SMTP_PASS)
+        s.send_message(msg)
 
 # ====== helpers para correos de funcionarios ======
 def _emails_para_ruts(con, ruts):
@@ -402,7 +373,7 @@ def abrir_asistencia_diaria(app_root, db_path: str):
     toggle_modo()
 
     # ---- Datos base ----
-    con = sqlite3.connect(db_path)
+    con = conectar(db_path)
     funcionarios = _leer_funcionarios(con)
     items = [f"{n} | {r}" for (r, n) in funcionarios]
     for it in items: listbox.insert("end", it)
@@ -466,16 +437,12 @@ def abrir_asistencia_diaria(app_root, db_path: str):
                 date_list = [dt.date(y, m, d) for d in range(1, last_day+1)]
                 period_text = f"{MESES_ES[m]} {y}"
 
-            set_fer = _feriados_set_range(con, date_list[0], date_list[-1])
-            salida_aut_set = _panel_salida_autorizada_set(con, date_list[0], date_list[-1])
-
-            day_types = []
-            for d in date_list:
-                f_iso = d.strftime("%Y-%m-%d")
-                if f_iso in set_fer: day_types.append("F")
-                else:
-                    wd = d.weekday()
-                    day_types.append("S" if wd==5 else ("D" if wd==6 else "N"))
+            ruts = _seleccionados()
+            if not ruts:
+                messagebox.showinfo("Asistencia diaria","No hay funcionarios seleccionados."); return
+            sel = set(ruts)
+            matriz = construir_matriz([(r, n) for r, n in funcionarios if r in sel], date_list, db_path)
+            day_types = matriz.day_types
 
             cols = ["nombre", "rut"] + [str(i+1) for i in range(len(date_list))]
             tabla["columns"] = cols
@@ -490,30 +457,15 @@ def abrir_asistencia_diaria(app_root, db_path: str):
                 tabla.heading(col_id, text=str(i+1))
                 tabla.column(col_id, width=36, anchor="center")
 
-            ruts = _seleccionados()
-            if not ruts:
-                messagebox.showinfo("Asistencia diaria","No hay funcionarios seleccionados."); return
-
             sab = sum(1 for t in day_types if t=="S")
             dom = sum(1 for t in day_types if t=="D")
             fer = sum(1 for t in day_types if t=="F")
             tabla.heading("nombre", text=f"Nombre  *  Sábados: {sab}, Domingos: {dom}, Feriados: {fer}")
 
-            for r, n in funcionarios:
-                if r not in ruts: continue
-                vals = [n, r]
-                for d in date_list:
-                    estado, obs_ing = _estado_y_obs_en_fecha(con, r, d, salida_aut_set)
-                    if estado == "OK":
-                        vals.append("✓●" if obs_ing else "✓")
-                    elif estado == "SI":
-                        vals.append("S/I")
-                    elif estado == "PS":
-                        vals.append("P/S")
-                    else:
-                        vals.append("-")
-                tabla.insert("", "end", values=vals)
+            for i, (r, n) in enumerate(matriz.funcionarios):
+                tabla.insert("", "end", values=[n, r] + [TEXTO_CELDA[f] for f in matriz.flags(i)])
 
+            tabla._matriz = matriz                # type: ignore
             tabla._date_list = date_list          # type: ignore
             tabla._period_text = period_text      # type: ignore
             tabla._day_types = day_types          # type: ignore
@@ -541,11 +493,9 @@ def abrir_asistencia_diaria(app_root, db_path: str):
             nombre = row["nombre"]; rut = row["rut"]
             cargo = ""
             try:
-                conx = sqlite3.connect(db_path)
+                conx = conectar(db_path)
                 curx = conx.cursor()
-                curx.execute("PRAGMA table_info(trabajadores)")
-                cols = {c[1].lower() for c in curx.fetchall()}
-                if "profesion" in cols:
+                if capacidades(db_path).tiene_columna("trabajadores", "profesion"):
                     curx.execute("SELECT profesion FROM trabajadores WHERE rut = ?", (rut,))
                     r = curx.fetchone()
                     if r and r[0]: cargo = str(r[0])
@@ -669,6 +619,10 @@ def abrir_asistencia_diaria(app_root, db_path: str):
         rows = tabla.get_children()
         if not rows: return None
         period_text = getattr(tabla, "_period_text", None)
+        matriz = getattr(tabla, "_matriz", None)
+        if matriz is not None and period_text:
+            # Misma matriz de la vista previa: sin volver a consultar ni leer celdas
+            return matriz.filas(), period_text, matriz.date_list, matriz.day_types
         date_list = getattr(tabla, "_date_list", None)
         day_types = getattr(tabla, "_day_types", None)
 
@@ -677,14 +631,7 @@ def abrir_asistencia_diaria(app_root, db_path: str):
             s, e, last_day = _mes_range(y, m)
             date_list = [dt.date(y, m, d) for d in range(1, last_day+1)]
             period_text = f"{MESES_ES[m]} {y}"
-            set_fer = _feriados_set_range(con, date_list[0], date_list[-1])
-            day_types = []
-            for d in date_list:
-                f_iso = d.strftime("%Y-%m-%d")
-                if f_iso in set_fer: day_types.append("F")
-                else:
-                    wd = d.weekday()
-                    day_types.append("S" if wd==5 else ("D" if wd==6 else "N"))
+            day_types = _day_types(date_list, _feriados_set_range(date_list[0], date_list[-1]))
 
         data = []
         for iid in rows:
@@ -808,14 +755,26 @@ def abrir_asistencia_diaria(app_root, db_path: str):
             html_body = _html_email_asistencia(period_text, data, day_types)
             subject   = f"Asistencia diaria – {period_text}"
 
-            ok = _send_email_pdf_bioaccess(to_list, cc_list, subject, text_body, html_body, path)
-            if ok:
+            def enviado(_=None):
                 messagebox.showinfo("Enviar", "Reporte enviado correctamente.")
                 try:
                     dlg.destroy()
                 except Exception:
                     pass
 
+            def fallo(e):
+                btn_send2.configure(state="normal")
+                messagebox.showerror("Correo", f"No fue posible enviar el correo:\n{e}")
+
+            if not USAR_SMTP:
+                if _send_email_pdf_bioaccess(to_list, cc_list, subject, text_body, html_body, path):
+                    enviado()
+                return
+            # SMTP en un trabajador: la ventana sigue respondiendo
+            btn_send2.configure(state="disabled")
+            ejecutar(_smtp_enviar_pdf, to_list, cc_list, subject, text_body, html_body, path,
+                     al_terminar=enviado, al_fallar=fallo, ambito=dlg, nombre="enviar_asistencia")
+
         btn_send2.configure(command=do_send_now)
 
         # Centrar
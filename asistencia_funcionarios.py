@@ -1,6 +1,6 @@
 # asistencia_funcionarios.py
 import os
-import sqlite3
+from db import conectar
 import calendar
 import datetime as dt
 import tkinter as tk
@@ -502,7 +502,7 @@ def abrir_asistencia(app_root, db_path: str, *, default_todos: bool = False):
     fila1.grid_columnconfigure(1, weight=1)
     fila1.grid_columnconfigure(3, weight=1)
 
-    con = sqlite3.connect(db_path)
+    con = conectar(db_path)
     funcionarios = _leer_funcionarios(con)
     listado = [f"{n} | {r}" for (r, n, _c) in funcionarios]
     combo_func.configure(values=listado if listado else ["(Sin registros)"])
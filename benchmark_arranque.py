@@ -0,0 +1,202 @@
+# benchmark_arranque.py
+"""
+Benchmark de arranque en frío (sin interacción) para BioAccess.
+
+Mide, y deja en JSON para comparar entre versiones:
+  - tiempo de importación de cada pantalla, cada una en un proceso limpio
+    (así pandas/reportlab/dlib se cargan a la cuenta de quien los trae),
+  - crear_bd sobre la base real,
+  - construcción de cada frame construir_* en una ventana oculta,
+  - tiempo hasta la "ventana lista" (CTk + crear_bd + Ingreso/Salida dibujado),
+  - tiempo total y RSS pico.
+
+Uso:
+    python benchmark_arranque.py                  # JSON a stdout
+    python benchmark_arranque.py --salida bench.json
+    python benchmark_arranque.py --sin-frames     # solo imports + crear_bd (CI sin pantalla)
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import importlib
+import subprocess
+
+T0 = time.perf_counter()
+
+
+def _base_dir():
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+BASE = _base_dir()
+DB_PATH = os.path.join(BASE, "reloj_control.db")
+
+# Pantallas tal como las abre principal.py: (módulo, función, kwargs extra)
+PANTALLAS = [
+    ("ingreso_salida", "construir_ingreso_salida", {}),
+    ("registrar", "construir_registro", {"on_guardado": lambda: None}),
+    ("reportes", "construir_reportes", {}),
+    ("nomina", "construir_nomina", {}),
+    ("editar_usuario", "construir_edicion", {"on_actualizacion": None, "on_volver_inicio": None}),
+    ("solicitudes", "construir_solicitudes", {"on_volver": None}),
+    ("dia_administrativo", "construir_dia_administrativo", {}),
+    ("panel_avanzado", "construir_panel_avanzado", {}),
+    ("resumen_dia", "construir_resumen_dia", {}),
+]
+
+
+# ============== MEMORIA ==============
+def rss_pico_mb():
+    """RSS pico del proceso en MB (None si la plataforma no lo expone)."""
+    try:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux: KB; macOS: bytes
+        return round(pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024, 1)
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class _PMC(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        pmc = _PMC()
+        pmc.cb = ctypes.sizeof(_PMC)
+        proc = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(proc, ctypes.byref(pmc), pmc.cb):
+            return round(pmc.PeakWorkingSetSize / (1024 * 1024), 1)
+    except Exception:
+        pass
+    return None
+
+
+# ============== IMPORTS AISLADOS ==============
+def _importar_y_medir(modulo: str) -> dict:
+    """Se ejecuta en el proceso hijo: importa 'modulo' y devuelve tiempos."""
+    antes = set(sys.modules)
+    t = time.perf_counter()
+    error = None
+    try:
+        importlib.import_module(modulo)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    dt = time.perf_counter() - t
+    pesados = sorted(m for m in ("cv2", "dlib", "face_recognition", "pandas", "reportlab",
+                                 "matplotlib", "numpy", "tkcalendar", "PyPDF2")
+                     if m in sys.modules and m not in antes)
+    return {"modulo": modulo, "import_s": round(dt, 4), "rss_pico_mb": rss_pico_mb(),
+            "modulos_cargados": len(sys.modules) - len(antes), "pesados": pesados, "error": error}
+
+def medir_imports(modulos) -> list:
+    """Cada import en un intérprete nuevo para que el costo no se reparta entre pantallas."""
+    resultados = []
+    for mod in modulos:
+        try:
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--importar", mod],
+                                 cwd=BASE, capture_output=True, text=True, timeout=300)
+            linea = [l for l in out.stdout.splitlines() if l.startswith("{")][-1]
+            resultados.append(json.loads(linea))
+        except Exception as e:
+            resultados.append({"modulo": mod, "import_s": None, "error": f"{type(e).__name__}: {e}"})
+    return resultados
+
+
+# ============== CREAR_BD + FRAMES ==============
+def medir_crear_bd() -> dict:
+    from db import crear_bd
+    t = time.perf_counter()
+    crear_bd(DB_PATH)
+    return {"crear_bd_s": round(time.perf_counter() - t, 4)}
+
+def medir_frames() -> dict:
+    """Construye cada pantalla en una ventana oculta (sin mainloop)."""
+    try:
+        import customtkinter as ctk
+        app = ctk.CTk()
+        app.withdraw()
+    except Exception as e:
+        return {"error": f"sin pantalla: {type(e).__name__}: {e}", "frames": []}
+
+    frames = []
+    ventana_lista_s = None
+    for modulo, funcion, kwargs in PANTALLAS:
+        cont = ctk.CTkFrame(app)
+        cont.pack(fill="both", expand=True)
+        t = time.perf_counter()
+        error = None
+        try:
+            getattr(importlib.import_module(modulo), funcion)(cont, **kwargs)
+            app.update_idletasks()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        dt = time.perf_counter() - t
+        if modulo == "ingreso_salida":
+            # Lo que ve el usuario al abrir principal.py: ventana + pantalla inicial
+            ventana_lista_s = round(time.perf_counter() - T0, 4)
+        frames.append({"modulo": modulo, "funcion": funcion, "construir_s": round(dt, 4), "error": error})
+        try:
+            cont.destroy()
+        except Exception:
+            pass
+    try:
+        app.destroy()
+    except Exception:
+        pass
+    return {"ventana_lista_s": ventana_lista_s, "frames": frames}
+
+
+# ============== CHEQUEOS EXTRA ==============
+def ejecutar_chequeos() -> dict:
+    """Chequeos de regresión baratos que conviene registrar junto al benchmark."""
+    from db import verificar_planes
+    planes = verificar_planes(DB_PATH)
+    return {"planes_ok": all(p["ok"] for p in planes.values()), "planes": planes}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark de arranque de BioAccess")
+    ap.add_argument("--importar", help=argparse.SUPPRESS)
+    ap.add_argument("--salida", help="archivo JSON de salida (por defecto stdout)")
+    ap.add_argument("--sin-frames", action="store_true", help="no construir pantallas (sin display)")
+    args = ap.parse_args(argv)
+
+    sys.path.insert(0, BASE)
+    os.chdir(BASE)   # igual que principal.py (rutas relativas a reloj_control.db)
+
+    if args.importar:
+        print(json.dumps(_importar_y_medir(args.importar)), flush=True)
+        return 0
+
+    informe = {
+        "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "imports": medir_imports([m for m, _f, _k in PANTALLAS]),
+    }
+    informe.update(medir_crear_bd())
+    informe.update({"pantallas": {"omitidas": True}} if args.sin_frames else {"pantallas": medir_frames()})
+    informe["chequeos"] = ejecutar_chequeos()
+    informe["total_s"] = round(time.perf_counter() - T0, 4)
+    informe["rss_pico_mb"] = rss_pico_mb()
+
+    texto = json.dumps(informe, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto)
+        print(f"✅ Benchmark guardado en {args.salida}")
+    else:
+        print(texto)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
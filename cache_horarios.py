@@ -0,0 +1,232 @@
+# cache_horarios.py
+"""
+Horarios semanales compilados en memoria.
+
+Se lee la tabla horarios UNA vez y cada semana queda como, por persona y día,
+una tupla de bloques en minutos desde medianoche, ordenados por inicio. Un
+bloque nocturno (salida < entrada) termina al día siguiente: fin = salida + 1440.
+
+Consultas (todas sin tocar la BD):
+  bloques(rut, dia)                 -> tupla de Bloque
+  entrada_esperada(rut, dia)        -> 'HH:MM' del primer bloque
+  salida_esperada(rut, dia)         -> 'HH:MM' de fin de jornada (último bloque)
+  entrada_mas_cercana(rut, dia, h)  -> 'HH:MM' del bloque cuya entrada está más cerca de h
+  bloque_en(rut, dia, h)            -> Bloque que contiene la hora h (o None)
+  minutos_programados(rut, dia)     -> suma de minutos de los bloques
+
+'dia' puede ser date/datetime, 'YYYY-MM-DD', número de día (0=lunes) o el
+nombre en español ("Miércoles", "miercoles", ...).
+
+Quien escribe en horarios (registrar, editar_usuario) llama a invalidar_horarios().
+"""
+import threading
+import unicodedata
+from datetime import date, datetime
+
+from db import conectar, capacidades
+
+DIAS_ES = ("lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo")
+_MIN_DIA = 24 * 60
+
+
+def clave_rut(rut) -> str:
+    """RUT sin puntos/guion/espacios y en mayúsculas (mismo criterio que los REPLACE en SQL)."""
+    return "".join(ch for ch in str(rut or "") if ch not in ".- ").upper()
+
+def _sin_tildes(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn")
+
+def indice_dia(dia) -> int:
+    if isinstance(dia, (date, datetime)):
+        return dia.weekday()
+    if isinstance(dia, int):
+        return dia % 7
+    s = str(dia or "").strip()
+    if len(s) >= 10 and s[4] == "-" and s[7] == "-":
+        return datetime.strptime(s[:10], "%Y-%m-%d").weekday()
+    return DIAS_ES.index(_sin_tildes(s).lower())
+
+def a_minutos(hora):
+    """'H:MM', 'HH:MM' o 'HH:MM:SS' -> minutos desde medianoche (None si no es hora válida)."""
+    if hora is None:
+        return None
+    if isinstance(hora, (datetime,)):
+        return hora.hour * 60 + hora.minute
+    partes = str(hora).strip().split(":")
+    if len(partes) < 2:
+        return None
+    try:
+        h, m = int(partes[0]), int(partes[1])
+    except ValueError:
+        return None
+    if not (0 <= h < 24 and 0 <= m < 60):
+        return None
+    return h * 60 + m
+
+def a_segundos(hora):
+    """'H:MM', 'HH:MM' o 'HH:MM:SS' -> segundos desde medianoche (None si no es hora válida).
+
+    Mismo criterio que db._sql_segundos (registros.seg_ingreso/seg_salida); solo para
+    horas que no vienen de la BD.
+    """
+    m = a_minutos(hora)
+    if m is None:
+        return None
+    partes = str(hora).strip().split(":")
+    try:
+        s = int(partes[2]) if len(partes) > 2 else 0
+    except ValueError:
+        return None
+    return m * 60 + s if 0 <= s < 60 else None
+
+def a_texto(minutos: int) -> str:
+    minutos %= _MIN_DIA
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+
+class Bloque:
+    __slots__ = ("inicio", "fin", "turno")
+
+    def __init__(self, inicio: int, fin: int, turno: str = ""):
+        self.inicio = inicio        # minutos desde medianoche
+        self.fin = fin              # > inicio; +1440 si cruza medianoche
+        self.turno = turno
+
+    @property
+    def entrada(self) -> str:
+        return a_texto(self.inicio)
+
+    @property
+    def salida(self) -> str:
+        return a_texto(self.fin)
+
+    @property
+    def minutos(self) -> int:
+        return self.fin - self.inicio
+
+    @property
+    def nocturno(self) -> bool:
+        return self.fin > _MIN_DIA
+
+    def contiene(self, minuto: int) -> bool:
+        return self.inicio <= minuto <= self.fin or self.inicio <= minuto + _MIN_DIA <= self.fin
+
+    def __iter__(self):
+        # Compatibilidad con el código que desempaqueta (entrada, salida)
+        return iter((self.entrada, self.salida))
+
+    def __repr__(self):
+        return f"Bloque({self.entrada}-{self.salida})"
+
+
+_SIN_BLOQUES = ()
+
+
+class CacheHorarios:
+    def __init__(self, db_path=None):
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        self._semanas = None         # {clave_rut: [tupla de Bloque por día] x 7}
+        self.version = 0
+
+    # ---------- compilación ----------
+    def _compilar(self):
+        con = conectar(self._db_path)
+        try:
+            cur = con.cursor()
+            cap = capacidades(self._db_path)
+            sel_turno = "IFNULL(turno,'')" if cap.tiene_columna("horarios", "turno") else "''"
+            # min_entrada/min_salida: minutos ya calculados por la BD (db.HORAS_ENTERAS)
+            sel_min = "min_entrada, min_salida" if cap.tiene_columna("horarios", "min_entrada") else "NULL, NULL"
+            filas = cur.execute(f"SELECT rut, dia, hora_entrada, hora_salida, {sel_turno}, {sel_min} FROM horarios").fetchall()
+        finally:
+            con.close()
+
+        semanas = {}
+        for rut, dia, he, hs, turno, m_ent, m_sal in filas:
+            ini = m_ent if m_ent is not None else a_minutos(he)
+            fin = m_sal if m_sal is not None else a_minutos(hs)
+            if ini is None or fin is None:
+                continue
+            try:
+                d = indice_dia(dia)
+            except ValueError:
+                continue
+            if fin < ini:
+                fin += _MIN_DIA
+            semana = semanas.setdefault(clave_rut(rut), [[] for _ in range(7)])
+            semana[d].append(Bloque(ini, fin, turno or ""))
+        for semana in semanas.values():
+            for d in range(7):
+                semana[d] = tuple(sorted(semana[d], key=lambda b: (b.inicio, b.fin)))
+        return semanas
+
+    def _semanas_listas(self):
+        semanas = self._semanas
+        if semanas is None:
+            with self._lock:
+                if self._semanas is None:
+                    self._semanas = self._compilar()
+                    self.version += 1
+                semanas = self._semanas
+        return semanas
+
+    def invalidar(self):
+        with self._lock:
+            self._semanas = None
+
+    # ---------- consultas ----------
+    def tiene_horario(self, rut) -> bool:
+        return clave_rut(rut) in self._semanas_listas()
+
+    def bloques(self, rut, dia) -> tuple:
+        semana = self._semanas_listas().get(clave_rut(rut))
+        return semana[indice_dia(dia)] if semana else _SIN_BLOQUES
+
+    def entrada_esperada(self, rut, dia):
+        b = self.bloques(rut, dia)
+        return b[0].entrada if b else None
+
+    def salida_esperada(self, rut, dia):
+        """Fin de jornada: la salida más tardía del día (considera nocturnos)."""
+        b = self.bloques(rut, dia)
+        return max(b, key=lambda x: x.fin).salida if b else None
+
+    def entrada_mas_cercana(self, rut, dia, hora):
+        b = self.bloques(rut, dia)
+        if not b:
+            return None
+        m = a_minutos(hora)
+        if m is None:
+            return b[0].entrada
+        return min(b, key=lambda x: abs(x.inicio - m)).entrada
+
+    def bloque_en(self, rut, dia, hora):
+        m = a_minutos(hora)
+        if m is None:
+            return None
+        for b in self.bloques(rut, dia):
+            if b.contiene(m):
+                return b
+        return None
+
+    def minutos_programados(self, rut, dia) -> int:
+        return sum(b.minutos for b in self.bloques(rut, dia))
+
+
+# ============== INSTANCIA COMPARTIDA ==============
+_cache = None
+_cache_lock = threading.Lock()
+
+def obtener_horarios() -> CacheHorarios:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheHorarios()
+    return _cache
+
+def invalidar_horarios():
+    """Llamar después de escribir en la tabla horarios."""
+    if _cache is not None:
+        _cache.invalidar()
@@ -1,5 +1,5 @@
 import tkinter as tk
-import sqlite3
+from db import conectar
 from tkinter import messagebox
 
 def abrir_cambio_clave():
@@ -34,7 +34,7 @@ def abrir_cambio_clave():
             messagebox.showerror("Error", "Las nuevas claves no coinciden.")
             return
 
-        conexion = sqlite3.connect("reloj_control.db")
+        conexion = conectar()
         cursor = conexion.cursor()
         cursor.execute("SELECT * FROM admins WHERE rut = ? AND clave = ?", (rut, clave_actual))
         admin = cursor.fetchone()
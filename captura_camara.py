@@ -0,0 +1,392 @@
+# captura_camara.py
+"""
+Captura de cámara en segundo plano desacoplada del reconocimiento y la vista previa.
+
+  - LectorCamara: hilo que solo hace cap.read() y deja los últimos cuadros en
+    un buffer circular pequeño (los cuadros viejos se pisan, nunca se encolan).
+  - TrabajadorReconocimiento: hilo que siempre toma el cuadro MÁS RECIENTE y
+    ejecuta la función de reconocimiento; si el encoder es lento, los cuadros
+    intermedios se descartan en vez de acumular retraso.
+  - La vista previa (cv2.imshow) la dibuja el llamador a su propio ritmo con
+    LectorCamara.ultimo() + el último resultado del trabajador.
+
+EstadisticasCaptura lleva contadores de cuadros capturados, descartados y
+reconocidos (totales y por segundo).
+
+GestorCamara mantiene UNA cámara abierta y "caliente" mientras la pantalla de
+Ingreso/Salida está visible: recuerda el último índice/backend que funcionó
+(también entre ejecuciones) y entrega su LectorCamara a cada verificación, de
+modo que el costo por persona es solo el del reconocimiento.
+"""
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+
+from carga_diferida import CAPTURA
+
+BUFFER_CUADROS = 2
+CUADROS_CALENTAMIENTO = 12   # cuadros a descartar tras abrir el dispositivo
+
+
+class EstadisticasCaptura:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.t0 = time.time()
+        self.capturados = 0
+        self.descartados = 0
+        self.reconocidos = 0
+
+    def sumar(self, capturados=0, descartados=0, reconocidos=0):
+        with self._lock:
+            self.capturados += capturados
+            self.descartados += descartados
+            self.reconocidos += reconocidos
+
+    def por_segundo(self):
+        """(capturados/s, descartados/s, reconocidos/s) desde el inicio."""
+        with self._lock:
+            dt = max(1e-6, time.time() - self.t0)
+            return (self.capturados / dt, self.descartados / dt, self.reconocidos / dt)
+
+    def resumen(self) -> str:
+        cap, desc, rec = self.por_segundo()
+        return (f"capturados={self.capturados} ({cap:.1f}/s) | "
+                f"descartados={self.descartados} ({desc:.1f}/s) | "
+                f"reconocidos={self.reconocidos} ({rec:.1f}/s)")
+
+
+class LectorCamara(threading.Thread):
+    """Hilo lector: mantiene solo los últimos BUFFER_CUADROS cuadros."""
+
+    def __init__(self, cap, stats: EstadisticasCaptura | None = None, tam_buffer: int = BUFFER_CUADROS):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.stats = stats or EstadisticasCaptura()
+        self._suscriptores = [self.stats]
+        self._buffer = deque(maxlen=max(1, tam_buffer))
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._detener = threading.Event()
+
+    def run(self):
+        while not self._detener.is_set():
+            try:
+                ret, frame = self.cap.read()
+            except Exception:
+                ret, frame = False, None
+            if not ret or frame is None:
+                time.sleep(0.01)
+                continue
+            with self._cond:
+                self._seq += 1
+                self._buffer.append((self._seq, frame))
+                self._cond.notify_all()
+            for st in list(self._suscriptores):
+                st.sumar(capturados=1)
+
+    def suscribir(self, stats: EstadisticasCaptura):
+        """Cuenta también los cuadros capturados en 'stats' (p.ej. estadísticas por sesión)."""
+        self._suscriptores.append(stats)
+
+    def desuscribir(self, stats: EstadisticasCaptura):
+        try:
+            self._suscriptores.remove(stats)
+        except ValueError:
+            pass
+
+    @property
+    def seq(self) -> int:
+        with self._cond:
+            return self._seq
+
+    def esperar_cuadros(self, n: int, timeout: float = 3.0) -> bool:
+        """Espera a que el lector haya capturado al menos n cuadros (calentamiento)."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq >= n or self._detener.is_set(), timeout=timeout) \
+                and self._seq >= n
+
+    def detener(self, timeout: float = 1.0):
+        self._detener.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def ultimo(self):
+        """(seq, frame) más reciente o (0, None) si aún no hay cuadros."""
+        with self._cond:
+            return self._buffer[-1] if self._buffer else (0, None)
+
+    def esperar_nuevo(self, despues_de: int, timeout: float = 0.5):
+        """Bloquea hasta que exista un cuadro con seq > despues_de; devuelve el más reciente."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._detener.is_set() or (self._buffer and self._buffer[-1][0] > despues_de),
+                timeout=timeout,
+            )
+            if self._buffer and self._buffer[-1][0] > despues_de:
+                return self._buffer[-1]
+            return despues_de, None
+
+
+class TrabajadorReconocimiento(threading.Thread):
+    """
+    Consume siempre el cuadro más nuevo del lector y ejecuta procesar(frame).
+    El último valor devuelto queda disponible en ultimo_resultado().
+    """
+
+    def __init__(self, lector: LectorCamara, procesar, stats: EstadisticasCaptura | None = None):
+        super().__init__(daemon=True)
+        self.lector = lector
+        self.stats = stats or lector.stats
+        self.procesar = procesar
+        self.resultado = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+
+    def run(self):
+        ult_seq = self.lector.seq
+        while not self._detener.is_set():
+            seq, frame = self.lector.esperar_nuevo(ult_seq, timeout=0.2)
+            if frame is None:
+                continue
+            if ult_seq and seq > ult_seq + 1:
+                self.stats.sumar(descartados=seq - ult_seq - 1)
+            ult_seq = seq
+            try:
+                r = self.procesar(frame)
+            except Exception as e:
+                self.error = e
+                break
+            with self._lock:
+                self.resultado = r
+            self.stats.sumar(reconocidos=1)
+
+    def ultimo_resultado(self):
+        with self._lock:
+            return self.resultado
+
+    def detener(self, timeout: float = 2.0):
+        self._detener.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+
+class SesionCaptura:
+    """
+    Arranca/detiene un trabajador de reconocimiento sobre una cámara.
+    'fuente' puede ser un cv2.VideoCapture abierto (se crea un lector propio)
+    o un LectorCamara ya activo (p.ej. el de GestorCamara), que no se detiene.
+    """
+
+    def __init__(self, fuente, procesar, tam_buffer: int = BUFFER_CUADROS):
+        self.stats = EstadisticasCaptura()
+        if isinstance(fuente, LectorCamara):
+            self.lector, self._lector_propio = fuente, False
+        else:
+            self.lector, self._lector_propio = LectorCamara(fuente, tam_buffer=tam_buffer), True
+        self.trabajador = TrabajadorReconocimiento(self.lector, procesar, self.stats)
+
+    def iniciar(self):
+        self.lector.suscribir(self.stats)
+        if self._lector_propio:
+            self.lector.start()
+        self.trabajador.start()
+        return self
+
+    def detener(self):
+        self.trabajador.detener()
+        self.lector.desuscribir(self.stats)
+        if self._lector_propio:
+            self.lector.detener()
+
+    def cuadro_preview(self):
+        """Copia del cuadro más reciente para dibujar encima (o None)."""
+        _seq, frame = self.lector.ultimo()
+        return None if frame is None else frame.copy()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+        return False
+
+
+# ============== APERTURA DE DISPOSITIVO ==============
+def _base_dir():
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+CONFIG_CAMARA_PATH = os.path.join(_base_dir(), "camara.json")
+
+def _cv2():
+    """OpenCV se importa en segundo plano (carga_diferida); aquí se espera si aún no está."""
+    return CAPTURA.obtener()
+
+def _backends():
+    cv2 = _cv2()
+    try:
+        return [cv2.CAP_DSHOW, cv2.CAP_MSMF, cv2.CAP_VFW, cv2.CAP_ANY]
+    except Exception:
+        return [cv2.CAP_ANY]
+
+def _intentar(indice: int, backend):
+    cv2 = _cv2()
+    try:
+        cap = cv2.VideoCapture(indice, backend)
+    except TypeError:
+        cap = cv2.VideoCapture(indice)
+    if cap is not None and cap.isOpened():
+        try:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        except Exception:
+            pass
+        return cap
+    if cap is not None:
+        cap.release()
+    return None
+
+def abrir_camara(max_index: int = 2, preferida=None):
+    """
+    Abre la cámara probando primero 'preferida' (indice, backend) y luego
+    índices 0..max_index x backends. Devuelve (cap, (indice, backend), detalle).
+    """
+    errores = []
+    candidatos = []
+    if preferida:
+        candidatos.append(tuple(preferida))
+    for i in range(0, max_index + 1):
+        for be in _backends():
+            if (i, be) not in candidatos:
+                candidatos.append((i, be))
+    for i, be in candidatos:
+        cap = _intentar(i, be)
+        if cap is not None:
+            print(f"[cam] OK index={i} backend={be}", flush=True)
+            return cap, (i, be), f"index={i}, backend={be}"
+        errores.append(f"falló index={i}, backend={be}")
+    detalle = "; ".join(errores) if errores else "no backends probados"
+    print("[cam] No se pudo abrir cámara:", detalle, flush=True)
+    return None, None, detalle
+
+
+# ============== GESTOR DE CÁMARA (sesión caliente) ==============
+class GestorCamara:
+    def __init__(self, config_path: str = CONFIG_CAMARA_PATH):
+        self.config_path = config_path
+        self._lock = threading.RLock()
+        self._cap = None
+        self._lector = None
+        self._usos = 0
+        self._mantener = False
+        self.preferida = self._leer_preferida()
+        self.detalle = ""
+
+    # ---------- persistencia de índice/backend ----------
+    def _leer_preferida(self):
+        try:
+            with open(self.config_path, "r", encoding="utf-8") as f:
+                d = json.load(f)
+            return (int(d["indice"]), int(d["backend"]))
+        except Exception:
+            return None
+
+    def _guardar_preferida(self, pref):
+        if pref == self.preferida:
+            return
+        self.preferida = pref
+        try:
+            with open(self.config_path, "w", encoding="utf-8") as f:
+                json.dump({"indice": pref[0], "backend": pref[1]}, f)
+        except Exception:
+            pass
+
+    # ---------- ciclo de vida ----------
+    def abierta(self) -> bool:
+        with self._lock:
+            return self._lector is not None and self._lector.is_alive()
+
+    def abrir(self):
+        """Abre (si hace falta) y deja el lector corriendo. Devuelve el LectorCamara o None."""
+        with self._lock:
+            if self.abierta():
+                return self._lector
+            self._cerrar()
+            cap, pref, self.detalle = abrir_camara(preferida=self.preferida)
+            if cap is None:
+                return None
+            self._guardar_preferida(pref)
+            self._cap = cap
+            self._lector = LectorCamara(cap)
+            self._lector.start()
+            return self._lector
+
+    def _cerrar(self):
+        if self._lector is not None:
+            self._lector.detener()
+            self._lector = None
+        if self._cap is not None:
+            try:
+                self._cap.release()
+            except Exception:
+                pass
+            self._cap = None
+
+    def liberar(self):
+        with self._lock:
+            self._cerrar()
+
+    def mantener_abierta(self, activo: bool):
+        """
+        True: abre en segundo plano y mantiene la cámara caliente (pantalla visible).
+        False: la libera en cuanto no haya verificaciones en curso.
+        """
+        with self._lock:
+            self._mantener = activo
+            if not activo and self._usos == 0:
+                self._cerrar()
+        if activo:
+            threading.Thread(target=self._abrir_en_segundo_plano, daemon=True).start()
+
+    def _abrir_en_segundo_plano(self):
+        try:
+            self.abrir()
+        except Exception as e:
+            print(f"[cam] no se pudo preparar la cámara: {e}", flush=True)
+
+    def adquirir(self, calentamiento: int = CUADROS_CALENTAMIENTO):
+        """
+        Entrega el lector listo para usar (abre y calienta si no estaba abierto).
+        Devuelve (lector, detalle); lector=None si no se pudo abrir. Llamar soltar() al terminar.
+        """
+        with self._lock:
+            lector = self.abrir()
+            if lector is None:
+                return None, self.detalle
+            self._usos += 1
+        lector.esperar_cuadros(calentamiento)
+        return lector, self.detalle
+
+    def soltar(self):
+        with self._lock:
+            self._usos = max(0, self._usos - 1)
+            if self._usos == 0 and not self._mantener:
+                self._cerrar()
+
+
+_gestor = None
+_gestor_lock = threading.Lock()
+
+def obtener_gestor_camara() -> GestorCamara:
+    global _gestor
+    with _gestor_lock:
+        if _gestor is None:
+            _gestor = GestorCamara()
+        return _gestor
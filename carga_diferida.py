@@ -0,0 +1,140 @@
+# carga_diferida.py
+"""
+Carga diferida de las pilas pesadas (dlib/face_recognition/OpenCV y pandas/reportlab).
+
+La ventana principal se muestra sin importar nada de esto; principal.py llama a
+iniciar_precarga() y las pilas se importan en un hilo en segundo plano. Quien
+las necesite antes de tiempo llama a .obtener(), que espera a que terminen.
+
+  BIOMETRIA.obtener() -> (cv2, face_recognition)
+  CAPTURA.obtener()   -> cv2 (solo captura/vista previa)
+  REPORTES.obtener()  -> (pandas | None, reportlab_ok: bool)
+
+Con el servidor de reconocimiento lanzado (servidor_reconocimiento.py) la UI carga
+solo CAPTURA: dlib, face_recognition y la galería viven en ese proceso. BIOMETRIA
+se carga en la UI únicamente cuando se reconoce en el mismo proceso.
+
+Estado visible para la UI: <carga>.estado in {"pendiente", "cargando", "listo", "error"}.
+"""
+import os
+import sys
+import shutil
+import threading
+import time
+
+
+class CargaDiferida:
+    def __init__(self, nombre: str, cargador):
+        self.nombre = nombre
+        self._cargador = cargador
+        self._lock = threading.Lock()
+        self._listo = threading.Event()
+        self._hilo = None
+        self.estado = "pendiente"
+        self.valor = None
+        self.error = None
+        self.segundos = None
+
+    def _ejecutar(self):
+        t0 = time.perf_counter()
+        try:
+            self.valor = self._cargador()
+            self.estado = "listo"
+        except Exception as e:
+            self.error = e
+            self.estado = "error"
+            print(f"[carga] {self.nombre}: error {e}", flush=True)
+        finally:
+            self.segundos = time.perf_counter() - t0
+            if self.estado == "listo":
+                print(f"[carga] {self.nombre} listo en {self.segundos:.2f}s", flush=True)
+            self._listo.set()
+
+    def iniciar(self):
+        """Lanza la carga en segundo plano (idempotente)."""
+        with self._lock:
+            if self._hilo is None:
+                self.estado = "cargando"
+                self._hilo = threading.Thread(target=self._ejecutar, daemon=True,
+                                              name=f"carga-{self.nombre}")
+                self._hilo.start()
+        return self
+
+    def listo(self) -> bool:
+        return self._listo.is_set() and self.estado == "listo"
+
+    def esperar(self, timeout: float | None = None) -> bool:
+        self.iniciar()
+        return self._listo.wait(timeout)
+
+    def obtener(self):
+        """Espera (si hace falta) y devuelve el valor cargado; relanza el error si falló."""
+        self.esperar()
+        if self.error is not None:
+            raise self.error
+        return self.valor
+
+
+# ============== CARGADORES ==============
+def _base_dir():
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+def _preparar_modelos_dlib():
+    """Copia los modelos de landmarks a %TEMP% si hace falta (antes se hacía al importar ingreso_salida)."""
+    modelos_dir = os.path.join(_base_dir(), "face_recognition_models", "models")
+    destino_dir = os.path.join(os.environ.get("TEMP", ""), "face_recognition_models", "models")
+    try:
+        os.makedirs(destino_dir, exist_ok=True)
+        for nombre in ("shape_predictor_68_face_landmarks.dat", "shape_predictor_5_face_landmarks.dat"):
+            origen = os.path.join(modelos_dir, nombre)
+            destino = os.path.join(destino_dir, nombre)
+            if os.path.exists(origen) and not os.path.exists(destino):
+                shutil.copy(origen, destino)
+    except Exception as e:
+        print("Aviso: no se pudo copiar a TEMP:", e)
+
+def _cargar_captura():
+    os.environ.setdefault("OPENCV_VIDEOIO_PRIORITY_MSMF", "0")
+    os.environ.setdefault("OPENCV_LOG_LEVEL", "SILENT")
+    import cv2
+    return cv2
+
+def _cargar_biometria():
+    _preparar_modelos_dlib()
+    cv2 = CAPTURA.obtener()
+    import dlib  # noqa: F401  (lo carga face_recognition; explícito para el empaquetado)
+    import face_recognition
+    # Índice de rostros listo para el primer marcaje
+    from galeria_rostros import obtener_galeria
+    obtener_galeria().sincronizar()
+    return cv2, face_recognition
+
+def _cargar_reportes():
+    try:
+        import pandas as pd
+    except Exception:
+        pd = None
+    try:
+        import reportlab.platypus  # noqa: F401
+        reportlab_ok = True
+    except Exception:
+        reportlab_ok = False
+    return pd, reportlab_ok
+
+
+CAPTURA = CargaDiferida("captura", _cargar_captura)
+BIOMETRIA = CargaDiferida("motor biométrico", _cargar_biometria)
+REPORTES = CargaDiferida("reportes", _cargar_reportes)
+
+
+def iniciar_precarga(biometria: bool = True):
+    """
+    Primero el motor biométrico (lo usa la pantalla inicial), luego pandas/reportlab.
+    biometria=False (reconocimiento en el servidor aparte): solo OpenCV para la cámara.
+    """
+    def _secuencia():
+        (BIOMETRIA if biometria else CAPTURA).iniciar().esperar()
+        REPORTES.iniciar()
+    threading.Thread(target=_secuencia, daemon=True, name="precarga").start()
@@ -0,0 +1,147 @@
+# condensacion_plantillas.py
+"""
+Condensación de plantillas: cada persona queda con a lo más K_PLANTILLAS
+encodings representativos.
+
+enrolar_funcionaria agrega muestras separadas por una distancia mínima y
+editar_usuario agrega encodings a los existentes, así que con el tiempo algunas
+personas acumulan decenas de vectores casi iguales que encarecen cada búsqueda 1:N.
+
+Por persona:
+  1) se descartan las muestras casi idénticas a una ya aceptada (DISTANCIA_DUPLICADO,
+     mismo criterio que enrolar_funcionaria);
+  2) si aún quedan más de k, se agrupan con k-medoides (inicio por punto más lejano,
+     luego iteración de Voronoi) y se guardan solo los medoides: muestras reales,
+     no promedios, que cubren las variantes de luz/ángulo de la persona.
+
+Corre sola después de cada enrolamiento (GaleriaRostros.guardar_rut) y a pedido:
+    python condensacion_plantillas.py               # condensa toda la galería
+    python condensacion_plantillas.py --k 6 --simular
+"""
+import sys
+import argparse
+
+import numpy as np
+
+from almacen_plantillas import AlmacenPlantillas, ENCODING_DIM, a_matriz
+
+K_PLANTILLAS = 8             # = N_TARGET de enrolar_funcionaria
+DISTANCIA_DUPLICADO = 0.36   # = DEDUP_DISTANCE de enrolar_funcionaria
+ITERACIONES = 10
+
+
+# ============== ALGORITMO ==============
+def _distancias(m: np.ndarray) -> np.ndarray:
+    """Matriz (n x n) de distancias euclidianas."""
+    norma2 = np.einsum("ij,ij->i", m, m)
+    d2 = norma2[:, None] + norma2[None, :] - 2.0 * (m @ m.T)
+    return np.sqrt(np.maximum(d2, 0.0))
+
+def deduplicar(m, distancia: float = DISTANCIA_DUPLICADO) -> np.ndarray:
+    """Índices de las muestras que sobreviven (en orden): cada una lejos de todas las aceptadas antes."""
+    m = a_matriz(m)
+    aceptadas = []
+    for i in range(len(m)):
+        if aceptadas and np.linalg.norm(m[aceptadas] - m[i], axis=1).min() < distancia:
+            continue
+        aceptadas.append(i)
+    return np.array(aceptadas, dtype=np.intp)
+
+def medoides(m, k: int = K_PLANTILLAS, iteraciones: int = ITERACIONES) -> np.ndarray:
+    """Índices (ordenados) de k medoides de las filas de m; todas si hay k o menos."""
+    m = a_matriz(m)
+    n = len(m)
+    if n <= k:
+        return np.arange(n, dtype=np.intp)
+    d = _distancias(m)
+    # Inicio determinista: el medoide global y luego siempre la muestra más lejana
+    idx = [int(d.sum(axis=1).argmin())]
+    cercania = d[idx[0]].copy()
+    while len(idx) < k:
+        j = int(cercania.argmax())
+        idx.append(j)
+        cercania = np.minimum(cercania, d[j])
+    idx = np.array(idx, dtype=np.intp)
+    for _ in range(iteraciones):
+        grupo = d[:, idx].argmin(axis=1)
+        nuevo = idx.copy()
+        for c in range(k):
+            miembros = np.flatnonzero(grupo == c)
+            if len(miembros):
+                nuevo[c] = miembros[d[np.ix_(miembros, miembros)].sum(axis=1).argmin()]
+        if np.array_equal(nuevo, idx):
+            break
+        idx = nuevo
+    return np.sort(idx)
+
+def condensar(m, k: int = K_PLANTILLAS, distancia: float = DISTANCIA_DUPLICADO) -> np.ndarray:
+    """Plantillas condensadas de una persona (float32, a lo más k filas)."""
+    m = a_matriz(m)
+    if not len(m):
+        return m
+    m = m[deduplicar(m, distancia)]
+    return np.ascontiguousarray(m[medoides(m, k)])
+
+
+# ============== GALERÍA COMPLETA ==============
+def condensar_galeria(k: int = K_PLANTILLAS, almacen: AlmacenPlantillas | None = None,
+                      simular: bool = False) -> dict:
+    """
+    Condensa a todas las personas en UNA escritura atómica (generación nueva).
+    Devuelve {personas, antes, despues, reducidas: [(rut, antes, despues)], escrita}.
+    """
+    if almacen is None:
+        from galeria_rostros import obtener_galeria
+        almacen = obtener_galeria().almacen
+    cuenta = {"personas": 0, "antes": 0, "despues": 0}
+    reducidas = []
+
+    def _condensar(rut, m):
+        c = condensar(m, k)
+        cuenta["personas"] += 1
+        cuenta["antes"] += len(m)
+        cuenta["despues"] += len(c)
+        if len(c) < len(m):
+            reducidas.append((rut, len(m), len(c)))
+        return c
+
+    if simular:
+        matriz, personas = almacen.cargar()
+        for rut, ini, n in personas.values():
+            _condensar(rut, matriz[ini:ini + n])
+        escrita = False
+    else:
+        # Leer, condensar y publicar con el candado de la galería tomado: lo que
+        # escriba otro proceso (enrolamiento) entra antes o después, nunca se pierde
+        escrita = almacen.reescribir(_condensar)
+    return {
+        "personas": cuenta["personas"],
+        "antes": cuenta["antes"],
+        "despues": cuenta["despues"],
+        "reducidas": sorted(reducidas),
+        "escrita": escrita,
+    }
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Condensa las plantillas de la galería de rostros (k-medoides)")
+    ap.add_argument("--k", type=int, default=K_PLANTILLAS, help=f"plantillas máximas por persona (por defecto {K_PLANTILLAS})")
+    ap.add_argument("--carpeta", help="carpeta de rostros (por defecto la de la app)")
+    ap.add_argument("--simular", action="store_true", help="solo informar, sin escribir")
+    args = ap.parse_args(argv)
+    if args.k < 1:
+        ap.error("--k debe ser >= 1")
+
+    almacen = AlmacenPlantillas(args.carpeta) if args.carpeta else None
+    inf = condensar_galeria(args.k, almacen, args.simular)
+    for rut, antes, despues in inf["reducidas"]:
+        print(f"  {rut}: {antes} -> {despues}")
+    ahorro = 100.0 * (1 - inf["despues"] / inf["antes"]) if inf["antes"] else 0.0
+    print(f"{'✅' if not args.simular else 'ℹ️ (simulación)'} {inf['personas']} persona(s) | "
+          f"plantillas {inf['antes']} -> {inf['despues']} (-{ahorro:.0f}%, "
+          f"{inf['antes'] * ENCODING_DIM * 4 // 1024} KB -> {inf['despues'] * ENCODING_DIM * 4 // 1024} KB) | "
+          f"{len(inf['reducidas'])} persona(s) reducida(s), k={args.k}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,369 @@
 # db.py
 import os
+import sys
 import sqlite3
+import threading
 
-def crear_bd(db_path: str = "reloj_control.db") -> None:
-    # Asegura la carpeta del archivo
-    base_dir = os.path.dirname(os.path.abspath(db_path))
-    os.makedirs(base_dir or ".", exist_ok=True)
+# ============== RUTA ÚNICA DE LA BD ==============
+def _base_dir():
+    # En onedir: carpeta del .exe; en interpretado: carpeta del .py
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
 
-    con = sqlite3.connect(db_path)
-    cur = con.cursor()
+BASE = _base_dir()
+DB_PATH = os.path.join(BASE, "reloj_control.db")
+
+# ============== CONEXIONES COMPARTIDAS POR HILO ==============
+# Una conexión por (hilo, archivo), abierta una sola vez y reutilizada.
+# WAL deja leer mientras otro hilo escribe (hilo Tk vs. hilos de cámara) y
+# busy_timeout espera el lock en vez de fallar con "database is locked".
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", 5000),            # ms
+    ("mmap_size", 256 * 1024 * 1024),  # bytes
+    ("cache_size", -16000),            # KiB (negativo = tamaño, no páginas)
+    ("temp_store", "MEMORY"),
+)
+
+_local = threading.local()
+
+
+def _ruta_bd(db_path=None) -> str:
+    """Ruta absoluta; las relativas ("reloj_control.db") se resuelven contra BASE, no contra el cwd."""
+    ruta = db_path or DB_PATH
+    if not os.path.isabs(ruta):
+        ruta = os.path.join(BASE, ruta)
+    return os.path.normcase(os.path.abspath(ruta))
+
+
+class _Compartida:
+    """Conexión real del hilo + cuántos Conexion la tienen abierta."""
+    __slots__ = ("con", "abiertas", "puntos")
+
+    def __init__(self, ruta: str):
+        self.con = sqlite3.connect(ruta)
+        for nombre, valor in PRAGMAS:
+            try:
+                self.con.execute(f"PRAGMA {nombre}={valor}")
+            except sqlite3.DatabaseError:
+                pass  # p.ej. WAL no soportado en unidades de red: se sigue con el modo por defecto
+        self.abiertas = 0
+        self.puntos = 0       # contador para nombres de SAVEPOINT únicos
+
+    def soltar(self):
+        self.abiertas -= 1
+        if self.abiertas <= 0:
+            self.abiertas = 0
+            # Igual que un close() real: lo no confirmado se descarta
+            if self.con.in_transaction:
+                self.con.rollback()
+
+
+class Conexion:
+    """
+    Lo que devuelve conectar(): se usa igual que sqlite3.Connection
+    (cursor/execute/commit/rollback/close, 'with con:'), pero close() NO cierra
+    el archivo: libera la conexión compartida del hilo (rollback si quedó una
+    transacción sin confirmar y nadie más la usa).
+
+    Si se pide con una transacción ya abierta en el hilo (un helper llamado a mitad
+    de la transacción de otro), queda anidada en un SAVEPOINT: su commit() solo
+    libera el savepoint y su rollback() deshace solo lo suyo; la transacción de
+    afuera la confirma o descarta quien la abrió. Al cerrarla, lo no confirmado
+    queda en la transacción de afuera.
+    """
+    __slots__ = ("_compartida", "_cerrada", "_punto")
+
+    def __init__(self, compartida: _Compartida):
+        self._compartida = compartida
+        self._cerrada = False
+        self._punto = None
+        compartida.abiertas += 1
+        if compartida.con.in_transaction:
+            compartida.puntos += 1
+            self._punto = f"anidada_{compartida.puntos}"
+            compartida.con.execute(f"SAVEPOINT {self._punto}")
+
+    def __getattr__(self, nombre):
+        return getattr(self._compartida.con, nombre)
+
+    def _en_punto(self, *sentencias) -> bool:
+        """Ejecuta sentencias sobre el savepoint; False si ya no existe (la transacción de afuera terminó)."""
+        try:
+            for sql in sentencias:
+                self._compartida.con.execute(sql)
+            return True
+        except sqlite3.OperationalError:
+            self._punto = None
+            return False
+
+    def commit(self):
+        if self._punto is None:
+            return self._compartida.con.commit()
+        if not self._en_punto(f"RELEASE {self._punto}", f"SAVEPOINT {self._punto}"):
+            self._compartida.con.commit()
+
+    def rollback(self):
+        if self._punto is None:
+            return self._compartida.con.rollback()
+        if not self._en_punto(f"ROLLBACK TO {self._punto}"):
+            self._compartida.con.rollback()
+
+    def close(self):
+        if not self._cerrada:
+            self._cerrada = True
+            if self._punto is not None:
+                self._en_punto(f"RELEASE {self._punto}")
+            self._compartida.soltar()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, tb):
+        # Como sqlite3.Connection, pero respetando el savepoint si está anidada
+        if tipo is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+def conectar(db_path=None) -> Conexion:
+    """
+    Conexión del hilo actual a 'db_path' (por defecto la BD de la app). Todas las
+    del hilo comparten la misma sqlite3.Connection; pedida dentro de una
+    transacción abierta queda anidada (ver Conexion).
+    """
+    ruta = _ruta_bd(db_path)
+    conexiones = getattr(_local, "conexiones", None)
+    if conexiones is None:
+        conexiones = _local.conexiones = {}
+    compartida = conexiones.get(ruta)
+    if compartida is None:
+        compartida = conexiones[ruta] = _Compartida(ruta)
+    return Conexion(compartida)
+
+
+def cerrar_conexiones():
+    """Cierra de verdad las conexiones del hilo actual (fin de hilo, copias del archivo .db)."""
+    conexiones = getattr(_local, "conexiones", None) or {}
+    for compartida in conexiones.values():
+        try:
+            if compartida.con.in_transaction:
+                compartida.con.rollback()
+            compartida.con.close()
+        except Exception:
+            pass
+    conexiones.clear()
+
+
+# ============== REGISTROS: FECHA CANÓNICA E ÍNDICES ==============
+# registros.fecha se guarda siempre 'YYYY-MM-DD' para filtrar con "fecha = ?" o
+# "fecha BETWEEN ? AND ?" y usar el índice; DATE(fecha) = ? obliga a recorrer la tabla.
+_GLOB_ISO = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]"
+_GLOB_DMY = ("[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]", "[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]")
+
+def _sql_fecha_iso(col: str) -> str:
+    """Expresión SQL que lleva 'dd/mm/aaaa', 'dd-mm-aaaa' o 'aaaa-mm-dd hh:mm[:ss]' a 'aaaa-mm-dd'."""
+    dmy = " OR ".join(f"{col} GLOB '{g}'" for g in _GLOB_DMY)
+    return (f"CASE WHEN {dmy} THEN substr({col},7,4)||'-'||substr({col},4,2)||'-'||substr({col},1,2)"
+            f" WHEN {col} GLOB '{_GLOB_ISO}?*' THEN substr({col},1,10)"
+            f" ELSE {col} END")
+
+def _normalizar_fechas(cur, tabla="registros"):
+    # Filas antiguas; OR IGNORE deja tal cual las que chocarían con un duplicado exacto
+    cur.execute(f"""
+        UPDATE OR IGNORE {tabla} SET fecha = {_sql_fecha_iso("fecha")}
+        WHERE fecha IS NOT NULL AND fecha NOT GLOB '{_GLOB_ISO}'
+    """)
+    # Escrituras futuras (cualquier pantalla o script externo)
+    for evento in ("INSERT", "UPDATE OF fecha"):
+        nombre = f"{tabla}_fecha_iso_" + evento.split()[0].lower()
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {nombre}
+            AFTER {evento} ON {tabla}
+            WHEN NEW.fecha IS NOT NULL AND NEW.fecha NOT GLOB '{_GLOB_ISO}'
+            BEGIN
+                UPDATE {tabla} SET fecha = {_sql_fecha_iso("NEW.fecha")} WHERE id = NEW.id;
+            END
+        """)
+
+def _consolidar_dias_duplicados(cur):
+    """
+    Una fila por (rut, fecha), como en la migración del esquema viejo: se queda la
+    de menor id con el primer ingreso, la última salida y las observaciones unidas.
+    Las filas duplicadas vienen de marcajes simultáneos anteriores al índice único.
+    """
+    dup = cur.execute("""
+        SELECT rut, fecha FROM registros
+        WHERE fecha IS NOT NULL
+        GROUP BY rut, fecha HAVING COUNT(*) > 1
+    """).fetchall()
+    for rut, fecha in dup:
+        filas = cur.execute("""
+            SELECT id, hora_ingreso, hora_salida, observacion FROM registros
+            WHERE rut = ? AND fecha = ? ORDER BY id
+        """, (rut, fecha)).fetchall()
+        ingresos = [f[1] for f in filas if f[1] and str(f[1]).strip()]
+        salidas = [f[2] for f in filas if f[2] and str(f[2]).strip()]
+        obs = []
+        for f in filas:
+            o = (f[3] or "").strip()
+            if o and o not in obs:
+                obs.append(o)
+        # Las horas que no quedan en la fila se dejan anotadas (no se pierde el dato)
+        sobrantes = sorted(ingresos)[1:] + sorted(salidas)[:-1]
+        if sobrantes:
+            obs.append("Marcajes duplicados: " + ", ".join(sobrantes))
+        cur.execute("DELETE FROM registros WHERE rut = ? AND fecha = ? AND id <> ?", (rut, fecha, filas[0][0]))
+        cur.execute("""
+            UPDATE registros SET hora_ingreso = ?, hora_salida = ?, observacion = ? WHERE id = ?
+        """, (min(ingresos) if ingresos else None, max(salidas) if salidas else None,
+              " | ".join(obs), filas[0][0]))
+
+def _indices_registros(cur):
+    # Un registro por persona y día: lo exige el UPSERT de marcaje.registrar_marcaje
+    try:
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_registros_rut_fecha ON registros(rut, fecha)")
+    except sqlite3.IntegrityError:
+        _consolidar_dias_duplicados(cur)
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_registros_rut_fecha ON registros(rut, fecha)")
+    # Índice cubriente para el marcaje/estado del día: (rut, fecha) -> horas y observación
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_registros_rut_fecha_cubre
+        ON registros(rut, fecha, hora_ingreso, hora_salida, observacion)
+    """)
+    # Resúmenes por día (todas las personas)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_registros_fecha ON registros(fecha)")
+    # Prefijo del cubriente: ya no aporta y encarece cada escritura
+    cur.execute("DROP INDEX IF EXISTS idx_registros_rut_fecha")
+
+
+def _tabla_asistencia_dia(cur):
+    """Hechos diarios (ver hechos_asistencia.py)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS asistencia_dia (
+            rut                   TEXT    NOT NULL,
+            fecha                 TEXT    NOT NULL,   -- 'YYYY-MM-DD'
+            hora_ingreso          TEXT,
+            hora_salida           TEXT,
+            entrada_esperada      TEXT,
+            salida_esperada       TEXT,
+            min_programados       INTEGER NOT NULL DEFAULT 0,
+            min_trabajados        INTEGER NOT NULL DEFAULT 0,
+            min_atraso            INTEGER NOT NULL DEFAULT 0,
+            min_salida_anticipada INTEGER NOT NULL DEFAULT 0,
+            min_extra             INTEGER NOT NULL DEFAULT 0,
+            estado                TEXT    NOT NULL,   -- OK | SI | PS | ADM | -
+            motivo                TEXT,
+            observacion           TEXT,
+            actualizado_en        TEXT,
+            PRIMARY KEY (rut, fecha)
+        ) WITHOUT ROWID
+    """)
+    # Por persona: la PK; por día/mes para todos:
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asistencia_dia_fecha ON asistencia_dia(fecha)")
+
+
+# ============== HORAS COMO ENTEROS ==============
+# Las horas siguen guardándose como texto ('HH:MM' / 'HH:MM:SS', lo que se muestra),
+# pero cada una tiene al lado su valor entero, mantenido por triggers en cualquier
+# escritura:
+#   registros.seg_ingreso / seg_salida   segundos desde medianoche (el marcaje trae
+#                                        segundos y el atraso redondea hacia arriba sobre ellos)
+#   horarios.min_entrada / min_salida    minutos desde medianoche (los horarios no llevan segundos)
+# Así los reportes restan enteros en vez de probar formatos con strptime fila a fila.
+HORAS_ENTERAS = (
+    ("registros", (("hora_ingreso", "seg_ingreso"), ("hora_salida", "seg_salida")), 1),
+    ("horarios", (("hora_entrada", "min_entrada"), ("hora_salida", "min_salida")), 60),
+)
+
+def _sql_segundos(col: str) -> str:
+    """Expresión SQL: 'H:MM', 'HH:MM' o 'HH:MM:SS' -> segundos desde medianoche (NULL si no es hora)."""
+    t = f"TRIM({col})"
+    h = f"(CASE WHEN substr({t},2,1) = ':' THEN '0' || {t} ELSE {t} END)"
+    hms = f"substr({h} || ':00', 1, 8)"
+    return (f"(CASE WHEN length({h}) IN (5, 8)"
+            f" AND ({hms} GLOB '[01][0-9]:[0-5][0-9]:[0-5][0-9]' OR {hms} GLOB '2[0-3]:[0-5][0-9]:[0-5][0-9]')"
+            f" THEN CAST(substr({h},1,2) AS INTEGER) * 3600 + CAST(substr({h},4,2) AS INTEGER) * 60"
+            f" + CAST(substr({hms},7,2) AS INTEGER) END)")
+
+def _horas_enteras(cur, tabla, pares, divisor):
+    cols = {c[1] for c in cur.execute(f"PRAGMA table_info({tabla})").fetchall()}
+    for _texto, entero in pares:
+        if entero not in cols:
+            cur.execute(f"ALTER TABLE {tabla} ADD COLUMN {entero} INTEGER")
+    asignar = ", ".join(f"{entero} = {_sql_segundos('NEW.' + texto)} / {divisor}" for texto, entero in pares)
+    textos = ", ".join(texto for texto, _ in pares)
+    for evento in ("INSERT", f"UPDATE OF {textos}"):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {tabla}_horas_enteras_{evento.split()[0].lower()}
+            AFTER {evento} ON {tabla}
+            BEGIN
+                UPDATE {tabla} SET {asignar} WHERE id = NEW.id;
+            END
+        """)
+    # Historia
+    cur.execute(f"UPDATE {tabla} SET " + ", ".join(
+        f"{entero} = {_sql_segundos(texto)} / {divisor}" for texto, entero in pares))
+
+
+# Consultas calientes y los índices aceptables (lo revisa benchmark_arranque).
+# Con igualdad en (rut, fecha) SQLite prefiere el índice único: una fila, una búsqueda.
+_POR_DIA = ("INDEX ux_registros_rut_fecha", "COVERING INDEX idx_registros_rut_fecha_cubre")
+PLANES_ESPERADOS = (
+    ("estado_del_dia",
+     "SELECT hora_ingreso, hora_salida FROM registros WHERE rut = ? AND fecha = ?",
+     _POR_DIA),
+    ("ingreso_y_observacion",
+     "SELECT hora_ingreso, observacion FROM registros WHERE rut = ? AND fecha = ?",
+     _POR_DIA),
+    ("rango_por_persona",
+     "SELECT fecha, hora_ingreso, hora_salida, observacion FROM registros WHERE rut = ? AND fecha BETWEEN ? AND ?",
+     ("COVERING INDEX idx_registros_rut_fecha_cubre",)),
+    ("resumen_del_dia",
+     "SELECT rut, hora_ingreso FROM registros WHERE fecha = ?",
+     ("INDEX idx_registros_fecha",)),
+)
+
+def verificar_planes(db_path=None) -> dict:
+    """
+    EXPLAIN QUERY PLAN de PLANES_ESPERADOS: {nombre: {"ok": bool, "plan": "..."}}.
+    ok=False significa que la consulta dejó de usar su índice (volvió a un SCAN).
+    """
+    con = conectar(db_path)
+    try:
+        resultado = {}
+        for nombre, sql, esperado in PLANES_ESPERADOS:
+            params = (None,) * sql.count("?")
+            plan = " | ".join(str(fila[-1]) for fila in con.execute("EXPLAIN QUERY PLAN " + sql, params))
+            ok = any(e in plan for e in esperado) and "SCAN registros" not in plan
+            resultado[nombre] = {"ok": ok, "plan": plan}
+        return resultado
+    finally:
+        con.close()
+
+
+# ============== ESQUEMA VERSIONADO (PRAGMA user_version) ==============
+# Cada migración lleva la BD de la versión anterior a la suya y se aplica UNA vez:
+# crear_bd compara user_version con ESQUEMA_VERSION y, si está al día, no ejecuta
+# ningún DDL. Los módulos ya no crean tablas ni consultan PRAGMA table_info en
+# caliente: preguntan a capacidades() (ver abajo).
+#
+# Para cambiar el esquema: agregar _migracion_N al final de MIGRACIONES (nunca
+# editar una ya publicada). Deben ser idempotentes: una BD antigua (versión 0)
+# puede tener ya parte de lo que crean.
+
+def _migracion_1(cur):
+    """Esquema base (lo que hacía crear_bd en cada arranque)."""
 
     # ---------- TRABAJADORES ----------
     cur.execute("""
@@ -45,14 +400,13 @@ def crear_bd(db_path: str = "reloj_control.db") -> None:
                 observacion TEXT
             )
         """)
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_registros_rut_fecha ON registros(rut, fecha)")
 
     if not cols_reg:
         # No existía la tabla: crear directamente con el esquema nuevo
         create_registros_new_table()
     elif "hora_ingreso" in cols_reg and "hora_salida" in cols_reg:
-        # Ya está migrada: asegurar índice
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_registros_rut_fecha ON registros(rut, fecha)")
+        # Ya está migrada: solo fechas e índices (abajo)
+        pass
     else:
         # Esquema viejo: registros(rut, nombre, fecha, hora, tipo, observacion)
         # => Migramos a un esquema por día con hora_ingreso/hora_salida
@@ -86,7 +440,9 @@ def crear_bd(db_path: str = "reloj_control.db") -> None:
         # Reemplazar tabla
         cur.execute("DROP TABLE registros")
         cur.execute("ALTER TABLE registros_nuevo RENAME TO registros")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_registros_rut_fecha ON registros(rut, fecha)")
+
+    _normalizar_fechas(cur, "registros")
+    _indices_registros(cur)
 
     # ---------- HORARIOS ----------
     cur.execute("""
@@ -136,6 +492,8 @@ def crear_bd(db_path: str = "reloj_control.db") -> None:
         )
     """)
 
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_dias_libres_fecha_rut ON dias_libres(fecha, rut)")
+
     # ---------- PANEL FLAGS (lo usa ingreso_salida para salida anticipada) ----------
     cur.execute("""
         CREATE TABLE IF NOT EXISTS panel_flags (
@@ -145,6 +503,17 @@ def crear_bd(db_path: str = "reloj_control.db") -> None:
         )
     """)
 
+    # ---------- EXTRAS MENSUALES (minutos extra acumulados por mes) ----------
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS extras_mensuales (
+            rut TEXT NOT NULL,
+            anio_mes TEXT NOT NULL,           -- 'YYYY-MM'
+            minutos_extra INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT,
+            PRIMARY KEY (rut, anio_mes)
+        )
+    """)
+
     # ---------- SOLICITUDES (para módulo Solicitar Permiso) ----------
     cur.execute("""
         CREATE TABLE IF NOT EXISTS solicitudes (
@@ -160,5 +529,254 @@ def crear_bd(db_path: str = "reloj_control.db") -> None:
         )
     """)
 
-    con.commit()
-    con.close()
+    # ---------- HECHOS DIARIOS DE ASISTENCIA ----------
+    _tabla_asistencia_dia(cur)
+
+
+def _migracion_2(cur):
+    """Tablas que antes creaba cada módulo al importarse o al abrir su pantalla."""
+    # ---------- FERIADOS (feriados.py, panel avanzado) ----------
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS feriados (
+            fecha TEXT PRIMARY KEY,          -- 'YYYY-MM-DD'
+            nombre TEXT NOT NULL,
+            irrenunciable INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+    # ---------- ATRASOS (reportes.py) ----------
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS atrasos_diarios (
+          rut             TEXT    NOT NULL,
+          fecha           DATE    NOT NULL,
+          minutos_atraso  INTEGER NOT NULL,
+          hora_esperada   TEXT,
+          hora_ingreso    TEXT,
+          tolerancia_min  INTEGER NOT NULL DEFAULT 5,
+          calculado_en    TEXT    NOT NULL DEFAULT (datetime('now')),
+          PRIMARY KEY (rut, fecha)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS atrasos_mensuales (
+          rut                     TEXT    NOT NULL,
+          anio                    INTEGER NOT NULL,
+          mes                     INTEGER NOT NULL,
+          minutos_atraso_total    INTEGER NOT NULL,
+          tolerancia_min          INTEGER NOT NULL DEFAULT 5,
+          cerrado_en              TEXT    NOT NULL DEFAULT (datetime('now')),
+          PRIMARY KEY (rut, anio, mes)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_atrasos_m_rut ON atrasos_mensuales(rut)")
+
+    # ---------- SOLICITUDES CON FOLIO (solicitudes.py) ----------
+    # La versión 1 creaba 'solicitudes' con otra forma (sin folio); si quedó así
+    # se aparta (o se borra si está vacía) para crear la que usa el módulo.
+    cols_sol = {c[1] for c in cur.execute("PRAGMA table_info(solicitudes)").fetchall()}
+    if cols_sol and "folio" not in cols_sol:
+        if cur.execute("SELECT 1 FROM solicitudes LIMIT 1").fetchone():
+            cur.execute("ALTER TABLE solicitudes RENAME TO solicitudes_v1")
+        else:
+            cur.execute("DROP TABLE solicitudes")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS folios (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            ultimo_folio INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("INSERT OR IGNORE INTO folios (id, ultimo_folio) VALUES (1, 0)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS solicitudes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            folio INTEGER NOT NULL,
+            rut TEXT NOT NULL,
+            nombre TEXT NOT NULL,
+            tipo_permiso TEXT NOT NULL,
+            fecha_desde TEXT NOT NULL,    -- ISO YYYY-MM-DD
+            fecha_hasta TEXT NOT NULL,    -- ISO YYYY-MM-DD
+            observacion TEXT,
+            pdf_path TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_solicitudes_folio ON solicitudes(folio)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_solicitudes_rut ON solicitudes(rut)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_solicitudes_created_at ON solicitudes(created_at)")
+
+    # ---------- PANEL FLAGS: cierre forzado (panel_avanzado.py) ----------
+    cols_pf = {c[1] for c in cur.execute("PRAGMA table_info(panel_flags)").fetchall()}
+    if "cierre_forzado" not in cols_pf:
+        cur.execute("ALTER TABLE panel_flags ADD COLUMN cierre_forzado INTEGER NOT NULL DEFAULT 0")
+    if "cierre_forzado_obs" not in cols_pf:
+        cur.execute("ALTER TABLE panel_flags ADD COLUMN cierre_forzado_obs TEXT")
+
+    # ---------- ÍNDICES DE NÓMINA (nomina.py) ----------
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_trab_ap_nom ON trabajadores (apellido, nombre)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_trab_nom_busq ON trabajadores (nombre, apellido, rut)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_horarios_rut ON horarios (rut)")
+    # rut ya es UNIQUE en trabajadores y (fecha, tipo) es de la tabla registros antigua
+    cur.execute("DROP INDEX IF EXISTS idx_trab_rut")
+    cur.execute("DROP INDEX IF EXISTS idx_registros_fecha_tipo")
+
+
+def _migracion_3(cur):
+    """Horas como enteros en registros/horarios y fecha ISO en dias_libres."""
+    for tabla, pares, divisor in HORAS_ENTERAS:
+        _horas_enteras(cur, tabla, pares, divisor)
+    # dias_libres se cruza con registros por fecha: mismo formato canónico
+    _normalizar_fechas(cur, "dias_libres")
+
+
+MIGRACIONES = (
+    (1, _migracion_1),
+    (2, _migracion_2),
+    (3, _migracion_3),
+)
+ESQUEMA_VERSION = MIGRACIONES[-1][0]
+
+
+def version_esquema(db_path=None) -> int:
+    con = conectar(db_path)
+    try:
+        return con.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        con.close()
+
+
+def _migrar(con) -> int:
+    """Aplica las migraciones pendientes en UNA transacción. Devuelve la versión de partida."""
+    cur = con.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        # Releída con el lock tomado: otro proceso pudo migrar mientras esperábamos
+        actual = cur.execute("PRAGMA user_version").fetchone()[0]
+        for version, migracion in MIGRACIONES:
+            if version > actual:
+                migracion(cur)
+                print(f"[db] esquema migrado a v{version} ({migracion.__doc__.strip()})")
+        if actual < ESQUEMA_VERSION:
+            cur.execute(f"PRAGMA user_version = {ESQUEMA_VERSION}")
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    return actual
+
+
+_esquemas_listos = set()          # rutas ya en ESQUEMA_VERSION en este proceso
+_esquemas_lock = threading.Lock()
+
+def crear_bd(db_path: str = "reloj_control.db") -> None:
+    """Deja la BD en ESQUEMA_VERSION. Si ya lo está, solo lee user_version."""
+    # Asegura la carpeta del archivo
+    base_dir = os.path.dirname(_ruta_bd(db_path))
+    os.makedirs(base_dir or ".", exist_ok=True)
+
+    con = conectar(db_path)
+    try:
+        if con.execute("PRAGMA user_version").fetchone()[0] >= ESQUEMA_VERSION:
+            _esquemas_listos.add(_ruta_bd(db_path))
+            return
+        desde = _migrar(con)
+        hechos_vacios = con.execute("SELECT 1 FROM asistencia_dia LIMIT 1").fetchone() is None
+    finally:
+        con.close()
+
+    _esquemas_listos.add(_ruta_bd(db_path))
+    olvidar_capacidades(db_path)
+
+    if desde < 1 and hechos_vacios:
+        # Primera vez: asistencia_dia se llena con la historia existente
+        try:
+            from hechos_asistencia import reconstruir
+            n = reconstruir(db_path=db_path)
+            print(f"[db] asistencia_dia inicializada con {n} fila(s)")
+        except Exception as e:
+            print("Aviso: no se pudo inicializar asistencia_dia:", e)
+
+
+def asegurar_esquema(db_path=None) -> None:
+    """
+    Para módulos que se pueden abrir solos (sin principal.py): migra la BD la
+    primera vez en el proceso; las siguientes llamadas no tocan la BD.
+    """
+    ruta = _ruta_bd(db_path)
+    if ruta in _esquemas_listos:
+        return
+    with _esquemas_lock:
+        if ruta not in _esquemas_listos:
+            crear_bd(db_path or DB_PATH)
+
+
+# ============== CAPACIDADES (tablas y columnas, leídas una vez) ==============
+class Capacidades:
+    """
+    Foto del esquema: qué tablas hay y qué columnas tiene cada una.
+    Nombres sin distinguir mayúsculas, como SQLite.
+
+        cap = capacidades()
+        cap.tiene_tabla("dias_libres")
+        cap.tiene_columna("trabajadores", "correo")
+        cap.columnas("horarios")            -> ('id', 'rut', 'dia', ...)
+    """
+    __slots__ = ("version", "_tablas")
+
+    def __init__(self, version: int, tablas: dict):
+        self.version = version
+        self._tablas = tablas        # {nombre_minúsculas: (nombre, (columnas...))}
+
+    def tablas(self) -> list:
+        return [nombre for nombre, _ in self._tablas.values()]
+
+    def tiene_tabla(self, tabla: str) -> bool:
+        return tabla.lower() in self._tablas
+
+    def columnas(self, tabla: str) -> tuple:
+        info = self._tablas.get(tabla.lower())
+        return info[1] if info else ()
+
+    def tiene_columna(self, tabla: str, columna: str) -> bool:
+        columna = columna.lower()
+        return any(c.lower() == columna for c in self.columnas(tabla))
+
+    def primera_columna(self, tabla: str, candidatas) -> str | None:
+        """La primera de 'candidatas' que exista en 'tabla' (None si ninguna)."""
+        for c in candidatas:
+            if self.tiene_columna(tabla, c):
+                return c
+        return None
+
+
+_capacidades = {}             # ruta -> Capacidades
+_capacidades_lock = threading.Lock()
+
+def _leer_capacidades(ruta: str) -> Capacidades:
+    con = conectar(ruta)
+    try:
+        cur = con.cursor()
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        nombres = [r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
+        tablas = {}
+        for nombre in nombres:
+            cols = tuple(c[1] for c in cur.execute(f'PRAGMA table_info("{nombre}")').fetchall())
+            tablas[nombre.lower()] = (nombre, cols)
+    finally:
+        con.close()
+    return Capacidades(version, tablas)
+
+def capacidades(db_path=None) -> Capacidades:
+    """Esquema de la BD, leído la primera vez y reutilizado (sin PRAGMA en caliente)."""
+    ruta = _ruta_bd(db_path)
+    cap = _capacidades.get(ruta)
+    if cap is None:
+        with _capacidades_lock:
+            cap = _capacidades.get(ruta)
+            if cap is None:
+                cap = _capacidades[ruta] = _leer_capacidades(ruta)
+    return cap
+
+def olvidar_capacidades(db_path=None) -> None:
+    """Después de migrar o de reemplazar el archivo .db."""
+    with _capacidades_lock:
+        _capacidades.pop(_ruta_bd(db_path), None)
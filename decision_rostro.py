@@ -0,0 +1,82 @@
+# decision_rostro.py
+"""
+Motor de decisión por evidencia acumulada (votación temporal) para rostros.
+
+En vez de aceptar con el primer cuadro cuya distancia quede bajo la tolerancia
+(y descartar los casi-aciertos), se acumulan observaciones por RUT en una
+ventana deslizante de M cuadros codificados y se decide cuando:
+
+  - el RUT suma al menos N votos en la ventana ("N de M"), donde un voto es
+    una observación con distancia <= umbral_voto y margen >= margen_min, y
+  - la media de las distancias de esos votos es <= umbral_media.
+
+Así se puede ser más estricto (umbral_media) sin alargar el timeout, y un
+match claro termina en 2–3 cuadros.
+"""
+import threading
+from collections import deque
+
+# ---------- valores por defecto ----------
+VENTANA_CUADROS = 5     # M
+VOTOS_REQUERIDOS = 2    # N
+UMBRAL_VOTO = 0.55      # distancia máxima para que un cuadro cuente como voto
+UMBRAL_MEDIA = 0.50     # distancia media máxima de los votos para decidir
+MARGEN_MIN = 0.0        # margen mínimo vs 2ª persona (solo reconocimiento abierto)
+
+
+class AcumuladorEvidencia:
+    def __init__(self, ventana: int = VENTANA_CUADROS, votos: int = VOTOS_REQUERIDOS,
+                 umbral_voto: float = UMBRAL_VOTO, umbral_media: float = UMBRAL_MEDIA,
+                 margen_min: float = MARGEN_MIN):
+        if votos > ventana:
+            raise ValueError("votos (N) no puede ser mayor que la ventana (M)")
+        self.ventana = ventana
+        self.votos = votos
+        self.umbral_voto = umbral_voto
+        self.umbral_media = umbral_media
+        self.margen_min = margen_min
+        self._obs = deque(maxlen=ventana)   # (rut | None, distancia)
+        self._lock = threading.Lock()        # el HUD lee mientras el trabajador agrega
+
+    def reiniciar(self):
+        with self._lock:
+            self._obs.clear()
+
+    def agregar(self, rut, distancia: float, margen: float = float("inf")):
+        """
+        Registra la observación de un cuadro codificado y devuelve el RUT
+        decidido (o None si aún no hay evidencia suficiente).
+        """
+        es_voto = rut is not None and distancia <= self.umbral_voto and margen >= self.margen_min
+        with self._lock:
+            self._obs.append((rut if es_voto else None, float(distancia)))
+        return self.decision()
+
+    def evidencia(self):
+        """{rut: (votos, distancia_media)} dentro de la ventana actual."""
+        with self._lock:
+            obs = list(self._obs)
+        acc = {}
+        for rut, d in obs:
+            if rut is None:
+                continue
+            n, s = acc.get(rut, (0, 0.0))
+            acc[rut] = (n + 1, s + d)
+        return {r: (n, s / n) for r, (n, s) in acc.items()}
+
+    def decision(self):
+        mejor, mejor_media = None, None
+        for rut, (n, media) in self.evidencia().items():
+            if n >= self.votos and media <= self.umbral_media:
+                if mejor is None or media < mejor_media:
+                    mejor, mejor_media = rut, media
+        return mejor
+
+    def progreso(self, rut=None) -> str:
+        """Texto corto para el HUD (votos del mejor candidato)."""
+        ev = self.evidencia()
+        if rut is not None:
+            n = ev.get(rut, (0, 0.0))[0]
+        else:
+            n = max((v[0] for v in ev.values()), default=0)
+        return f"Evidencia {n}/{self.votos}"
@@ -0,0 +1,249 @@
+# despacho_ui.py
+"""
+Trabajo bloqueante fuera del hilo de Tk y resultados de vuelta en él.
+
+Tk no es seguro entre hilos: un callback que toca widgets desde el hilo de la
+cámara o de un trabajador congela la ventana de vez en cuando. Aquí hay dos piezas:
+
+  - un grupo acotado de hilos trabajadores (MAX_TRABAJADORES) para cámara, BD,
+    PDF y SMTP;
+  - una cola que el hilo de Tk vacía con after() cada INTERVALO_MS: todo lo que
+    toca la UI pasa por ella.
+
+Uso:
+    iniciar_despacho(app)                        # principal.py, una vez (hilo de Tk)
+
+    ejecutar(trabajo, arg1, ...,
+             al_terminar=lambda resultado: ...,  # en el hilo de Tk
+             al_fallar=lambda error: ...,        # en el hilo de Tk
+             ambito=frame)                       # pantalla dueña de la tarea
+    en_hilo_ui(fn, *args)                        # desde cualquier hilo
+
+    cancelar_ambito(frame_contenedor)            # al dejar una pantalla
+
+Cancelar no interrumpe un trabajo que ya corre: lo marca, sus callbacks ya no se
+llaman y quien haga trabajos largos puede mirar tarea_actual().cancelada.
+Tampoco se llaman si el widget del ámbito ya no existe.
+"""
+import queue
+import sys
+import threading
+import time
+import traceback
+
+MAX_TRABAJADORES = 4
+INTERVALO_MS = 25             # cada cuánto revisa la cola el hilo de Tk
+PRESUPUESTO_S = 0.010         # tiempo máximo por vuelta (la UI sigue respondiendo)
+
+PENDIENTE, CORRIENDO, LISTA, ERROR, CANCELADA = "pendiente", "corriendo", "lista", "error", "cancelada"
+
+
+# ============== TAREAS ==============
+class Tarea:
+    __slots__ = ("nombre", "ambito", "_ruta", "estado", "_cancelada")
+
+    def __init__(self, nombre: str, ambito=None):
+        self.nombre = nombre
+        self.ambito = ambito
+        self._ruta = str(ambito) if ambito is not None else None   # '.!ctkframe.!frame2' (jerárquico)
+        self.estado = PENDIENTE
+        self._cancelada = threading.Event()
+
+    @property
+    def cancelada(self) -> bool:
+        return self._cancelada.is_set()
+
+    def cancelar(self):
+        self._cancelada.set()
+        if self.estado in (PENDIENTE, CORRIENDO):
+            self.estado = CANCELADA
+
+    def dentro_de(self, ruta: str) -> bool:
+        return self._ruta is not None and (self._ruta == ruta or self._ruta.startswith(ruta + "."))
+
+    def vigente(self) -> bool:
+        """Se pueden entregar sus resultados: no cancelada y su ámbito sigue en pantalla."""
+        if self.cancelada:
+            return False
+        if self.ambito is None:
+            return True
+        try:
+            return bool(self.ambito.winfo_exists())
+        except Exception:
+            return False
+
+    def __repr__(self):
+        return f"Tarea({self.nombre!r}, {self.estado})"
+
+
+_local = threading.local()
+
+def tarea_actual():
+    """La Tarea que corre en este hilo trabajador (None fuera de ejecutar())."""
+    return getattr(_local, "tarea", None)
+
+
+# ============== GRUPO DE TRABAJADORES ==============
+class _Trabajadores:
+    """Hilos daemon creados a demanda hasta MAX_TRABAJADORES; conservan su conexión a la BD."""
+
+    def __init__(self, maximo: int):
+        self._maximo = maximo
+        self._cola = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._hilos = []
+        self._en_curso = 0        # enviadas y no terminadas
+
+    def enviar(self, funcion):
+        with self._lock:
+            self._hilos = [h for h in self._hilos if h.is_alive()]
+            if self._en_curso >= len(self._hilos) and len(self._hilos) < self._maximo:
+                h = threading.Thread(target=self._bucle, daemon=True, name=f"trabajo-{len(self._hilos) + 1}")
+                self._hilos.append(h)
+                h.start()
+            self._en_curso += 1
+        self._cola.put(funcion)
+
+    def _bucle(self):
+        while True:
+            funcion = self._cola.get()
+            try:
+                funcion()
+            finally:
+                with self._lock:
+                    self._en_curso -= 1
+
+
+# ============== DESPACHADOR (hilo de Tk) ==============
+class Despachador:
+    def __init__(self, root):
+        self.root = root
+        self._cola = queue.SimpleQueue()
+        self._after_id = None
+        self._hilo_ui = threading.get_ident()
+
+    def iniciar(self):
+        if self._after_id is None:
+            self._after_id = self.root.after(INTERVALO_MS, self._drenar)
+        return self
+
+    def detener(self):
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+
+    def en_hilo_ui(self) -> bool:
+        return threading.get_ident() == self._hilo_ui
+
+    def poner(self, fn, args=()):
+        self._cola.put((fn, args))
+
+    def _drenar(self):
+        limite = time.perf_counter() + PRESUPUESTO_S
+        while time.perf_counter() < limite:
+            try:
+                fn, args = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args)
+            except Exception:
+                # Mismo camino que los errores de cualquier callback Tk (log + aviso)
+                try:
+                    self.root.report_callback_exception(*sys.exc_info())
+                except Exception:
+                    traceback.print_exc()
+        try:
+            self._after_id = self.root.after(INTERVALO_MS, self._drenar)
+        except Exception:
+            self._after_id = None     # la ventana se cerró
+
+
+_despachador = None
+_trabajadores = _Trabajadores(MAX_TRABAJADORES)
+_tareas = set()
+_tareas_lock = threading.Lock()
+
+
+def iniciar_despacho(root) -> Despachador:
+    """Llamar desde el hilo de Tk con la ventana principal (idempotente)."""
+    global _despachador
+    if _despachador is None:
+        _despachador = Despachador(root).iniciar()
+    return _despachador
+
+def _asegurar_despacho(ambito):
+    # Pantallas abiertas sin principal.py: se arranca con la ventana del ámbito
+    if _despachador is None and ambito is not None and threading.current_thread() is threading.main_thread():
+        iniciar_despacho(ambito.winfo_toplevel())
+
+def en_hilo_ui(fn, *args):
+    """Encola fn(*args) para el hilo de Tk. Seguro desde cualquier hilo."""
+    if _despachador is None:
+        print("[despacho] sin iniciar_despacho(): se descarta", getattr(fn, "__name__", fn), flush=True)
+        return
+    _despachador.poner(fn, args)
+
+
+def _error_por_defecto(tarea):
+    def _mostrar(error):
+        print(f"[despacho] {tarea.nombre}: {error!r}", flush=True)
+    return _mostrar
+
+def ejecutar(trabajo, *args, al_terminar=None, al_fallar=None, ambito=None, nombre=None) -> Tarea:
+    """
+    Corre trabajo(*args) en un hilo trabajador. al_terminar(resultado) / al_fallar(error)
+    se llaman en el hilo de Tk, solo si la tarea sigue vigente.
+    """
+    _asegurar_despacho(ambito)
+    tarea = Tarea(nombre or getattr(trabajo, "__name__", "tarea"), ambito)
+    al_fallar = al_fallar or _error_por_defecto(tarea)
+    with _tareas_lock:
+        _tareas.add(tarea)
+
+    def _entregar(callback, valor):
+        if tarea.vigente() and callback is not None:
+            callback(valor)
+
+    def _correr():
+        try:
+            if tarea.cancelada:
+                return
+            tarea.estado = CORRIENDO
+            _local.tarea = tarea
+            try:
+                resultado = trabajo(*args)
+            except Exception as e:
+                traceback.print_exc()
+                if not tarea.cancelada:
+                    tarea.estado = ERROR
+                    en_hilo_ui(_entregar, al_fallar, e)
+                return
+            finally:
+                _local.tarea = None
+            if not tarea.cancelada:
+                tarea.estado = LISTA
+                en_hilo_ui(_entregar, al_terminar, resultado)
+        finally:
+            with _tareas_lock:
+                _tareas.discard(tarea)
+
+    _trabajadores.enviar(_correr)
+    return tarea
+
+
+def cancelar_ambito(ambito) -> int:
+    """Cancela las tareas de 'ambito' y de cualquier widget dentro de él. Devuelve cuántas."""
+    ruta = str(ambito)
+    with _tareas_lock:
+        afectadas = [t for t in _tareas if t.dentro_de(ruta)]
+    for t in afectadas:
+        t.cancelar()
+    return len(afectadas)
+
+def tareas_activas() -> list:
+    with _tareas_lock:
+        return list(_tareas)
@@ -1,6 +1,8 @@
 import os
 import sys
-import sqlite3
+from db import conectar
+from feriados import sumar_dias_habiles as sumar_dias_habiles_cal
+from hechos_asistencia import actualizar_dias
 from datetime import datetime, timedelta
 import tkinter as tk
 from tkinter import messagebox
@@ -40,7 +42,7 @@ def obtener_cupo_admin_para_rut(rut: str) -> int | None:
     Retorna int o None si no está configurado.
     """
     try:
-        con = sqlite3.connect("reloj_control.db")
+        con = conectar()
         cur = con.cursor()
         cur.execute("""
             SELECT valor FROM parametros_trabajador
@@ -62,7 +64,7 @@ def contar_admin_anio(rut: str, anio: int | None = None) -> int:
     try:
         if anio is None:
             anio = datetime.now().year
-        con = sqlite3.connect("reloj_control.db")
+        con = conectar()
         cur = con.cursor()
         cur.execute("""
             SELECT COUNT(*)
@@ -142,7 +144,7 @@ def _categoria_motivo(motivo: str) -> str:
 
 def _emails_para_rut(rut: str):
     try:
-        con = sqlite3.connect("reloj_control.db")
+        con = conectar()
         cur = con.cursor()
         cur.execute("SELECT correo FROM trabajadores WHERE rut = ?", (rut,))
         row = cur.fetchone()
@@ -376,7 +378,7 @@ def construir_dia_administrativo(frame_padre):
         filas = [(id, fecha_iso, motivo), ...] ordenado por fecha
         """
         try:
-            conn = sqlite3.connect("reloj_control.db"); cur = conn.cursor()
+            conn = conectar(); cur = conn.cursor()
             if solo_ids:
                 placeholders = ",".join("?" for _ in solo_ids)
                 cur.execute(f"""
@@ -650,7 +652,7 @@ def construir_dia_administrativo(frame_padre):
 
     # Carga nombres/ruts
     def cargar_nombres_ruts():
-        conn = sqlite3.connect("reloj_control.db")
+        conn = conectar()
         cursor = conn.cursor()
         cursor.execute("SELECT rut, nombre, apellido FROM trabajadores")
         nombres, dict_nombre_rut = [], {}
@@ -787,15 +789,8 @@ def construir_dia_administrativo(frame_padre):
 
     # helpers fecha
     def sumar_dias_habiles(fecha_inicio, dias_habiles):
-        dias_agregados = 0
-        fecha = fecha_inicio
-        while dias_agregados < dias_habiles:
-            if fecha.weekday() < 5:
-                dias_agregados += 1
-                if dias_agregados == dias_habiles:
-                    break
-            fecha += timedelta(days=1)
-        return fecha
+        # Salta fines de semana y feriados (calendario en memoria)
+        return sumar_dias_habiles_cal(fecha_inicio, dias_habiles)
 
     def sumar_dias_corridos_inclusivo(fecha_inicio, dias_corridos):
         return fecha_inicio + timedelta(days=dias_corridos - 1)
@@ -827,11 +822,14 @@ def construir_dia_administrativo(frame_padre):
         if not selected_ids: return
         if not messagebox.askyesno("Confirmar", f"¿Eliminar {len(selected_ids)} registro(s) seleccionado(s)?"):
             return
-        conn = sqlite3.connect("reloj_control.db")
+        conn = conectar()
         cur = conn.cursor()
         placeholders = ",".join("?" for _ in selected_ids)
+        cur.execute(f"SELECT rut, fecha FROM dias_libres WHERE id IN ({placeholders})", tuple(selected_ids))
+        afectados = cur.fetchall()
         cur.execute(f"DELETE FROM dias_libres WHERE id IN ({placeholders})", tuple(selected_ids))
         conn.commit(); conn.close()
+        actualizar_dias(afectados)
         cant = len(selected_ids)
         selected_ids.clear(); checkbox_vars.clear()
         mostrar_vista_previa(); actualizar_boton_eliminar()
@@ -920,8 +918,9 @@ def construir_dia_administrativo(frame_padre):
         if fecha_fin < fecha_inicio:
             messagebox.showerror("Error", "La fecha final no puede ser anterior a la inicial."); return
 
-        conn = sqlite3.connect("reloj_control.db"); cur = conn.cursor()
+        conn = conectar(); cur = conn.cursor()
         dias_registrados = 0
+        nuevos = []
         fecha_actual = fecha_inicio
         while fecha_actual <= fecha_fin:
             if "días hábiles" in motivo_sel.lower() and fecha_actual.weekday() >= 5:
@@ -930,9 +929,11 @@ def construir_dia_administrativo(frame_padre):
             cur.execute("SELECT COUNT(*) FROM dias_libres WHERE rut = ? AND fecha = ?", (rut, fecha_iso))
             if cur.fetchone()[0] == 0:
                 cur.execute("INSERT INTO dias_libres (rut, fecha, motivo) VALUES (?, ?, ?)", (rut, fecha_iso, motivo))
+                nuevos.append((rut, fecha_iso))
                 dias_registrados += 1
             fecha_actual += timedelta(days=1)
         conn.commit(); conn.close()
+        actualizar_dias(nuevos)
         messagebox.showinfo("Éxito", f"{dias_registrados} día(s) guardado(s) correctamente.")
         mostrar_vista_previa()
 
@@ -1024,7 +1025,7 @@ def construir_dia_administrativo(frame_padre):
         )
 
         # extras = todos menos 'Día Administrativo'
-        conn = sqlite3.connect("reloj_control.db"); cur = conn.cursor()
+        conn = conectar(); cur = conn.cursor()
         cur.execute("""
             SELECT COUNT(*) FROM dias_libres 
             WHERE rut = ? AND strftime('%Y', fecha) = ?
@@ -1061,17 +1062,23 @@ def construir_dia_administrativo(frame_padre):
 
     def actualizar_motivo(id_, entry_widget):
         nuevo_motivo = entry_widget.get().strip()
-        conn = sqlite3.connect("reloj_control.db"); cur = conn.cursor()
+        conn = conectar(); cur = conn.cursor()
         cur.execute("UPDATE dias_libres SET motivo = ? WHERE id = ?", (nuevo_motivo, id_))
+        cur.execute("SELECT rut, fecha FROM dias_libres WHERE id = ?", (id_,))
+        afectados = cur.fetchall()
         conn.commit(); conn.close()
+        actualizar_dias(afectados)
         messagebox.showinfo("Actualizado", "Motivo actualizado correctamente.")
 
     def eliminar_dia_admin(id_):
         if not messagebox.askyesno("Confirmar", "¿Deseas eliminar este día administrativo/permisos?"):
             return
-        conn = sqlite3.connect("reloj_control.db"); cur = conn.cursor()
+        conn = conectar(); cur = conn.cursor()
+        cur.execute("SELECT rut, fecha FROM dias_libres WHERE id = ?", (id_,))
+        afectados = cur.fetchall()
         cur.execute("DELETE FROM dias_libres WHERE id = ?", (id_,))
         conn.commit(); conn.close()
+        actualizar_dias(afectados)
         mostrar_vista_previa()
         messagebox.showinfo("Eliminado", "Registro eliminado correctamente.")
 
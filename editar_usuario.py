@@ -1,8 +1,8 @@
 # editar_usuario.py
 import os
-import sqlite3
-import threading
-import pickle
+from db import conectar
+from cache_horarios import invalidar_horarios
+import hechos_asistencia
 import time
 from datetime import datetime
 
@@ -17,6 +17,9 @@ import cv2
 import face_recognition
 import numpy as np
 
+from galeria_rostros import obtener_galeria
+from despacho_ui import ejecutar
+
 
 # ========================== PARÁMETROS BIOMÉTRICOS ==========================
 N_TARGET_SAMPLES = 8
@@ -100,12 +103,11 @@ def _quality_ok(frame_bgr, loc, *, min_face_size, min_lap, bright_min, bright_ma
 
 def _guardar_biometria(rut_original: str, frame_bgr, encodings_list):
     """
-    Guarda lista de encodings en PKL + foto JPG de referencia.
-    Actualiza la BD con el nombre de archivo NORMALIZADO (consistente con disco).
+    Guarda la lista de encodings en el almacén de plantillas + foto JPG de referencia.
+    Actualiza la BD con la referencia a la galería (RUT normalizado).
     """
     os.makedirs("rostros", exist_ok=True)
     rut_norm = _norm_rut_filename(rut_original)
-    ruta_pkl = os.path.join("rostros", f"{rut_norm}.pkl")
     ruta_jpg = os.path.join("rostros", f"{rut_norm}.jpg")
 
     try:
@@ -113,13 +115,13 @@ def _guardar_biometria(rut_original: str, frame_bgr, encodings_list):
     except Exception:
         pass
 
-    with open(ruta_pkl, "wb") as f:
-        pickle.dump(list(encodings_list), f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Escritura atómica en el almacén + refresco del índice en memoria
+    obtener_galeria().guardar_rut(rut_original, list(encodings_list))
 
-    con = sqlite3.connect("reloj_control.db")
+    con = conectar()
     cur = con.cursor()
     cur.execute("UPDATE trabajadores SET verificacion_facial = ? WHERE rut = ?",
-                (f"{rut_norm}.pkl", rut_original))
+                (f"galeria:{rut_norm}", rut_original))
     con.commit()
     con.close()
 
@@ -135,7 +137,7 @@ def _buscar_foto_por_rut_archivo(rut: str):
     return None
 
 def cargar_nombres_ruts():
-    con = sqlite3.connect("reloj_control.db")
+    con = conectar()
     cur = con.cursor()
     cur.execute("SELECT rut, nombre, apellido FROM trabajadores")
     nombres = []
@@ -272,24 +274,34 @@ def construir_edicion(frame_padre, on_actualizacion=None, on_volver_inicio=None)
 
     # ---------- Acciones ----------
     def cargar_usuario():
-        def tarea():
-            rut = entry_rut_buscar.get().strip()
-            if not rut:
-                label_estado.configure(text="⚠️ Ingresa un RUT válido", text_color="orange")
-                return
+        rut = entry_rut_buscar.get().strip()
+        if not rut:
+            label_estado.configure(text="⚠️ Ingresa un RUT válido", text_color="orange")
+            return
 
-            con = sqlite3.connect("reloj_control.db")
-            cur = con.cursor()
-            cur.execute("""
-                SELECT nombre, apellido, rut, profesion, correo, cumpleanos, verificacion_facial
-                FROM trabajadores WHERE rut = ?
-            """, (rut,))
-            trabajador = cur.fetchone()
+        def leer():
+            # Hilo trabajador: solo BD y galería, nada de widgets
+            con = conectar()
+            try:
+                cur = con.cursor()
+                cur.execute("""
+                    SELECT nombre, apellido, rut, profesion, correo, cumpleanos, verificacion_facial
+                    FROM trabajadores WHERE rut = ?
+                """, (rut,))
+                trabajador = cur.fetchone()
+                if not trabajador:
+                    return None
+                cur.execute("SELECT dia, turno, hora_entrada, hora_salida FROM horarios WHERE rut = ?", (rut,))
+                horarios = cur.fetchall()
+            finally:
+                con.close()
+            return trabajador, horarios, obtener_galeria().tiene_rut(rut)
 
-            if not trabajador:
+        def mostrar(datos):
+            if not datos:
                 label_estado.configure(text="❌ Usuario no encontrado", text_color="red")
-                con.close()
                 return
+            trabajador, horarios, con_rostro = datos
 
             entry_nombre.delete(0, 'end');   entry_nombre.insert(0, trabajador[0] or "")
             entry_apellido.delete(0, 'end'); entry_apellido.insert(0, trabajador[1] or "")
@@ -303,8 +315,6 @@ def construir_edicion(frame_padre, on_actualizacion=None, on_volver_inicio=None)
                     pass
 
             # Horarios
-            cur.execute("SELECT dia, turno, hora_entrada, hora_salida FROM horarios WHERE rut = ?", (rut,))
-            horarios = cur.fetchall()
             for _, _, ent, sal in campos_horarios:
                 ent.delete(0, 'end'); sal.delete(0, 'end')
             for dia, turno, h_in, h_out in horarios:
@@ -315,22 +325,23 @@ def construir_edicion(frame_padre, on_actualizacion=None, on_volver_inicio=None)
                         break
 
             # Verificación facial
-            ruta_pkl = os.path.join("rostros", f"{_norm_rut_filename(rut)}.pkl")
-            if os.path.exists(ruta_pkl):
+            if con_rostro:
                 label_verificacion.configure(text="✅ Rostro registrado", text_color="green")
             else:
                 label_verificacion.configure(text="⚠️ Rostro no registrado", text_color="orange")
 
-            con.close()
             label_estado.configure(text="✅ Usuario cargado", text_color="green")
 
-        threading.Thread(target=tarea, daemon=True).start()
+        def fallo(e):
+            label_estado.configure(text=f"❌ Error al cargar: {e}", text_color="red")
+
+        ejecutar(leer, al_terminar=mostrar, al_fallar=fallo, ambito=label_estado, nombre="cargar_usuario")
 
     def guardar_cambios():
         rut = entry_rut.get().strip()
         if not rut:
             return
-        con = sqlite3.connect("reloj_control.db")
+        con = conectar()
         cur = con.cursor()
         cur.execute("""
             UPDATE trabajadores SET nombre=?, apellido=?, profesion=?, correo=?, cumpleanos=?
@@ -352,6 +363,12 @@ def construir_edicion(frame_padre, on_actualizacion=None, on_volver_inicio=None)
                     VALUES (?, ?, ?, ?, ?)
                 """, (rut, dia, turno, h_in, h_out))
         con.commit(); con.close()
+        invalidar_horarios()
+        # Atrasos/extras dependen del horario: se recalcula la historia de este rut
+        try:
+            hechos_asistencia.reconstruir(ruts=[rut])
+        except Exception as e:
+            print("Aviso: no se pudo recalcular asistencia_dia:", e)
         label_estado.configure(text="✅ Cambios guardados", text_color="green")
         if on_actualizacion:
             on_actualizacion()
@@ -362,12 +379,18 @@ def construir_edicion(frame_padre, on_actualizacion=None, on_volver_inicio=None)
             return
         if not tk.messagebox.askyesno("Confirmar", f"¿Eliminar al usuario con RUT {rut}?"):
             return
-        con = sqlite3.connect("reloj_control.db")
+        con = conectar()
         cur = con.cursor()
         cur.execute("DELETE FROM trabajadores WHERE rut=?", (rut,))
         cur.execute("DELETE FROM horarios WHERE rut=?", (rut,))
         cur.execute("DELETE FROM registros WHERE rut=?", (rut,))
         con.commit(); con.close()
+        invalidar_horarios()
+        hechos_asistencia.borrar_rut(rut)
+        try:
+            obtener_galeria().eliminar_rut(rut)
+        except Exception:
+            pass
         # limpiar UI
         entry_rut_buscar.delete(0, 'end')
         for e in (entry_nombre, entry_apellido, entry_profesion, entry_correo):
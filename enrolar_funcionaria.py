@@ -1,4 +1,6 @@
-import os, pickle, cv2, numpy as np, face_recognition
+import os, cv2, numpy as np, face_recognition
+
+from galeria_rostros import obtener_galeria
 
 OUTPUT_DIR = "rostros"
 N_TARGET = 8                 # cantidad objetivo de muestras por persona (6–10)
@@ -24,12 +26,7 @@ def _quality_ok(frame, loc):
     return True, ""
 
 def _load_existing(rut):
-    path = os.path.join(OUTPUT_DIR, f"{rut}.pkl")
-    if not os.path.exists(path):
-        return []
-    with open(path, "rb") as f:
-        data = pickle.load(f)
-    return list(data) if isinstance(data, (list, tuple)) else [data]
+    return [np.array(e) for e in obtener_galeria().encodings_de(rut)]
 
 def enrolar(rut: str):
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -80,10 +77,9 @@ def enrolar(rut: str):
     cap.release(); cv2.destroyAllWindows()
 
     if samples:
-        out = os.path.join(OUTPUT_DIR, f"{rut}.pkl")
-        with open(out, "wb") as f:
-            pickle.dump(samples, f, protocol=pickle.HIGHEST_PROTOCOL)
-        print(f"✅ Guardado {len(samples)} muestras en {out}")
+        g = obtener_galeria()
+        g.guardar_rut(rut, samples)
+        print(f"✅ Guardado {len(samples)} muestras en {g.almacen.ruta_indice}")
     else:
         print("⚠️ No se guardaron muestras")
 
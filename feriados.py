@@ -1,5 +1,26 @@
 # feriados.py
-import sqlite3, datetime
+"""
+Calendario de feriados en memoria.
+
+Cada año se compila UNA vez (tabla 'feriados' + librería holidays de Chile) en:
+  - un mapa de bits de 366 días (1 = feriado),
+  - la lista ordenada de feriados con nombre e irrenunciable,
+  - la suma acumulada de días hábiles (lun-vie no feriados),
+y desde ahí se responden las consultas sin tocar la BD:
+
+  es_feriado(fecha)                    -> (es_feriado, nombre, irrenunciable)
+  feriados_en_rango(desde, hasta)      -> [(date, nombre, irrenunciable), ...]
+  dias_habiles_entre(desde, hasta)     -> int (ambos extremos incluidos)
+  sumar_dias_habiles(inicio, n)        -> date del n-ésimo día hábil contando 'inicio'
+
+Quien escribe en 'feriados' (marcar_feriado, borrar_feriado, sincronizar_feriados_chile,
+gestor de feriados del panel) llama a invalidar_feriados().
+"""
+import bisect
+import datetime
+import threading
+from itertools import accumulate
+from db import conectar, asegurar_esquema
 from typing import Tuple, Optional
 
 DB_PATH = "reloj_control.db"
@@ -13,24 +34,163 @@ except Exception:
     _HOL_LIB_OK = False
 
 
-def _ensure_schema():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS feriados (
-            fecha TEXT PRIMARY KEY,          -- 'YYYY-MM-DD'
-            nombre TEXT NOT NULL,
-            irrenunciable INTEGER NOT NULL DEFAULT 0
-        );
-    """)
-    con.commit()
-    con.close()
+# ============== CALENDARIO COMPILADO ==============
+class _Anio:
+    """Feriados de un año: mapa de bits por día del año + acumulado de días hábiles."""
+    __slots__ = ("anio", "inicio", "bits", "detalle", "ordinales", "habiles_acum")
+
+    def __init__(self, anio: int, feriados: dict):
+        self.anio = anio
+        self.inicio = datetime.date(anio, 1, 1).toordinal()
+        n = datetime.date(anio, 12, 31).toordinal() - self.inicio + 1
+        self.bits = bytearray(n)
+        self.detalle = {}                       # ordinal -> (nombre, irrenunciable)
+        for iso, (nombre, irr) in feriados.items():
+            o = datetime.date.fromisoformat(iso).toordinal()
+            self.bits[o - self.inicio] = 1
+            self.detalle[o] = (nombre, irr)
+        self.ordinales = sorted(self.detalle)
+        # habiles_acum[i] = días hábiles en [1-ene, 1-ene + i)
+        primer_dow = datetime.date(anio, 1, 1).weekday()
+        self.habiles_acum = [0] + list(accumulate(
+            1 if ((primer_dow + i) % 7 < 5 and not self.bits[i]) else 0 for i in range(n)))
+
+    def es_habil(self, ordinal: int) -> bool:
+        i = ordinal - self.inicio
+        return (ordinal - 1) % 7 < 5 and not self.bits[i]   # date.fromordinal(1) es lunes
+
+
+class CalendarioFeriados:
+    def __init__(self, db_path=None):
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        self._manuales = None        # {anio: {iso: (nombre, irrenunciable)}}
+        self._anios = {}             # {anio: _Anio}
+
+    def _leer_manuales(self):
+        asegurar_esquema(self._db_path or DB_PATH)
+        con = conectar(self._db_path or DB_PATH)
+        try:
+            filas = con.execute("SELECT fecha, nombre, irrenunciable FROM feriados").fetchall()
+        finally:
+            con.close()
+        manuales = {}
+        for fecha, nombre, irr in filas:
+            try:
+                d = datetime.date.fromisoformat(str(fecha)[:10])
+            except ValueError:
+                continue
+            manuales.setdefault(d.year, {})[d.isoformat()] = (nombre or "", bool(irr))
+        return manuales
+
+    def _compilar(self, anio: int) -> _Anio:
+        if self._manuales is None:       # ya dentro de self._lock
+            self._manuales = self._leer_manuales()
+        feriados = {}
+        if _HOL_LIB_OK:
+            for d, nombre in holidays.CL(years=anio).items():
+                feriados[d.isoformat()] = (str(nombre), False)
+        # Prioridad a lo cargado a mano en la tabla
+        feriados.update(self._manuales.get(anio, {}))
+        return _Anio(anio, feriados)
+
+    def _anio(self, anio: int) -> _Anio:
+        a = self._anios.get(anio)
+        if a is None:
+            with self._lock:
+                a = self._anios.get(anio)
+                if a is None:
+                    a = self._anios[anio] = self._compilar(anio)
+        return a
+
+    def invalidar(self):
+        with self._lock:
+            self._manuales = None
+            self._anios = {}
+
+    # ---------- consultas ----------
+    def es_feriado(self, fecha: datetime.date) -> Tuple[bool, Optional[str], bool]:
+        o = fecha.toordinal()
+        info = self._anio(fecha.year).detalle.get(o)
+        return (True, info[0], info[1]) if info else (False, None, False)
 
+    def _tabla(self) -> dict:
+        manuales = self._manuales
+        if manuales is None:
+            with self._lock:
+                if self._manuales is None:
+                    self._manuales = self._leer_manuales()
+                manuales = self._manuales
+        return manuales
 
+    def feriados_en_rango(self, desde: datetime.date, hasta: datetime.date, solo_tabla: bool = False) -> list:
+        if solo_tabla:
+            d1, d2 = desde.isoformat(), hasta.isoformat()
+            return [(datetime.date.fromisoformat(iso), nombre, irr)
+                    for anio in range(desde.year, hasta.year + 1)
+                    for iso, (nombre, irr) in sorted(self._tabla().get(anio, {}).items())
+                    if d1 <= iso <= d2]
+        d1, d2 = desde.toordinal(), hasta.toordinal()
+        salida = []
+        for anio in range(desde.year, hasta.year + 1):
+            a = self._anio(anio)
+            i = bisect.bisect_left(a.ordinales, d1)
+            j = bisect.bisect_right(a.ordinales, d2)
+            for o in a.ordinales[i:j]:
+                nombre, irr = a.detalle[o]
+                salida.append((datetime.date.fromordinal(o), nombre, irr))
+        return salida
+
+    def dias_habiles_entre(self, desde: datetime.date, hasta: datetime.date) -> int:
+        if hasta < desde:
+            return 0
+        total = 0
+        for anio in range(desde.year, hasta.year + 1):
+            a = self._anio(anio)
+            i = (desde.toordinal() - a.inicio) if anio == desde.year else 0
+            j = (hasta.toordinal() - a.inicio + 1) if anio == hasta.year else len(a.bits)
+            total += a.habiles_acum[j] - a.habiles_acum[i]
+        return total
+
+    def es_habil(self, fecha: datetime.date) -> bool:
+        return self._anio(fecha.year).es_habil(fecha.toordinal())
+
+    def sumar_dias_habiles(self, inicio: datetime.date, n: int) -> datetime.date:
+        """Fecha del n-ésimo día hábil contando desde 'inicio' inclusive (n <= 0 -> inicio)."""
+        fecha = inicio
+        contados = 0
+        while n > 0:
+            if self.es_habil(fecha):
+                contados += 1
+                if contados == n:
+                    break
+            fecha += datetime.timedelta(days=1)
+        return fecha
+
+
+# ============== INSTANCIA COMPARTIDA ==============
+_calendario = None
+_calendario_lock = threading.Lock()
+
+def obtener_calendario() -> CalendarioFeriados:
+    global _calendario
+    if _calendario is None:
+        with _calendario_lock:
+            if _calendario is None:
+                _calendario = CalendarioFeriados()
+    return _calendario
+
+def invalidar_feriados():
+    """Llamar después de escribir en la tabla feriados."""
+    if _calendario is not None:
+        _calendario.invalidar()
+
+
+# ============== API ==============
 def marcar_feriado(fecha: datetime.date, nombre: str, irrenunciable: bool = False):
     """Inserta/actualiza un feriado manual en la BD."""
-    _ensure_schema()
-    con = sqlite3.connect(DB_PATH)
+    asegurar_esquema(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
     cur.execute("""
         INSERT INTO feriados (fecha, nombre, irrenunciable)
@@ -41,15 +201,17 @@ def marcar_feriado(fecha: datetime.date, nombre: str, irrenunciable: bool = Fals
     """, (fecha.isoformat(), nombre.strip(), 1 if irrenunciable else 0))
     con.commit()
     con.close()
+    invalidar_feriados()
 
 
 def borrar_feriado(fecha: datetime.date):
-    _ensure_schema()
-    con = sqlite3.connect(DB_PATH)
+    asegurar_esquema(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
     cur.execute("DELETE FROM feriados WHERE fecha=?", (fecha.isoformat(),))
     con.commit()
     con.close()
+    invalidar_feriados()
 
 
 def es_feriado(fecha: datetime.date) -> Tuple[bool, Optional[str], bool]:
@@ -58,32 +220,35 @@ def es_feriado(fecha: datetime.date) -> Tuple[bool, Optional[str], bool]:
 
     Prioridad:
     1) Lo que esté en la tabla 'feriados' (manual).
-    2) Si está instalado 'holidays', consulta feriados de Chile del año correspondiente.
+    2) Si está instalado 'holidays', feriados de Chile del año correspondiente.
     """
-    _ensure_schema()
-    iso = fecha.isoformat()
+    return obtener_calendario().es_feriado(fecha)
 
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    row = cur.execute("SELECT nombre, irrenunciable FROM feriados WHERE fecha=?", (iso,)).fetchone()
-    con.close()
-    if row:
-        return True, row[0], bool(row[1])
 
-    if _HOL_LIB_OK:
-        cl = holidays.CL(years=fecha.year)
-        if iso in cl:
-            return True, str(cl.get(iso)), False
+def feriados_en_rango(desde: datetime.date, hasta: datetime.date, solo_tabla: bool = False) -> list:
+    """
+    [(date, nombre, irrenunciable), ...] ordenado, ambos extremos incluidos.
+    solo_tabla=True: solo los cargados en la tabla 'feriados' (sin la librería holidays).
+    """
+    return obtener_calendario().feriados_en_rango(desde, hasta, solo_tabla)
+
+
+def dias_habiles_entre(desde: datetime.date, hasta: datetime.date) -> int:
+    """Días lun-vie no feriados en [desde, hasta]."""
+    return obtener_calendario().dias_habiles_entre(desde, hasta)
+
 
-    return False, None, False
+def sumar_dias_habiles(inicio: datetime.date, n: int) -> datetime.date:
+    """Fecha en que se completan n días hábiles contando 'inicio' (salta fines de semana y feriados)."""
+    return obtener_calendario().sumar_dias_habiles(inicio, n)
 
 
 def sincronizar_feriados_chile(anio: int):
     """Rellena en BD los feriados del año indicado (si está instalada la librería 'holidays')."""
     if not _HOL_LIB_OK:
         raise RuntimeError("Instala primero: pip install holidays")
-    _ensure_schema()
-    con = sqlite3.connect(DB_PATH)
+    asegurar_esquema(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
     cl = holidays.CL(years=anio)
     for d, nombre in cl.items():
@@ -92,3 +257,4 @@ def sincronizar_feriados_chile(anio: int):
         """, (str(d), str(nombre)))
     con.commit()
     con.close()
+    invalidar_feriados()
@@ -0,0 +1,152 @@
+# galeria_rostros.py
+"""
+Índice en memoria de encodings faciales, compartido por todo el proceso.
+
+Se carga una sola vez (al inicio, en segundo plano) desde el almacén empaquetado
+(almacen_plantillas) y mantiene:
+  - una matriz float32 contigua (N x 128) con todas las muestras (mapeada en memoria),
+  - un mapa fila -> RUT (las filas de una misma persona quedan contiguas),
+  - la firma (mtime) del índice del almacén para invalidar por cambios en disco.
+
+verificar_rostro / reconocer_rostro_sin_rut leen desde aquí en vez de listar
+'rostros/' y deserializar cada .pkl en cada marcaje.
+"""
+import threading
+
+import numpy as np
+
+from almacen_plantillas import AlmacenPlantillas, ENCODING_DIM, clave_rut
+from condensacion_plantillas import K_PLANTILLAS, condensar
+
+
+# ============== ÍNDICE ==============
+class GaleriaRostros:
+    def __init__(self, almacen: AlmacenPlantillas | None = None):
+        self.almacen = almacen or AlmacenPlantillas()
+        self.carpeta = self.almacen.carpeta
+        self._lock = threading.RLock()
+        self._firma = None
+        self._matriz = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        self._ruts = []         # fila -> RUT formateado
+        self._filas = {}        # clave -> (inicio, fin)
+        self._cargada = False
+
+    # ---------- invalidación por mtime ----------
+    def sincronizar(self) -> bool:
+        """
+        Recarga el almacén solo si su índice cambió (un stat por llamada).
+        La primera vez migra los .pkl heredados si aún no existe el almacén.
+        Devuelve True si el índice en memoria cambió.
+        """
+        with self._lock:
+            if not self.almacen.existe() and self.almacen.pkl_existentes():
+                personas, plantillas = self.almacen.migrar_desde_pkl()
+                print(f"[galeria] migrados {plantillas} encodings de {personas} personas desde .pkl")
+            firma = self.almacen.firma()
+            if self._cargada and firma == self._firma:
+                return False
+            matriz, personas = self.almacen.cargar()
+            ruts, filas = [], {}
+            for k, (rut, ini, n) in personas.items():
+                ruts.extend([rut] * n)
+                filas[k] = (ini, ini + n)
+            self._matriz, self._ruts, self._filas = matriz, ruts, filas
+            self._firma = firma
+            self._cargada = True
+            return True
+
+    def _asegurar(self):
+        self.sincronizar()
+
+    # ---------- consultas ----------
+    def encodings_de(self, rut: str) -> np.ndarray:
+        """Matriz (k x 128) de la persona; vacía si no tiene plantillas."""
+        with self._lock:
+            self._asegurar()
+            rango = self._filas.get(clave_rut(rut))
+            if rango is None:
+                return np.empty((0, ENCODING_DIM), dtype=np.float32)
+            return self._matriz[rango[0]:rango[1]]
+
+    def todas(self):
+        """(matriz N x 128, lista fila->RUT). La matriz es de solo lectura."""
+        with self._lock:
+            self._asegurar()
+            return self._matriz, self._ruts
+
+    def filas_por_rut(self):
+        """{clave: (inicio, fin)} de cada persona dentro de la matriz."""
+        with self._lock:
+            self._asegurar()
+            return dict(self._filas)
+
+    def instantanea(self):
+        """(matriz, ruts por fila, filas por rut, firma) coherentes entre sí."""
+        with self._lock:
+            self._asegurar()
+            return self._matriz, self._ruts, dict(self._filas), self._firma
+
+    def tiene_rut(self, rut: str) -> bool:
+        return len(self.encodings_de(rut)) > 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ruts)
+
+    @property
+    def firma(self):
+        """Firma del almacén cargado (cambia con cada escritura); útil para cachés derivados."""
+        with self._lock:
+            return self._firma
+
+    # ---------- escrituras ----------
+    def guardar_rut(self, rut: str, encodings, agregar: bool = False, k: int | None = K_PLANTILLAS):
+        """
+        Persiste las plantillas de un RUT en el almacén (reemplazo o agregado
+        atómico) y refresca el índice en memoria. Con k (por defecto) el conjunto
+        resultante se condensa a lo más k medoides dentro de la misma escritura,
+        con el candado de la galería tomado (no se pierde lo que agregue otro proceso).
+        """
+        def _condensar(m):
+            c = condensar(m, k)
+            if len(c) < len(m):
+                print(f"[galeria] {rut}: {len(m)} -> {len(c)} plantillas (k={k})")
+            return c
+
+        transformar = None if k is None else _condensar
+        with self._lock:
+            if agregar:
+                self.almacen.agregar(rut, encodings, transformar)
+            else:
+                self.almacen.reemplazar(rut, encodings, transformar)
+            self.sincronizar()
+
+    def eliminar_rut(self, rut: str):
+        with self._lock:
+            self.almacen.eliminar(rut)
+            self.sincronizar()
+
+
+# ============== INSTANCIA DE PROCESO ==============
+_galeria = None
+_galeria_lock = threading.Lock()
+
+def obtener_galeria() -> GaleriaRostros:
+    global _galeria
+    with _galeria_lock:
+        if _galeria is None:
+            _galeria = GaleriaRostros()
+        return _galeria
+
+def precargar_en_segundo_plano():
+    """Carga el índice en un hilo para que el primer marcaje no pague el I/O."""
+    def _tarea():
+        try:
+            g = obtener_galeria()
+            g.sincronizar()
+            print(f"[galeria] {len(g)} encodings cargados")
+        except Exception as e:
+            print(f"[galeria] error precargando: {e}")
+    t = threading.Thread(target=_tarea, daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,296 @@
+# hechos_asistencia.py
+"""
+Hechos de asistencia por funcionario y día (tabla asistencia_dia).
+
+Cada fila resume un (rut, fecha) que tiene marcaje o día libre:
+  hora_ingreso / hora_salida           lo marcado
+  entrada_esperada / salida_esperada   del horario compilado (cache_horarios)
+  min_programados                      suma de bloques del día
+  min_trabajados                       salida - ingreso (día administrativo sin marcas: lo programado)
+  min_atraso                           sobre la primera entrada, con TOLERANCIA_INGRESO_MIN (igual que reportes)
+  min_salida_anticipada / min_extra    antes / después del fin de jornada
+  estado                               OK | SI (sin salida) | PS (salida autorizada por panel) | ADM | -
+  motivo                               motivo de dias_libres, si lo hay
+  observacion                          la del registro (NULL si no tiene)
+
+Se mantiene de forma incremental:
+  - marcaje.registrar_marcaje   -> dentro de la misma transacción del marcaje
+  - dia_administrativo           -> al guardar/editar/eliminar días libres
+  - panel_avanzado               -> cierre de jornada y salida anticipada del día
+  - editar_usuario               -> cambio de horario (reconstruye ese rut) o eliminación
+y para la historia:  python hechos_asistencia.py --reconstruir [--desde F] [--hasta F] [--rut R]
+
+Los feriados NO se guardan aquí: salen del calendario en memoria (feriados.py),
+así cambiar un feriado no obliga a reescribir hechos.
+"""
+import sys
+import math
+import argparse
+from datetime import date, datetime
+
+from db import conectar
+from cache_horarios import obtener_horarios, CacheHorarios, a_texto, a_segundos
+
+TOLERANCIA_INGRESO_MIN = 5     # mismo criterio que reportes.TOLERANCIA_MIN
+
+OK = "OK"
+SIN_SALIDA = "SI"
+SALIDA_AUTORIZADA = "PS"
+ADMINISTRATIVO = "ADM"
+SIN_MARCA = "-"
+
+COLUMNAS = ("rut", "fecha", "hora_ingreso", "hora_salida", "entrada_esperada", "salida_esperada",
+            "min_programados", "min_trabajados", "min_atraso", "min_salida_anticipada", "min_extra",
+            "estado", "motivo", "observacion", "actualizado_en")
+
+_FECHA_MIN, _FECHA_MAX = "0000-01-01", "9999-12-31"
+
+
+# ============== CÁLCULO ==============
+def calcular_dia(rut, fecha_iso, hora_ingreso, hora_salida, observacion, motivo,
+                 salida_autorizada=False, horarios=None, ahora=None,
+                 seg_ingreso=None, seg_salida=None) -> tuple:
+    """
+    Fila de asistencia_dia (en el orden de COLUMNAS) para un (rut, fecha).
+    seg_ingreso/seg_salida: registros.seg_* ya calculados por la BD; si faltan se leen del texto.
+    """
+    horarios = horarios or obtener_horarios()
+    bloques = horarios.bloques(rut, date.fromisoformat(fecha_iso))
+    fin = max(b.fin for b in bloques) if bloques else None
+    programados = sum(b.minutos for b in bloques)
+
+    s_ing = seg_ingreso if seg_ingreso is not None else a_segundos(hora_ingreso)
+    s_sal = seg_salida if seg_salida is not None else a_segundos(hora_salida)
+    if s_ing is not None and s_sal is not None and s_sal < s_ing:
+        s_sal += 24 * 3600           # salida al día siguiente (turno nocturno)
+
+    atraso = 0
+    if s_ing is not None and bloques:
+        delta = s_ing - bloques[0].inicio * 60
+        if delta > 60 * TOLERANCIA_INGRESO_MIN:
+            atraso = int(math.ceil((delta - 60 * TOLERANCIA_INGRESO_MIN) / 60.0))
+
+    if s_ing is not None and s_sal is not None:
+        trabajados = (s_sal - s_ing) // 60
+    elif motivo:
+        trabajados = programados
+    else:
+        trabajados = 0
+
+    anticipada = extra = 0
+    if s_sal is not None and fin is not None:
+        diff = s_sal // 60 - fin
+        anticipada, extra = max(0, -diff), max(0, diff)
+
+    if s_ing is not None:
+        estado = OK if s_sal is not None else (SALIDA_AUTORIZADA if salida_autorizada else SIN_SALIDA)
+    elif motivo:
+        estado = ADMINISTRATIVO
+    else:
+        estado = SIN_MARCA
+
+    return (rut, fecha_iso, hora_ingreso or None, hora_salida or None,
+            bloques[0].entrada if bloques else None, a_texto(fin) if fin is not None else None,
+            programados, int(trabajados), atraso, anticipada, extra,
+            estado, motivo or None, (observacion or "").strip() or None,
+            ahora or datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+
+# ============== LECTURA DE FUENTES ==============
+def _filtro_ruts(ruts):
+    if not ruts:
+        return "", ()
+    return f" AND rut IN ({','.join('?' * len(ruts))})", tuple(ruts)
+
+def _fuentes(cur, desde, hasta, ruts=None):
+    """{(rut, fecha): [ingreso, salida, observacion, motivo, seg_ingreso, seg_salida]} desde registros + dias_libres."""
+    filtro, params = _filtro_ruts(ruts)
+    datos = {}
+    cur.execute(f"""
+        SELECT rut, fecha, hora_ingreso, hora_salida, observacion, seg_ingreso, seg_salida
+        FROM registros
+        WHERE fecha BETWEEN ? AND ?{filtro}
+    """, (desde, hasta) + params)
+    for rut, fecha, hi, hs, obs, s_ing, s_sal in cur.fetchall():
+        datos[(rut, fecha)] = [hi, hs, obs, None, s_ing, s_sal]
+    cur.execute(f"""
+        SELECT rut, fecha, motivo
+        FROM dias_libres
+        WHERE fecha BETWEEN ? AND ?{filtro}
+    """, (desde, hasta) + params)
+    for rut, fecha, motivo in cur.fetchall():
+        datos.setdefault((rut, fecha), [None, None, None, None, None, None])[3] = motivo or "Día libre"
+    return datos
+
+def _salidas_autorizadas(cur, desde, hasta) -> set:
+    cur.execute("SELECT fecha FROM panel_flags WHERE fecha BETWEEN ? AND ? AND salida_anticipada=1",
+                (desde, hasta))
+    return {r[0] for r in cur.fetchall()}
+
+def _escribir(cur, datos, autorizadas, horarios):
+    ahora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    filas = []
+    for (rut, fecha), (hi, hs, obs, motivo, s_ing, s_sal) in datos.items():
+        try:
+            filas.append(calcular_dia(rut, fecha, hi, hs, obs, motivo, fecha in autorizadas, horarios, ahora,
+                                      s_ing, s_sal))
+        except ValueError:
+            continue     # fecha no ISO (no debería quedar ninguna tras crear_bd)
+    cur.executemany(f"INSERT OR REPLACE INTO asistencia_dia ({', '.join(COLUMNAS)}) "
+                    f"VALUES ({', '.join('?' * len(COLUMNAS))})", filas)
+    return len(filas)
+
+
+# ============== MANTENCIÓN INCREMENTAL ==============
+def _en_transaccion(con, trabajo):
+    """Ejecuta trabajo(cur) en la transacción del llamador o en una propia."""
+    cur = con.cursor()
+    propia = not con.in_transaction
+    try:
+        if propia:
+            cur.execute("BEGIN IMMEDIATE")
+        resultado = trabajo(cur)
+        if propia:
+            con.commit()
+        return resultado
+    except Exception:
+        if propia and con.in_transaction:
+            con.rollback()
+        raise
+
+def actualizar_dias(pares, con=None, db_path=None) -> int:
+    """
+    Recalcula los (rut, fecha 'YYYY-MM-DD') indicados. Si se pasa 'con' con una
+    transacción abierta, escribe dentro de ella (sin commit).
+    """
+    por_fecha = {}
+    for rut, fecha in pares:
+        por_fecha.setdefault(fecha, set()).add(rut)
+    if not por_fecha:
+        return 0
+
+    def _trabajo(cur):
+        n = 0
+        for fecha, ruts in por_fecha.items():
+            ruts = sorted(ruts)
+            datos = _fuentes(cur, fecha, fecha, ruts)
+            filtro, params = _filtro_ruts(ruts)
+            # Lo que ya no tiene marcaje ni día libre se borra
+            cur.execute(f"DELETE FROM asistencia_dia WHERE fecha = ?{filtro}", (fecha,) + params)
+            n += _escribir(cur, datos, _salidas_autorizadas(cur, fecha, fecha), obtener_horarios())
+        return n
+
+    propia = con is None
+    con = con or conectar(db_path)
+    try:
+        return _en_transaccion(con, _trabajo)
+    finally:
+        if propia:
+            con.close()
+
+def actualizar_dia(rut, fecha, con=None, db_path=None) -> int:
+    return actualizar_dias([(rut, fecha)], con=con, db_path=db_path)
+
+def actualizar_fecha(fecha, con=None, db_path=None) -> int:
+    """Recalcula todos los funcionarios de una fecha (cierre de jornada, salida anticipada)."""
+    fecha = fecha.isoformat() if isinstance(fecha, date) else str(fecha)[:10]
+    propia = con is None
+    con = con or conectar(db_path)
+    try:
+        cur = con.cursor()
+        cur.execute("""
+            SELECT rut FROM registros WHERE fecha = ?
+            UNION SELECT rut FROM dias_libres WHERE fecha = ?
+            UNION SELECT rut FROM asistencia_dia WHERE fecha = ?
+        """, (fecha, fecha, fecha))
+        pares = [(r[0], fecha) for r in cur.fetchall()]
+        return actualizar_dias(pares, con=con)
+    finally:
+        if propia:
+            con.close()
+
+def borrar_rut(rut, db_path=None):
+    con = conectar(db_path)
+    try:
+        con.execute("DELETE FROM asistencia_dia WHERE rut = ?", (rut,))
+        con.commit()
+    finally:
+        con.close()
+
+def reconstruir(desde=None, hasta=None, ruts=None, db_path=None) -> int:
+    """Rehace asistencia_dia en el rango (por defecto toda la historia) en una sola transacción."""
+    desde = desde.isoformat() if isinstance(desde, date) else (desde or _FECHA_MIN)
+    hasta = hasta.isoformat() if isinstance(hasta, date) else (hasta or _FECHA_MAX)
+    horarios = obtener_horarios() if db_path is None else CacheHorarios(db_path)
+
+    def _trabajo(cur):
+        filtro, params = _filtro_ruts(ruts)
+        cur.execute(f"DELETE FROM asistencia_dia WHERE fecha BETWEEN ? AND ?{filtro}", (desde, hasta) + params)
+        return _escribir(cur, _fuentes(cur, desde, hasta, ruts), _salidas_autorizadas(cur, desde, hasta), horarios)
+
+    con = conectar(db_path)
+    try:
+        return _en_transaccion(con, _trabajo)
+    finally:
+        con.close()
+
+
+# ============== CONSULTAS ==============
+def leer_rango(desde, hasta, ruts=None, db_path=None) -> dict:
+    """{(rut, fecha): {columna: valor}} para el rango (escaneo por índice)."""
+    desde = desde.isoformat() if isinstance(desde, date) else desde
+    hasta = hasta.isoformat() if isinstance(hasta, date) else hasta
+    filtro, params = _filtro_ruts(ruts)
+    con = conectar(db_path)
+    try:
+        cur = con.cursor()
+        cur.execute(f"""
+            SELECT {', '.join(COLUMNAS)} FROM asistencia_dia
+            WHERE fecha BETWEEN ? AND ?{filtro}
+        """, (desde, hasta) + params)
+        return {(f[0], f[1]): dict(zip(COLUMNAS, f)) for f in cur.fetchall()}
+    finally:
+        con.close()
+
+def totales_por_mes(rut, desde, hasta, db_path=None) -> dict:
+    """{'YYYY-MM': {trabajados, atraso, salida_anticipada, extra, dias_ok, dias_sin_salida, dias_adm}}."""
+    desde = desde.isoformat() if isinstance(desde, date) else desde
+    hasta = hasta.isoformat() if isinstance(hasta, date) else hasta
+    con = conectar(db_path)
+    try:
+        cur = con.cursor()
+        cur.execute("""
+            SELECT substr(fecha, 1, 7) AS mes,
+                   SUM(min_trabajados), SUM(min_atraso), SUM(min_salida_anticipada), SUM(min_extra),
+                   SUM(estado = 'OK'), SUM(estado IN ('SI', 'PS')), SUM(estado = 'ADM')
+            FROM asistencia_dia
+            WHERE rut = ? AND fecha BETWEEN ? AND ?
+            GROUP BY mes
+        """, (rut, desde, hasta))
+        claves = ("trabajados", "atraso", "salida_anticipada", "extra", "dias_ok", "dias_sin_salida", "dias_adm")
+        return {f[0]: dict(zip(claves, (int(v or 0) for v in f[1:]))) for f in cur.fetchall()}
+    finally:
+        con.close()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Hechos diarios de asistencia (asistencia_dia)")
+    ap.add_argument("--reconstruir", action="store_true", help="recalcular desde registros/dias_libres")
+    ap.add_argument("--desde", help="YYYY-MM-DD (por defecto: toda la historia)")
+    ap.add_argument("--hasta", help="YYYY-MM-DD")
+    ap.add_argument("--rut", action="append", help="limitar a un RUT (se puede repetir)")
+    ap.add_argument("--db", help="ruta de la BD (por defecto reloj_control.db)")
+    args = ap.parse_args(argv)
+    if not args.reconstruir:
+        ap.print_help()
+        return 1
+    from db import crear_bd
+    crear_bd(args.db or "reloj_control.db")
+    t = datetime.now()
+    n = reconstruir(args.desde, args.hasta, args.rut, db_path=args.db)
+    print(f"✅ asistencia_dia: {n} fila(s) recalculadas en {(datetime.now() - t).total_seconds():.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
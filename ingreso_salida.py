@@ -1,22 +1,23 @@
 # ingreso_salida.py
 import os
 import sys
-import shutil
-import face_recognition
-import dlib
 import customtkinter as ctk
-import sqlite3
 import tkinter as tk
-import pickle
-import cv2
 import time
 from datetime import datetime, timedelta
 
+from db import conectar
 from feriados import es_feriado
+from marcaje import registrar_marcaje, estado_dia, INGRESO, SALIDA
+from cache_horarios import obtener_horarios
+from decision_rostro import AcumuladorEvidencia
+from captura_camara import SesionCaptura, obtener_gestor_camara
+from carga_diferida import BIOMETRIA, CAPTURA
+from despacho_ui import ejecutar
+from servidor_reconocimiento import nuevo_analizador, servidor_activo, estado_galeria
 
-# ======== OpenCV: forzar backend estable y silenciar logs ========
-os.environ.setdefault("OPENCV_VIDEOIO_PRIORITY_MSMF", "0")
-os.environ.setdefault("OPENCV_LOG_LEVEL", "SILENT")
+# face_recognition / dlib / cv2 NO se importan aquí: los carga carga_diferida
+# en segundo plano (junto con la copia de modelos a %TEMP% y la galería).
 
 # ============== RUTAS ROBUSTAS PARA EJECUTABLE / INTERPRETADO ==============
 def _base_dir():
@@ -29,7 +30,6 @@ BASE = _base_dir()
 
 DB_PATH        = os.path.join(BASE, "reloj_control.db")
 ROSTROS_DIR    = os.path.join(BASE, "rostros")
-MODELOS_DIR    = os.path.join(BASE, "face_recognition_models", "models")
 SALIDAS_DIR    = os.path.join(BASE, "salidas_solicitudes")
 ASSETS_DIR     = os.path.join(BASE, "assets")
 
@@ -51,24 +51,6 @@ print(f"[init] DB_PATH={DB_PATH}")
 print(f"[init] ROSTROS_DIR={ROSTROS_DIR}")
 log(f"Inicio app | BASE={BASE}")
 
-# ============== MODELOS DLIB (copiamos a %TEMP% si hace falta) =============
-origen_dat = os.path.join(MODELOS_DIR, "shape_predictor_68_face_landmarks.dat")
-origen_5pt = os.path.join(MODELOS_DIR, "shape_predictor_5_face_landmarks.dat")
-destino_dir = os.path.join(os.environ.get("TEMP", ""), "face_recognition_models", "models")
-os.makedirs(destino_dir, exist_ok=True)
-destino_dat = os.path.join(destino_dir, "shape_predictor_68_face_landmarks.dat")
-destino_5pt = os.path.join(destino_dir, "shape_predictor_5_face_landmarks.dat")
-
-print(f"✅ Copiando modelo desde:\n  {origen_dat}\na:\n  {destino_dat}")
-try:
-    if os.path.exists(origen_dat) and not os.path.exists(destino_dat):
-        shutil.copy(origen_dat, destino_dat)
-    if os.path.exists(origen_5pt) and not os.path.exists(destino_5pt):
-        shutil.copy(origen_5pt, destino_5pt)
-except Exception as e:
-    print("Aviso: no se pudo copiar a TEMP:", e)
-    log(f"Aviso copia modelos: {e}")
-
 # ====================== HELPERS DE TIEMPO/BD ======================
 
 def parse_hora(hora_str):
@@ -89,7 +71,7 @@ def _dia_semana_es(fecha_iso: str) -> str:
 
 def _get_flag_salida_anticipada_local():
     try:
-        con = sqlite3.connect(DB_PATH)
+        con = conectar(DB_PATH)
         cur = con.cursor()
         cur.execute("""
             SELECT salida_anticipada, salida_anticipada_obs
@@ -109,26 +91,8 @@ def _hora_salida_oficial_por_horario(rut: str, fecha_iso: str, hora_ingreso_hhmm
     DEVUELVE LA SALIDA OFICIAL (FIN DE JORNADA): la ÚLTIMA hora_salida del día para el RUT y día de semana.
     Ignora colación. Si no hay turnos, retorna '17:30'.
     """
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    dia = _dia_semana_es(fecha_iso)
-    cur.execute("SELECT hora_entrada, hora_salida FROM horarios WHERE rut=? AND dia=?", (rut, dia))
-    turnos = cur.fetchall()
-    con.close()
-
-    if not turnos:
-        return "17:30"
-
-    salidas_validas = [s for (_e, s) in turnos if s and s.strip()]
-    if not salidas_validas:
-        return "17:30"
-
-    # Elegimos la mayor por hora del día (no contempla nocturnos cruzando medianoche)
-    try:
-        ultima = max(salidas_validas, key=lambda h: parse_hora(h))
-    except Exception:
-        ultima = max(salidas_validas)  # fallback por string
-    return ultima[:5]
+    # Horario compilado en memoria (considera turnos nocturnos)
+    return obtener_horarios().salida_esperada(rut, fecha_iso) or "17:30"
 
 # ================== EMERGENCIA: VALIDACIÓN POR RUT + CLAVE ==================
 CLAVE_MAESTRA = "2202225"
@@ -189,8 +153,13 @@ def _rut_valido(r: str) -> bool:
     return dv_calc == dv
 
 # ================== VERIFICACIÓN FACIAL ==================
-FACIAL_TOLERANCE = 0.50      # más bajo = más estricto
+FACIAL_TOLERANCE = 0.50      # más bajo = más estricto (media de los votos)
 DISTANCE_MARGIN  = 0.04
+# Votación temporal: decidir con N votos dentro de los últimos M cuadros codificados
+FACE_VENTANA_CUADROS  = 5
+FACE_VOTOS_REQUERIDOS = 2
+FACE_UMBRAL_VOTO      = 0.55  # un casi-acierto aún suma evidencia
+INGRESO_TOLERANCIA_MIN = 5   # atraso mayor a esto pide observación
 FRIDAY_FLEX_MINUTES = 30     # margen de “colación” (viernes)
 LATE_AFTER_EXIT_MINUTES = 60 # observación si supera la salida final por 60+ min  ✅
 
@@ -198,104 +167,88 @@ LATE_AFTER_EXIT_MINUTES = 60 # observación si supera la salida final por 60+ mi
 EXTRA_MINUTES_THRESHOLD = 60
 EXTRA_COUNT_ONLY_ABOVE_THRESHOLD = True
 
-def _ensure_list_encodings(obj):
-    if isinstance(obj, (list, tuple)):
-        return list(obj)
-    return [obj]
-
-# ===== Loader tolerante a variantes de nombre de archivo =====
-def _load_encodings_for_rut(rut: str):
-    candidatos = set()
-
-    r_fmt = _rut_formatear(rut)          # 12345678-K
-    r_raw = _rut_limpio(rut)             # 12345678K
-
-    # Variantes comunes con y sin guion, K/k
-    candidatos.update([
-        r_fmt,                            # 12345678-K
-        r_fmt.lower(),                    # 12345678-k
-        r_raw,                            # 12345678K
-        (r_raw[:-1] + "-" + r_raw[-1]) if len(r_raw) >= 2 else r_fmt,          # 12345678-K
-        ((r_raw[:-1] + "-" + r_raw[-1]).lower()) if len(r_raw) >= 2 else r_fmt  # 12345678-k
-    ])
-
-    for base in candidatos:
-        p = os.path.join(ROSTROS_DIR, f"{base}.pkl")
-        if os.path.exists(p):
-            with open(p, "rb") as f:
-                data = pickle.load(f)
-            return _ensure_list_encodings(data)
-    return []
-
-def _load_all_known_encodings():
-    encs, ruts = [], []
-    if not os.path.isdir(ROSTROS_DIR):
-        return encs, ruts
-    for archivo in os.listdir(ROSTROS_DIR):
-        if archivo.endswith(".pkl"):
-            rut = archivo[:-4]
-            for enc in _load_encodings_for_rut(rut):
-                encs.append(enc)
-                ruts.append(rut)
-    return encs, ruts
-
-def _debug_listar_pkl():
+def _minutos_extra_sobre(hora_actual_dt, hora_oficial_str) -> int:
+    """Exceso sobre la salida oficial que cuenta como extra (0 si no corresponde)."""
+    if not hora_oficial_str:
+        return 0
+    base = datetime.now().date()
+    t_act = datetime.combine(base, hora_actual_dt.time())
+    t_ofi = datetime.combine(base, parse_hora(hora_oficial_str).time())
+    exceso_min = int(max(0, (t_act - t_ofi).total_seconds() // 60))
+    if EXTRA_COUNT_ONLY_ABOVE_THRESHOLD:
+        return exceso_min if exceso_min >= EXTRA_MINUTES_THRESHOLD else 0
+    return exceso_min
+
+# ===== Estado de la galería (galeria_rostros) =====
+# Con el servidor de reconocimiento lanzado la galería vive en ese proceso y aquí
+# solo se piden sus conteos; sin él se lee el índice en memoria de este proceso.
+def _consultar_galeria(rut=None):
+    """{"personas", "encodings", "del_rut"} o None si no se pudo consultar."""
     try:
-        archivos = [a for a in os.listdir(ROSTROS_DIR) if a.endswith(".pkl")]
-        print(f"[enc] dir={ROSTROS_DIR} | archivos_pkl={len(archivos)}")
+        g = estado_galeria(rut)
     except Exception as e:
-        print(f"[enc] no se pudo listar pkl: {e}")
-
-# ------------------ Apertura robusta de cámara ------------------
-def _open_camera(max_index: int = 2):
-    try:
-        backends = [cv2.CAP_DSHOW, cv2.CAP_MSMF, cv2.CAP_VFW, cv2.CAP_ANY]
-    except Exception:
-        backends = [cv2.CAP_ANY]
-
-    errores = []
-    for i in range(0, max_index + 1):
-        for be in backends:
-            try:
-                cap = cv2.VideoCapture(i, be)
-            except TypeError:
-                cap = cv2.VideoCapture(i)
-            if cap is not None and cap.isOpened():
-                print(f"[cam] OK index={i} backend={be}", flush=True)
-                try:
-                    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-                except Exception:
-                    pass
-                return cap, f"index={i}, backend={be}"
-            if cap is not None:
-                cap.release()
-            errores.append(f"falló index={i}, backend={be}")
-    detalle = "; ".join(errores) if errores else "no backends probados"
-    print("[cam] No se pudo abrir cámara:", detalle, flush=True)
-    log("No se pudo abrir cámara: " + detalle)
-    return None, detalle
-
-def _warmup_camera(cap, n=12):
-    for _ in range(n):
-        cap.read()
-        time.sleep(0.02)
+        print(f"[enc] no se pudo consultar galería: {e}")
+        return None
+    print(f"[enc] personas={g['personas']} | encodings={g['encodings']}")
+    return g
+
+# ------------------ Cámara (sesión caliente compartida) ------------------
+# GestorCamara recuerda el último índice/backend que funcionó y mantiene el
+# dispositivo abierto mientras la pantalla de Ingreso/Salida está visible.
+def _adquirir_camara():
+    lector, info = obtener_gestor_camara().adquirir()
+    if lector is None:
+        log("No se pudo abrir cámara: " + info)
+    return lector, info
+
+def _nuevo_acumulador(margen_min: float = 0.0):
+    return AcumuladorEvidencia(ventana=FACE_VENTANA_CUADROS, votos=FACE_VOTOS_REQUERIDOS,
+                               umbral_voto=FACE_UMBRAL_VOTO, umbral_media=FACIAL_TOLERANCE,
+                               margen_min=margen_min)
+
+def _carga_motor():
+    """Lo que la UI necesita cargar: solo OpenCV si reconoce el servidor, si no el motor completo."""
+    return CAPTURA if servidor_activo() else BIOMETRIA
+
+def _motor():
+    """cv2 para captura y vista previa; espera a que termine la carga en segundo plano si hace falta."""
+    carga = _carga_motor()
+    return carga.obtener() if carga is CAPTURA else carga.obtener()[0]
+
+def _motor_listo() -> bool:
+    servidor = servidor_activo()
+    return _carga_motor().listo() and (servidor is None or servidor.listo)
 
 def verificar_rostro(rut):
-    _debug_listar_pkl()
-    expected_encs = _load_encodings_for_rut(rut)
-    print(f"[enc] para {rut}: {len(expected_encs)} encodings")
-    if not expected_encs:
+    cv2 = _motor()
+    from pipeline_rostro import dibujar_resultado
+
+    galeria = _consultar_galeria(rut)
+    if galeria is None:
+        log("verificar_rostro: galería no disponible")
+        return False
+    print(f"[enc] para {rut}: {galeria['del_rut']} encodings")
+    if not galeria["del_rut"]:
         log(f"verificar_rostro: no hay encodings para {rut}")
         return False
 
-    cap, info = _open_camera()
-    if not cap:
+    lector, info = _adquirir_camara()
+    if lector is None:
         log("verificar_rostro: cámara no abierta (" + info + ")")
         return False
 
-    print(f"[cam] iniciado verificación; encodings={len(expected_encs)}", flush=True)
-    _warmup_camera(cap, 12)
+    print(f"[cam] iniciado verificación; encodings={galeria['del_rut']}", flush=True)
+
+    analizador = nuevo_analizador(rut)     # servidor de reconocimiento o local
+    evidencia = _nuevo_acumulador()
+
+    # Corre en el hilo de reconocimiento, siempre sobre el cuadro más reciente
+    def _procesar(frame):
+        res, match = analizador.analizar(frame)
+        ok = False
+        if match is not None:
+            ok = evidencia.agregar(rut, match[1]) is not None
+        return res, ok
 
     cv2.namedWindow("Verificación Facial", cv2.WINDOW_NORMAL)
     cv2.resizeWindow("Verificación Facial", 800, 600)
@@ -303,68 +256,82 @@ def verificar_rostro(rut):
     t0 = time.time()
     duracion = 10.0  # segundos mínimos de captura
     verificado = False
-    instrucciones_mostradas = False
-
-    while time.time() - t0 < duracion:
-        ret, frame = cap.read()
-        if not ret:
-            time.sleep(0.02)
-            continue
 
-        restante = max(0, int(duracion - (time.time() - t0)))
-        cv2.putText(frame, f"Tiempo restante: {restante}s", (40, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-
-        if not instrucciones_mostradas:
+    # La vista previa se dibuja a su ritmo; no espera al encoder
+    sesion = SesionCaptura(lector, _procesar).iniciar()
+    try:
+        while time.time() - t0 < duracion:
+            frame = sesion.cuadro_preview()
+            if frame is None:
+                time.sleep(0.01)
+                continue
+            if sesion.trabajador.error is not None:
+                print("Error en pipeline facial:", sesion.trabajador.error, flush=True)
+                log(f"pipeline facial error: {sesion.trabajador.error}")
+                break
+
+            restante = max(0, int(duracion - (time.time() - t0)))
+            cv2.putText(frame, f"Tiempo restante: {restante}s", (40, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
             cv2.putText(frame, "Mire al frente sin moverse", (40, 70),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 255), 2)
-            instrucciones_mostradas = True
 
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        try:
-            rostros = face_recognition.face_encodings(rgb)
-        except Exception as e:
-            print("Error en face_encodings:", e, flush=True)
-            log(f"face_encodings error: {e}")
-            break
-
-        if rostros:
-            if len(rostros) > 1:
-                cv2.putText(frame, "Por favor, solo 1 persona frente a la camara", (40, 110),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-            cand = rostros[0]
-            dists = face_recognition.face_distance(expected_encs, cand)
-            best = float(min(dists)) if len(dists) else 1.0
-            if best <= FACIAL_TOLERANCE:
-                verificado = True
-
-        cv2.imshow("Verificación Facial", frame)
-        if (cv2.waitKey(1) & 0xFF == ord('q')) or verificado:
-            break
-
-    cap.release()
+            ultimo = sesion.trabajador.ultimo_resultado()
+            if ultimo:
+                res, ok = ultimo
+                dibujar_resultado(frame, res)
+                verificado = verificado or ok
+            cv2.putText(frame, evidencia.progreso(), (40, 430),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (124, 255, 124), 2)
+
+            _fps_cap, _fps_desc, _fps_rec = sesion.stats.por_segundo()
+            cv2.putText(frame, f"cam {_fps_cap:.0f}/s | desc {_fps_desc:.0f}/s | rec {_fps_rec:.1f}/s", (40, 460),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
+            cv2.imshow("Verificación Facial", frame)
+            if (cv2.waitKey(15) & 0xFF == ord('q')) or verificado:
+                break
+    finally:
+        sesion.detener()
+        analizador.cerrar()
+        obtener_gestor_camara().soltar()
+        log(f"verificar_rostro stats: {sesion.stats.resumen()}")
+
     cv2.destroyAllWindows()
     print(f"[cam] verificación fin -> {'OK' if verificado else 'FAIL'}", flush=True)
     return verificado
 
 def reconocer_rostro_sin_rut():
-    _debug_listar_pkl()
-    known_encs, rut_map = _load_all_known_encodings()
-    print(f"[enc] total encodings en carpeta: {len(known_encs)}")
-    if not known_encs:
+    cv2 = _motor()
+    from pipeline_rostro import dibujar_resultado
+
+    galeria = _consultar_galeria()
+    if galeria is None:
+        log("reconocer_rostro_sin_rut: galería no disponible")
+        return None
+    if not galeria["personas"]:
         log("reconocer_rostro_sin_rut: no hay encodings en carpeta 'rostros'")
         return None
 
-    import numpy as np
-    known_matrix = np.vstack(known_encs)
-
-    cap, info = _open_camera()
-    if not cap:
+    lector, info = _adquirir_camara()
+    if lector is None:
         log("reconocer_rostro_sin_rut: cámara no abierta (" + info + ")")
         return None
 
     print("[cam] iniciado reconocimiento abierto", flush=True)
-    _warmup_camera(cap, 12)
+
+    analizador = nuevo_analizador()
+    evidencia = _nuevo_acumulador(margen_min=DISTANCE_MARGIN)
+
+    # Corre en el hilo de reconocimiento, siempre sobre el cuadro más reciente
+    def _procesar(frame):
+        res, match = analizador.analizar(frame)
+        rut = None
+        if match is not None:
+            # Mejor persona y margen contra la 2ª mejor PERSONA (no plantilla);
+            # la decisión sale de la evidencia acumulada en varios cuadros
+            rut_best, best_dist, margen = match
+            rut = evidencia.agregar(rut_best, best_dist, margen)
+        return res, rut
 
     cv2.namedWindow("Reconocimiento Automático", cv2.WINDOW_NORMAL)
     cv2.resizeWindow("Reconocimiento Automático", 800, 600)
@@ -373,117 +340,63 @@ def reconocer_rostro_sin_rut():
     duracion = 10.0
     rostro_detectado = None
 
-    while time.time() - t0 < duracion:
-        ret, frame = cap.read()
-        if not ret:
-            time.sleep(0.02)
-            continue
-
-        restante = max(0, int(duracion - (time.time() - t0)))
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        try:
-            rostros_en_vivo = face_recognition.face_encodings(rgb)
-        except Exception as e:
-            print("Error en face_encodings:", e, flush=True)
-            log(f"face_encodings error: {e}")
-            break
-
-        if rostros_en_vivo:
-            cand = rostros_en_vivo[0]
-            dists = face_recognition.face_distance(known_matrix, cand)
-
-            idxs = np.argsort(dists)
-            best_idx = int(idxs[0])
-            best_dist = float(dists[best_idx])
-            second_best = float(dists[idxs[1]]) if len(dists) > 1 else None
-
-            seguro = (best_dist <= FACIAL_TOLERANCE) and \
-                     (second_best is None or (second_best - best_dist) >= DISTANCE_MARGIN)
-
-            if seguro:
-                rostro_detectado = rut_map[best_idx]
-
-        cv2.imshow("Reconocimiento Automático", frame)
-        if (cv2.waitKey(1) & 0xFF == ord('q')) or rostro_detectado:
-            break
+    sesion = SesionCaptura(lector, _procesar).iniciar()
+    try:
+        while time.time() - t0 < duracion:
+            frame = sesion.cuadro_preview()
+            if frame is None:
+                time.sleep(0.01)
+                continue
+            if sesion.trabajador.error is not None:
+                print("Error en pipeline facial:", sesion.trabajador.error, flush=True)
+                log(f"pipeline facial error: {sesion.trabajador.error}")
+                break
+
+            ultimo = sesion.trabajador.ultimo_resultado()
+            if ultimo:
+                res, rut = ultimo
+                dibujar_resultado(frame, res)
+                rostro_detectado = rostro_detectado or rut
+            cv2.putText(frame, evidencia.progreso(), (40, 430),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (124, 255, 124), 2)
+
+            _fps_cap, _fps_desc, _fps_rec = sesion.stats.por_segundo()
+            cv2.putText(frame, f"cam {_fps_cap:.0f}/s | desc {_fps_desc:.0f}/s | rec {_fps_rec:.1f}/s", (40, 460),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
+            cv2.imshow("Reconocimiento Automático", frame)
+            if (cv2.waitKey(15) & 0xFF == ord('q')) or rostro_detectado:
+                break
+    finally:
+        sesion.detener()
+        analizador.cerrar()
+        obtener_gestor_camara().soltar()
+        log(f"reconocer_rostro_sin_rut stats: {sesion.stats.resumen()}")
 
-    cap.release()
     cv2.destroyAllWindows()
     print(f"[cam] reconocimiento fin -> {rostro_detectado}", flush=True)
     return rostro_detectado
 
-def verificar_rostro_async(rut, callback_exito, callback_error):
-    def proceso():
-        try:
-            exito = verificar_rostro(rut)
-            if exito:
-                callback_exito()
-            else:
-                callback_error()
-        except Exception as e:
-            log(f"Error en verificación: {e}")
-            print("Error en verificación:", e)
-            callback_error()
-    import threading
-    threading.Thread(target=proceso, daemon=True).start()
-
-def reconocer_rostro_async(callback_exito, callback_error):
-    def proceso():
-        try:
-            rut_detectado = reconocer_rostro_sin_rut()
-            if rut_detectado:
-                callback_exito(rut_detectado)
-            else:
-                callback_error()
-        except Exception as e:
-            log(f"Error en reconocimiento: {e}")
-            print("Error en reconocimiento:", e)
-            callback_error()
-    import threading
-    threading.Thread(target=proceso, daemon=True).start()
-
-# ============== EXTRAS MENSUALES (TABLA Y UTILIDADES) ==============
-def _extras_ensure_schema():
-    try:
-        con = sqlite3.connect(DB_PATH)
-        cur = con.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS extras_mensuales (
-                rut TEXT NOT NULL,
-                anio_mes TEXT NOT NULL,           -- 'YYYY-MM'
-                minutos_extra INTEGER NOT NULL DEFAULT 0,
-                updated_at TEXT,
-                PRIMARY KEY (rut, anio_mes)
-            )
-        """)
-        con.commit()
-        con.close()
-    except Exception as e:
-        log(f"extras schema error: {e}")
-
-def _extras_sumar_minutos(rut: str, fecha_iso: str, minutos: int):
-    """Suma 'minutos' al registro mensual (YYYY-MM). Si no existe, lo crea."""
-    try:
-        if minutos <= 0:
-            return
-        anio_mes = fecha_iso[:7]  # 'YYYY-MM'
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        con = sqlite3.connect(DB_PATH)
-        cur = con.cursor()
-        cur.execute("""
-            INSERT INTO extras_mensuales (rut, anio_mes, minutos_extra, updated_at)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(rut, anio_mes) DO UPDATE SET
-                minutos_extra = minutos_extra + excluded.minutos_extra,
-                updated_at = excluded.updated_at
-        """, (rut, anio_mes, int(minutos), now))
-        con.commit()
-        con.close()
-    except Exception as e:
-        log(f"extras sumar error: {e}")
-
-# Crear esquema de extras al cargar el módulo
-_extras_ensure_schema()
+def verificar_rostro_async(rut, callback_exito, callback_error, ambito=None):
+    """verificar_rostro en un trabajador; los callbacks corren en el hilo de Tk."""
+    def _fallo(e):
+        log(f"Error en verificación: {e}")
+        print("Error en verificación:", e)
+        callback_error()
+    return ejecutar(
+        verificar_rostro, rut,
+        al_terminar=lambda exito: callback_exito() if exito else callback_error(),
+        al_fallar=_fallo, ambito=ambito, nombre="verificar_rostro")
+
+def reconocer_rostro_async(callback_exito, callback_error, ambito=None):
+    """reconocer_rostro_sin_rut en un trabajador; los callbacks corren en el hilo de Tk."""
+    def _fallo(e):
+        log(f"Error en reconocimiento: {e}")
+        print("Error en reconocimiento:", e)
+        callback_error()
+    return ejecutar(
+        reconocer_rostro_sin_rut,
+        al_terminar=lambda rut_detectado: callback_exito(rut_detectado) if rut_detectado else callback_error(),
+        al_fallar=_fallo, ambito=ambito, nombre="reconocer_rostro")
 
 # ================== UI PRINCIPAL ==================
 def construir_ingreso_salida(frame_padre):
@@ -586,15 +499,11 @@ def construir_ingreso_salida(frame_padre):
         boton_ingreso.pack_forget()
         boton_salida.pack_forget()
 
-    def actualizar_estado_botones(rut, por_reconocimiento=False):
-        conexion = sqlite3.connect(DB_PATH)
-        cursor = conexion.cursor()
-        cursor.execute("""
-            SELECT hora_ingreso, hora_salida FROM registros
-            WHERE rut = ? AND DATE(fecha) = ?
-        """, (rut, HOY))
-        resultado = cursor.fetchone()
-        conexion.close()
+    def actualizar_estado_botones(rut, por_reconocimiento=False, estado=None):
+        # 'estado' (marcaje.EstadoDia) evita releer la fila recién escrita
+        if estado is None:
+            estado = estado_dia(rut, HOY)
+        resultado = (estado.hora_ingreso, estado.hora_salida) if estado.motivo != "sin_registro" else None
 
         boton_ingreso.pack_forget()
         boton_salida.pack_forget()
@@ -648,185 +557,78 @@ def construir_ingreso_salida(frame_padre):
         }
         dia_semana = dias_traducidos.get(dia_actual, '')
 
-        conexion = sqlite3.connect(DB_PATH)
-        cursor = conexion.cursor()
-        cursor.execute("""
-            SELECT hora_entrada, hora_salida FROM horarios
-            WHERE rut = ? AND dia = ?
-        """, (rut, dia_semana))
-        bloques = cursor.fetchall()
+        bloques = [tuple(b) for b in obtener_horarios().bloques(rut, dia_semana)]
+
+        def _minutos_extra(hora_oficial_str):
+            return _minutos_extra_sobre(hora_actual_dt, hora_oficial_str)
+
+        def _salida_oficial(hora_ingreso_hhmm):
+            return _hora_salida_oficial_por_horario(rut, fecha_iso, hora_ingreso_hhmm)
+
+        def _mostrar_registrado(estado, texto, espera_ms):
+            label_estado.configure(text=texto, text_color="green")
+            actualizar_estado_botones(rut, por_reconocimiento=False, estado=estado)
+            label_hora_registro.configure(text=f"⏰ Hora de registro: {hora_actual}", text_color="yellow")
+            frame.after(espera_ms, limpiar_campos)
 
         # ---- REGISTRA EN BD (aplica panel/feriado/viernes-flex) ----
+        # Una sola transacción en marcaje.registrar_marcaje (UPSERT por rut+fecha)
         def registrar_final(observacion="", usar_hora_oficial_salida=False):
             if es_f:
                 observacion = (observacion + " | " if observacion else "") + obs_feriado
 
             if tipo == "ingreso":
-                cursor.execute("""
-                    SELECT hora_ingreso FROM registros WHERE rut = ? AND DATE(fecha) = ?
-                """, (rut, HOY))
-                resultado = cursor.fetchone()
-                if resultado:
-                    if resultado[0]:
-                        label_estado.configure(text="⚠️ Ya registraste un ingreso hoy.", text_color="orange")
-                        conexion.close()
-                        return
-                    else:
-                        cursor.execute("""
-                            UPDATE registros SET hora_ingreso = ?, observacion = ? 
-                            WHERE rut = ? AND DATE(fecha) = ?
-                        """, (hora_actual, observacion, rut, HOY))
-                        conexion.commit()
-                else:
-                    cursor.execute("""
-                        INSERT INTO registros (rut, nombre, fecha, hora_ingreso, hora_salida, observacion)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, (rut, nombre, fecha_iso, hora_actual, None, observacion))
-                    conexion.commit()
-                conexion.close()
-                label_estado.configure(
-                    text=("Ingreso registrado correctamente ✅\n"
-                          "Limpieza automática en 5 seg..." if not es_f else
-                          f"Ingreso en feriado registrado ✅ ({nombre_f}).\nLimpieza automática en 60 seg..."),
-                    text_color="green"
-                )
-                boton_ingreso.pack_forget()
-                boton_salida.pack_forget()
-                actualizar_estado_botones(rut, por_reconocimiento=False)
-                label_hora_registro.configure(text=f"⏰ Hora de registro: {hora_actual}", text_color="yellow")
-                frame.after(5000 if not es_f else 60000, limpiar_campos)
+                estado = registrar_marcaje(rut, fecha_iso, INGRESO, hora_actual, nombre=nombre,
+                                           observacion=observacion)
+                if not estado.registrado:
+                    label_estado.configure(text="⚠️ Ya registraste un ingreso hoy.", text_color="orange")
+                    return
+                _mostrar_registrado(
+                    estado,
+                    "Ingreso registrado correctamente ✅\n"
+                    "Limpieza automática en 5 seg..." if not es_f else
+                    f"Ingreso en feriado registrado ✅ ({nombre_f}).\nLimpieza automática en 60 seg...",
+                    5000 if not es_f else 60000)
 
             elif tipo == "salida":
                 # Panel de salida anticipada (guarda hora oficial) → NO suma extras
                 flag, obs_aut = _get_flag_salida_anticipada_local()
                 if flag and not es_f:
-                    cursor.execute("""
-                        SELECT hora_ingreso, observacion FROM registros 
-                        WHERE rut=? AND DATE(fecha)=?
-                    """, (rut, HOY))
-                    row = cursor.fetchone()
-                    hora_ingreso_hhmm = row[0] if row else None
-                    hora_oficial = _hora_salida_oficial_por_horario(rut, fecha_iso, hora_ingreso_hhmm)
-                    obs_concat = (row[1] + " | " if row and row[1] else "") + (obs_aut or "Salida anticipada autorizada")
-
-                    # Doble-check salida ya registrada
-                    cursor.execute("SELECT hora_salida FROM registros WHERE rut=? AND DATE(fecha)=?", (rut, HOY))
-                    hs = cursor.fetchone()
-                    if hs and hs[0]:
+                    estado = registrar_marcaje(rut, fecha_iso, SALIDA, hora_actual, nombre=nombre,
+                                               observacion=obs_aut or "Salida anticipada autorizada",
+                                               concatenar_observacion=True,
+                                               salida_oficial=_salida_oficial, usar_hora_oficial=True)
+                    if not estado.registrado:
                         label_estado.configure(text="⚠️ Ya registraste una salida hoy.", text_color="orange")
-                        conexion.close()
                         return
-
-                    if row:
-                        cursor.execute("""
-                            UPDATE registros SET hora_salida=?, observacion=? 
-                            WHERE rut=? AND DATE(fecha)=?
-                        """, (hora_oficial, obs_concat, rut, HOY))
-                    else:
-                        cursor.execute("""
-                            INSERT INTO registros (rut, nombre, fecha, hora_ingreso, hora_salida, observacion)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        """, (rut, nombre, fecha_iso, None, hora_oficial, obs_aut or "Salida anticipada autorizada"))
-                    conexion.commit()
-                    conexion.close()
-
-                    # No sumar extras (se guardó hora oficial)
-                    label_estado.configure(
-                        text=f"Salida anticipada registrada ✅ (hora oficial {hora_oficial}).\nLimpieza automática en 5 seg...",
-                        text_color="green"
-                    )
-                    boton_ingreso.pack_forget()
-                    boton_salida.pack_forget()
-                    actualizar_estado_botones(rut, por_reconocimiento=False)
-                    label_hora_registro.configure(text=f"⏰ Hora de registro: {hora_actual}", text_color="yellow")
-                    frame.after(5000, limpiar_campos)
+                    _mostrar_registrado(
+                        estado,
+                        f"Salida anticipada registrada ✅ (hora oficial {estado.hora_oficial}).\n"
+                        f"Limpieza automática en 5 seg...",
+                        5000)
                     return
 
-                # Flujo normal (sin panel)
-                cursor.execute("""
-                    SELECT hora_salida FROM registros WHERE rut = ? AND DATE(fecha) = ?
-                """, (rut, HOY))
-                resultado = cursor.fetchone()
-                if resultado and resultado[0]:
+                # Flujo normal (sin panel): hora actual o hora oficial (regla viernes);
+                # los extras se suman en la misma transacción
+                estado = registrar_marcaje(rut, fecha_iso, SALIDA, hora_actual, nombre=nombre,
+                                           observacion=observacion,
+                                           salida_oficial=_salida_oficial,
+                                           usar_hora_oficial=usar_hora_oficial_salida,
+                                           minutos_extra=_minutos_extra)
+                if not estado.registrado:
                     label_estado.configure(text="⚠️ Ya registraste una salida hoy.", text_color="orange")
-                    conexion.close()
                     return
 
-                # ¿Usar hora oficial (regla viernes) o hora actual?
-                hora_db = hora_actual
-                hora_oficial_usada = None
-                if usar_hora_oficial_salida:
-                    cursor.execute("""
-                        SELECT hora_ingreso, observacion FROM registros 
-                        WHERE rut=? AND DATE(fecha)=?
-                    """, (rut, HOY))
-                    row = cursor.fetchone()
-                    hora_ingreso_hhmm = row[0] if row else None
-                    hora_oficial = _hora_salida_oficial_por_horario(rut, fecha_iso, hora_ingreso_hhmm)
-                    hora_db = f"{hora_oficial}:00" if len(hora_oficial) == 5 else hora_oficial
-                    hora_oficial_usada = hora_oficial
-
-                # Guardar salida
-                if resultado:
-                    cursor.execute("""
-                        UPDATE registros SET hora_salida = ?, observacion = ? 
-                        WHERE rut = ? AND DATE(fecha) = ?
-                    """, (hora_db, observacion, rut, HOY))
-                    conexion.commit()
-                else:
-                    cursor.execute("""
-                        INSERT INTO registros (rut, nombre, fecha, hora_ingreso, hora_salida, observacion)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, (rut, nombre, fecha_iso, None, hora_db, observacion))
-                    conexion.commit()
-                conexion.close()
-
-                # ---- SUMA DE EXTRAS (si corresponde) ----
-                if not usar_hora_oficial_salida:
-                    try:
-                        con2 = sqlite3.connect(DB_PATH)
-                        cur2 = con2.cursor()
-                        cur2.execute("SELECT hora_ingreso FROM registros WHERE rut=? AND DATE(fecha)=?", (rut, HOY))
-                        row = cur2.fetchone()
-                        con2.close()
-                        hora_ingreso_hhmm = row[0] if row and row[0] else None
-                        hora_oficial_str = _hora_salida_oficial_por_horario(rut, fecha_iso, hora_ingreso_hhmm)
-                        if hora_oficial_str:
-                            base = datetime.now().date()
-                            t_act = datetime.combine(base, hora_actual_dt.time())
-                            t_ofi_time = parse_hora(hora_oficial_str)
-                            t_ofi = datetime.combine(base, t_ofi_time.time())
-                            exceso_min = int(max(0, (t_act - t_ofi).total_seconds() // 60))
-                            if EXTRA_COUNT_ONLY_ABOVE_THRESHOLD:
-                                exceso_contable = exceso_min if exceso_min >= EXTRA_MINUTES_THRESHOLD else 0
-                            else:
-                                exceso_contable = exceso_min
-                            if exceso_contable > 0:
-                                _extras_sumar_minutos(rut, fecha_iso, exceso_contable)
-                    except Exception as e:
-                        log(f"calc extras error: {e}")
-
                 # Mensajes finales
-                if usar_hora_oficial_salida and hora_oficial_usada:
-                    label_estado.configure(
-                        text=(f"Salida de viernes (colación) registrada ✅\n"
-                              f"Se guarda la hora oficial {hora_oficial_usada}.\n"
-                              f"Limpieza automática en 5 seg..."),
-                        text_color="green"
-                    )
+                if usar_hora_oficial_salida and estado.hora_oficial:
+                    texto = (f"Salida de viernes (colación) registrada ✅\n"
+                             f"Se guarda la hora oficial {estado.hora_oficial}.\n"
+                             f"Limpieza automática en 5 seg...")
                 else:
-                    label_estado.configure(
-                        text=("Salida registrada correctamente ✅\n"
-                              "Limpieza automática en 5 seg..." if not es_f else
-                              f"Salida en feriado registrada ✅ ({nombre_f}).\nLimpieza automática en 60 seg..."),
-                        text_color="green"
-                    )
-
-                boton_ingreso.pack_forget()
-                boton_salida.pack_forget()
-                actualizar_estado_botones(rut, por_reconocimiento=False)
-                label_hora_registro.configure(text=f"⏰ Hora de registro: {hora_actual}", text_color="yellow")
-                frame.after(5000 if not es_f else 60000, limpiar_campos)
+                    texto = ("Salida registrada correctamente ✅\n"
+                             "Limpieza automática en 5 seg..." if not es_f else
+                             f"Salida en feriado registrada ✅ ({nombre_f}).\nLimpieza automática en 60 seg...")
+                _mostrar_registrado(estado, texto, 5000 if not es_f else 60000)
 
         # ---------- Reglas para pedir observación ----------
         if es_f:
@@ -843,7 +645,7 @@ def construir_ingreso_salida(frame_padre):
                     continue
                 hora_entrada_dt = parse_hora(hora_entrada)
                 delta = (hora_actual_dt - hora_entrada_dt).total_seconds()
-                if delta <= 5 * 60:
+                if delta <= INGRESO_TOLERANCIA_MIN * 60:
                     registrar_final()
                     return
                 else:
@@ -1011,7 +813,7 @@ def construir_ingreso_salida(frame_padre):
         # ---- Reset de estado para evitar arrastres de mensajes previos ----
         label_estado.configure(text="", text_color="white")
 
-        conexion = sqlite3.connect(DB_PATH)
+        conexion = conectar(DB_PATH)
         cursor = conexion.cursor()
 
         # Comparar por RUT "limpio" (sin puntos/guion y DV mayúscula)
@@ -1074,11 +876,20 @@ def construir_ingreso_salida(frame_padre):
         entry_rut.insert(0, fmt)
 
     def buscar_automatico():
+        # El marcaje manual usa la misma cámara: el modo kiosco queda en pausa
+        if kiosco["motor"] is not None and kiosco["motor"].activo:
+            detener_kiosco()
         # Formatear antes de usar
         _formatear_entry_rut()
         rut = entry_rut.get().strip()
+        if not _motor_listo():
+            # El hilo de verificación espera al motor; se avisa para que no parezca colgado
+            label_estado.configure(text="⏳ Motor biométrico cargando, un momento...", text_color="gray")
+            label_hora_registro.configure(text="")
+            frame.update()
         if not rut:
-            label_estado.configure(text="🔍 Buscando rostro...", text_color="gray")
+            if _motor_listo():
+                label_estado.configure(text="🔍 Buscando rostro...", text_color="gray")
             label_hora_registro.configure(text="")
             reconocer_rostro_async(
                 callback_exito=lambda rut_detectado: [
@@ -1086,17 +897,20 @@ def construir_ingreso_salida(frame_padre):
                     entry_rut.insert(0, _rut_formatear(rut_detectado)),
                     cargar_info_usuario(_rut_formatear(rut_detectado), por_verificacion=True)
                 ],
-                callback_error=lambda: pedir_emergencia(rut_sugerido="", mensaje="❌ No se pudo identificar el rostro. Usa clave de emergencia:")
+                callback_error=lambda: pedir_emergencia(rut_sugerido="", mensaje="❌ No se pudo identificar el rostro. Usa clave de emergencia:"),
+                ambito=frame
             )
             return
 
-        label_estado.configure(text="🔄 Verificando rostro...", text_color="gray")
-        label_hora_registro.configure(text="")
-        frame.update()
+        if _motor_listo():
+            label_estado.configure(text="🔄 Verificando rostro...", text_color="gray")
+            label_hora_registro.configure(text="")
+            frame.update()
         verificar_rostro_async(
             rut,
             callback_exito=lambda: cargar_info_usuario(rut, por_verificacion=True),
-            callback_error=lambda: pedir_emergencia(rut_sugerido=rut)
+            callback_error=lambda: pedir_emergencia(rut_sugerido=rut),
+            ambito=frame
         )
 
     def limpiar_campos_btn():
@@ -1106,6 +920,18 @@ def construir_ingreso_salida(frame_padre):
     frame = ctk.CTkFrame(frame_padre)
     frame.pack(fill="both", expand=True)
 
+    # Cámara caliente mientras esta pantalla esté visible
+    gestor_camara = obtener_gestor_camara()
+    gestor_camara.mantener_abierta(True)
+
+    def _al_destruir(e):
+        if e.widget is not frame:
+            return
+        if kiosco["motor"] is not None:
+            kiosco["motor"].detener()
+        gestor_camara.mantener_abierta(False)
+    frame.bind("<Destroy>", _al_destruir)
+
     ctk.CTkLabel(frame, text="Ingreso / Salida de Funcionarios", font=("Arial", 16)).pack(pady=10)
     ctk.CTkLabel(frame, text="Ingresa el RUT del funcionario:").pack(pady=(10, 2))
     entry_rut = ctk.CTkEntry(frame, placeholder_text="Ej: 12345678-9")
@@ -1119,6 +945,9 @@ def construir_ingreso_salida(frame_padre):
 
     ctk.CTkButton(frame, text="Buscar", command=buscar_automatico).pack(pady=5)
     ctk.CTkButton(frame, text="Limpiar", command=limpiar_campos_btn).pack(pady=5)
+    boton_kiosco = ctk.CTkButton(frame, text="▶ Modo kiosco (manos libres)", fg_color="#0f766e",
+                                 command=lambda: alternar_kiosco())
+    boton_kiosco.pack(pady=5)
 
     label_nombre = ctk.CTkLabel(frame, text="Nombre: ---", font=("Arial", 14)); label_nombre.pack(pady=(15, 5))
     label_profesion = ctk.CTkLabel(frame, text="Profesión: ---", font=("Arial", 14)); label_profesion.pack(pady=5)
@@ -1129,5 +958,88 @@ def construir_ingreso_salida(frame_padre):
     boton_salida  = ctk.CTkButton(frame, text="Registrar Salida",  font=("Arial", 15), height=45, width=220)
 
     label_estado = ctk.CTkLabel(frame, text="", font=("Arial", 16)); label_estado.pack(pady=10)
+    label_motor = ctk.CTkLabel(frame, text="", font=("Arial", 12), text_color="gray"); label_motor.pack()
     label_hora_registro = ctk.CTkLabel(frame, text="", font=("Arial", 36, "bold"), text_color="yellow")
     label_hora_registro.pack(pady=(25, 35))
+
+    # ---------- Modo kiosco (modo_kiosco): overlay no bloqueante ----------
+    # Tarjeta sobre la pantalla con el último resultado; se oculta sola y nunca toma el foco.
+    overlay = ctk.CTkFrame(frame, corner_radius=14, fg_color="#14532d")
+    overlay_nombre = ctk.CTkLabel(overlay, text="", font=("Arial", 26, "bold"), text_color="white")
+    overlay_nombre.pack(padx=24, pady=(14, 2))
+    overlay_texto = ctk.CTkLabel(overlay, text="", font=("Arial", 18), text_color="white", justify="center")
+    overlay_texto.pack(padx=24, pady=(0, 14))
+    kiosco = {"motor": None, "ocultar": None}
+    COLORES_KIOSCO = {"registrado": "#14532d", "enfriamiento": "#1e3a8a", "completo": "#1e3a8a",
+                      "manual": "#7c2d12", "no_encontrado": "#7f1d1d", "error": "#7f1d1d"}
+
+    def _mostrar_evento_kiosco(evento):
+        if not overlay.winfo_exists():
+            return
+        overlay.configure(fg_color=COLORES_KIOSCO.get(evento.motivo, "#1f2937"))
+        overlay_nombre.configure(text=evento.nombre or _rut_formatear(evento.rut))
+        overlay_texto.configure(text=evento.texto)
+        overlay.place(relx=0.5, rely=0.62, anchor="center")
+        overlay.lift()
+        if kiosco["ocultar"] is not None:
+            frame.after_cancel(kiosco["ocultar"])
+        kiosco["ocultar"] = frame.after(3500 if evento.motivo == "registrado" else 5000, _ocultar_overlay)
+        motor = kiosco["motor"]
+        if motor is not None and motor.activo:
+            label_hora_registro.configure(text=f"Marcajes en kiosco: {motor.atendidos}", text_color="gray")
+
+    def _ocultar_overlay():
+        kiosco["ocultar"] = None
+        if overlay.winfo_exists():
+            overlay.place_forget()
+
+    def _estado_kiosco(texto):
+        if not label_estado.winfo_exists():
+            return
+        if texto is not None:
+            label_estado.configure(text=texto, text_color="gray")
+        motor = kiosco["motor"]
+        if motor is None or not motor.activo:
+            boton_kiosco.configure(text="▶ Modo kiosco (manos libres)", fg_color="#0f766e")
+
+    def iniciar_kiosco():
+        from despacho_ui import iniciar_despacho
+        from modo_kiosco import Kiosco
+        iniciar_despacho(frame.winfo_toplevel())
+        limpiar_campos()
+        # Uno nuevo por arranque (el anterior suelta la cámara por su cuenta);
+        # el enfriamiento se conserva para que una pausa no permita doble marcaje
+        previo = kiosco["motor"]
+        kiosco["motor"] = Kiosco(al_evento=_mostrar_evento_kiosco, al_estado=_estado_kiosco,
+                                 enfriamiento=previo.enfriamiento if previo is not None else None).iniciar()
+        boton_kiosco.configure(text="■ Detener modo kiosco", fg_color="#b91c1c")
+        label_estado.configure(text="⏳ Iniciando modo kiosco...", text_color="gray")
+
+    def detener_kiosco():
+        if kiosco["motor"] is not None:
+            kiosco["motor"].detener()
+        boton_kiosco.configure(text="▶ Modo kiosco (manos libres)", fg_color="#0f766e")
+        label_estado.configure(text="⏸ Modo kiosco detenido.", text_color="gray")
+
+    def alternar_kiosco():
+        if kiosco["motor"] is not None and kiosco["motor"].activo:
+            detener_kiosco()
+        else:
+            iniciar_kiosco()
+
+    # ---------- Estado del motor biométrico (carga en segundo plano) ----------
+    def _refrescar_estado_motor():
+        if not label_motor.winfo_exists():
+            return
+        carga = _carga_motor()
+        if carga.estado == "error":
+            label_motor.configure(text=f"❌ Motor biométrico no disponible: {carga.error}", text_color="red")
+            return
+        if _motor_listo():
+            label_motor.configure(text="")
+            return
+        label_motor.configure(text="⏳ Motor biométrico cargando...", text_color="gray")
+        frame.after(250, _refrescar_estado_motor)
+
+    _carga_motor().iniciar()
+    _refrescar_estado_motor()
@@ -0,0 +1,141 @@
+# libro_extras.py
+"""
+Libro de minutos extra (extras_mensuales) por funcionario y mes.
+
+El esquema se resuelve UNA vez por proceso y BD (sobre db.capacidades()): el actual (rut, anio_mes 'YYYY-MM',
+minutos_extra) que escribe marcaje.py, o una tabla antigua con columnas anio/mes.
+Luego todo sale de una consulta por rango sobre la clave (rut, período):
+
+    libro = leer_libro(["12345678-9"], 2025)["12345678-9"]
+    libro.mes(2025, 3)          -> minutos de marzo
+    libro.acumulado(2025, 3)    -> enero..marzo (YTD)
+    libro.anio(2025)            -> total del año
+"""
+import threading
+
+from db import conectar, capacidades
+
+_CANDIDATAS = (
+    "extras_mensuales", "extras_mensual", "minutos_extra_mensual",
+    "minutos_extras_mensuales", "saldo_extras_mensual", "acumulado_extras_mensual",
+)
+_COLS_MIN = ("minutos_extra", "minutos", "min_extras", "minutos_extras", "total_minutos")
+
+_esquemas = {}                # db_path -> dict | None
+_esquemas_lock = threading.Lock()
+
+
+# ============== ESQUEMA (una vez por proceso) ==============
+def _detectar(cap):
+    tablas = cap.tablas()
+    # Primero las conocidas, después cualquiera con rut + período + minutos
+    ordenadas = [t for t in tablas if t.lower() in _CANDIDATAS] + [t for t in tablas if t.lower() not in _CANDIDATAS]
+    for t in ordenadas:
+        cols = {c.lower() for c in cap.columnas(t)}
+        col_min = next((c for c in _COLS_MIN if c in cols), None)
+        if "rut" not in cols or not col_min:
+            continue
+        if "anio_mes" in cols:
+            return {"tabla": t, "col_min": col_min, "anio_mes": True}
+        col_anio = "anio" if "anio" in cols else ("year" if "year" in cols else None)
+        col_mes = "mes" if "mes" in cols else ("month" if "month" in cols else None)
+        if col_anio and col_mes:
+            return {"tabla": t, "col_min": col_min, "col_anio": col_anio, "col_mes": col_mes, "anio_mes": False}
+    return None
+
+def esquema(db_path=None):
+    """Tabla/columnas del libro de extras (None si la BD no tiene ninguna)."""
+    if db_path not in _esquemas:
+        with _esquemas_lock:
+            if db_path not in _esquemas:
+                _esquemas[db_path] = _detectar(capacidades(db_path))
+    return _esquemas[db_path]
+
+def olvidar_esquema():
+    """Para herramientas que cambian la estructura de la BD en caliente."""
+    with _esquemas_lock:
+        _esquemas.clear()
+
+
+def _a_minutos(valor) -> int:
+    if valor is None:
+        return 0
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        texto = str(valor)
+        if ":" in texto:
+            hh, mm = texto.split(":")[:2]
+            return int(hh) * 60 + int(mm)
+    return 0
+
+
+# ============== LIBRO ==============
+class LibroExtras:
+    __slots__ = ("rut", "meses")
+
+    def __init__(self, rut):
+        self.rut = rut
+        self.meses = {}           # (anio, mes) -> minutos
+
+    def mes(self, anio: int, mes: int) -> int:
+        return self.meses.get((int(anio), int(mes)), 0)
+
+    def acumulado(self, anio: int, mes: int) -> int:
+        """Enero..mes del año indicado."""
+        return sum(v for (a, m), v in self.meses.items() if a == int(anio) and m <= int(mes))
+
+    def anio(self, anio: int) -> int:
+        return self.acumulado(anio, 12)
+
+
+def leer_libro(ruts, anio_desde: int, anio_hasta: int | None = None, db_path=None) -> dict:
+    """{rut: LibroExtras} con los meses de [anio_desde, anio_hasta] en UNA consulta."""
+    if isinstance(ruts, str):
+        ruts = [ruts]
+    ruts = list(dict.fromkeys(ruts))
+    anio_hasta = anio_hasta or anio_desde
+    libros = {r: LibroExtras(r) for r in ruts}
+    meta = esquema(db_path)
+    if not meta or not ruts:
+        return libros
+
+    marcas = ",".join("?" * len(ruts))
+    if meta["anio_mes"]:
+        sql = f"""
+            SELECT rut, CAST(substr(anio_mes, 1, 4) AS INTEGER), CAST(substr(anio_mes, 6, 2) AS INTEGER),
+                   {meta['col_min']}
+            FROM {meta['tabla']}
+            WHERE rut IN ({marcas}) AND anio_mes BETWEEN ? AND ?
+        """
+        params = tuple(ruts) + (f"{int(anio_desde):04d}-01", f"{int(anio_hasta):04d}-12")
+    else:
+        sql = f"""
+            SELECT rut, {meta['col_anio']}, {meta['col_mes']}, {meta['col_min']}
+            FROM {meta['tabla']}
+            WHERE rut IN ({marcas}) AND {meta['col_anio']} BETWEEN ? AND ?
+        """
+        params = tuple(ruts) + (int(anio_desde), int(anio_hasta))
+
+    con = conectar(db_path)
+    try:
+        for rut, anio, mes, minutos in con.execute(sql, params).fetchall():
+            libro = libros.get(rut)
+            if libro is None or anio is None or mes is None:
+                continue
+            clave = (int(anio), int(mes))
+            libro.meses[clave] = libro.meses.get(clave, 0) + _a_minutos(minutos)
+    finally:
+        con.close()
+    return libros
+
+
+# ============== ATAJOS (un rut) ==============
+def minutos_mes(rut, anio, mes, db_path=None) -> int:
+    return leer_libro([rut], anio, db_path=db_path)[rut].mes(anio, mes)
+
+def minutos_hasta_mes(rut, anio, mes, db_path=None) -> int:
+    return leer_libro([rut], anio, db_path=db_path)[rut].acumulado(anio, mes)
+
+def minutos_anio(rut, anio, db_path=None) -> int:
+    return leer_libro([rut], anio, db_path=db_path)[rut].anio(anio)
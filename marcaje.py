@@ -0,0 +1,159 @@
+# marcaje.py
+"""
+Servicio de marcaje: registra un ingreso o una salida en UNA transacción corta.
+
+  BEGIN IMMEDIATE   (toma el lock de escritura antes de leer: dos marcajes
+                     seguidos ya no ven ambos "todavía no hay fila")
+  lectura del día   (índice único rut+fecha)
+  UPSERT registros  ON CONFLICT(rut, fecha)
+  UPSERT extras_mensuales (si corresponde)
+  asistencia_dia    (hechos_asistencia.actualizar_dia)
+  COMMIT
+
+y devuelve el EstadoDia resultante para que la UI no tenga que volver a consultar.
+"""
+from datetime import datetime
+
+from db import conectar
+from hechos_asistencia import actualizar_dia
+
+INGRESO = "ingreso"
+SALIDA = "salida"
+
+
+class EstadoDia:
+    """Fila del día de una persona después del marcaje."""
+    __slots__ = ("rut", "fecha", "hora_ingreso", "hora_salida", "observacion",
+                 "registrado", "motivo", "hora_registrada", "hora_oficial", "minutos_extra")
+
+    def __init__(self, rut, fecha, hora_ingreso=None, hora_salida=None, observacion="",
+                 registrado=False, motivo="", hora_registrada=None, hora_oficial=None, minutos_extra=0):
+        self.rut = rut
+        self.fecha = fecha
+        self.hora_ingreso = hora_ingreso
+        self.hora_salida = hora_salida
+        self.observacion = observacion or ""
+        self.registrado = registrado            # False si ya existía ese marcaje
+        self.motivo = motivo                    # ok | ya_ingreso | ya_salida
+        self.hora_registrada = hora_registrada  # lo que quedó en la BD
+        self.hora_oficial = hora_oficial        # salida oficial usada (si se pidió)
+        self.minutos_extra = minutos_extra      # minutos sumados a extras_mensuales
+
+    @property
+    def tiene_ingreso(self) -> bool:
+        return bool(self.hora_ingreso and str(self.hora_ingreso).strip())
+
+    @property
+    def tiene_salida(self) -> bool:
+        return bool(self.hora_salida and str(self.hora_salida).strip())
+
+
+def _leer_dia(cur, rut, fecha):
+    return cur.execute("""
+        SELECT hora_ingreso, hora_salida, observacion FROM registros
+        WHERE rut = ? AND fecha = ?
+    """, (rut, fecha)).fetchone()
+
+def estado_dia(rut: str, fecha: str, db_path=None) -> EstadoDia:
+    """Estado del día sin registrar nada."""
+    con = conectar(db_path)
+    try:
+        fila = _leer_dia(con.cursor(), rut, fecha)
+    finally:
+        con.close()
+    if not fila:
+        return EstadoDia(rut, fecha, motivo="sin_registro")
+    return EstadoDia(rut, fecha, fila[0], fila[1], fila[2], motivo="ok")
+
+def _con_segundos(hhmm: str) -> str:
+    return f"{hhmm}:00" if hhmm and len(hhmm) == 5 else hhmm
+
+def _sumar_extras(cur, rut, fecha, minutos, ahora):
+    cur.execute("""
+        INSERT INTO extras_mensuales (rut, anio_mes, minutos_extra, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(rut, anio_mes) DO UPDATE SET
+            minutos_extra = minutos_extra + excluded.minutos_extra,
+            updated_at = excluded.updated_at
+    """, (rut, fecha[:7], int(minutos), ahora))
+
+
+def registrar_marcaje(rut: str, fecha: str, tipo: str, hora: str, nombre: str = "",
+                      observacion: str = "", concatenar_observacion: bool = False,
+                      salida_oficial=None, usar_hora_oficial: bool = False,
+                      minutos_extra=None, db_path=None) -> EstadoDia:
+    """
+    Registra 'tipo' (ingreso|salida) para (rut, fecha 'YYYY-MM-DD') a la 'hora' dada.
+
+    salida_oficial(hora_ingreso) -> 'HH:MM' | None
+        Solo salidas; se evalúa dentro de la transacción con el ingreso ya guardado.
+    usar_hora_oficial
+        Guarda la salida oficial en vez de 'hora' (salida anticipada autorizada, viernes).
+    minutos_extra(hora_oficial) -> int
+        Minutos a sumar en extras_mensuales en la misma transacción (0 = nada).
+    concatenar_observacion
+        Agrega 'observacion' a la existente ("a | b") en vez de reemplazarla (vacía = la conserva).
+
+    Si el marcaje ya existía no escribe nada y devuelve registrado=False.
+    """
+    if tipo not in (INGRESO, SALIDA):
+        raise ValueError(f"tipo de marcaje inválido: {tipo!r}")
+    col = "hora_ingreso" if tipo == INGRESO else "hora_salida"
+    ahora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    con = conectar(db_path)
+    cur = con.cursor()
+    propia = not con.in_transaction
+    try:
+        if propia:
+            cur.execute("BEGIN IMMEDIATE")
+        fila = _leer_dia(cur, rut, fecha)
+        ing_prev, sal_prev, obs_prev = fila if fila else (None, None, "")
+
+        previa = ing_prev if tipo == INGRESO else sal_prev
+        if previa and str(previa).strip():
+            if propia:
+                con.rollback()
+            return EstadoDia(rut, fecha, ing_prev, sal_prev, obs_prev, registrado=False,
+                             motivo="ya_ingreso" if tipo == INGRESO else "ya_salida")
+
+        hora_oficial = None
+        if tipo == SALIDA and salida_oficial is not None:
+            hora_oficial = salida_oficial(ing_prev[:5] if ing_prev else None)
+        hora_db = _con_segundos(hora_oficial) if (usar_hora_oficial and hora_oficial) else hora
+
+        if concatenar_observacion:
+            obs_sql = ("CASE WHEN excluded.observacion = '' THEN registros.observacion "
+                       "WHEN registros.observacion IS NULL OR TRIM(registros.observacion) = '' "
+                       "THEN excluded.observacion ELSE registros.observacion || ' | ' || excluded.observacion END")
+        else:
+            obs_sql = "excluded.observacion"
+        cur.execute(f"""
+            INSERT INTO registros (rut, nombre, fecha, {col}, observacion)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(rut, fecha) DO UPDATE SET
+                {col} = excluded.{col},
+                observacion = {obs_sql}
+        """, (rut, nombre, fecha, hora_db, observacion or ""))
+
+        extras = 0
+        if tipo == SALIDA and minutos_extra is not None and not usar_hora_oficial:
+            extras = int(minutos_extra(hora_oficial) or 0)
+            if extras > 0:
+                _sumar_extras(cur, rut, fecha, extras, ahora)
+
+        # Hechos del día (asistencia_dia) en la misma transacción
+        actualizar_dia(rut, fecha, con=con)
+
+        ing, sal, obs = _leer_dia(cur, rut, fecha)
+        if propia:
+            con.commit()
+    except Exception:
+        if propia and con.in_transaction:
+            con.rollback()
+        raise
+    finally:
+        con.close()
+
+    return EstadoDia(rut, fecha, ing, sal, obs, registrado=True, motivo="ok",
+                     hora_registrada=hora_db, hora_oficial=hora_oficial, minutos_extra=extras)
@@ -0,0 +1,81 @@
+# matcher_rostros.py
+"""
+Matcher abierto (1:N) vectorizado sobre la galería de rostros.
+
+  - Distancias euclidianas contra toda la matriz con un solo producto
+    matriz-vector (normas de la galería precalculadas).
+  - Mínimo por PERSONA con np.minimum.reduceat (las filas de cada RUT son
+    contiguas en la galería), no por plantilla: quien tiene muchas muestras ya
+    no compite consigo mismo en la prueba de margen.
+  - Mejor y segunda mejor persona con np.argpartition (sin ordenar todo).
+
+API: MatcherRostros.mejor(encoding) -> (rut, distancia, margen)
+"""
+import threading
+
+import numpy as np
+
+
+class MatcherRostros:
+    def __init__(self, matriz, filas_por_rut: dict, ruts_por_fila=None):
+        """
+        matriz         : float32 (N x 128), filas de cada persona contiguas
+        filas_por_rut  : {clave: (inicio, fin)}
+        ruts_por_fila  : lista fila -> RUT formateado (para devolver el RUT legible)
+        """
+        orden = sorted(filas_por_rut.items(), key=lambda kv: kv[1][0])
+        self._matriz = np.asarray(matriz, dtype=np.float32)
+        self._norma2 = np.einsum("ij,ij->i", self._matriz, self._matriz) if len(self._matriz) \
+            else np.empty(0, dtype=np.float32)
+        self._inicios = np.array([ini for _k, (ini, _fin) in orden], dtype=np.intp)
+        if ruts_por_fila is not None:
+            self._ruts = [ruts_por_fila[ini] for _k, (ini, _fin) in orden]
+        else:
+            self._ruts = [k for k, _r in orden]
+
+    def __len__(self):
+        return len(self._ruts)
+
+    def distancias(self, encoding) -> np.ndarray:
+        """Distancia euclidiana de 'encoding' a cada plantilla (equivale a face_distance)."""
+        c = np.asarray(encoding, dtype=np.float32).ravel()
+        d2 = self._norma2 + float(c @ c) - 2.0 * (self._matriz @ c)
+        return np.sqrt(np.maximum(d2, 0.0))
+
+    def distancias_por_persona(self, encoding) -> np.ndarray:
+        """Mínima distancia de 'encoding' a las plantillas de cada persona."""
+        if not len(self._inicios):
+            return np.empty(0, dtype=np.float32)
+        return np.minimum.reduceat(self.distancias(encoding), self._inicios)
+
+    def mejor(self, encoding):
+        """
+        (rut, distancia, margen) de la persona más cercana.
+        margen = distancia de la 2ª mejor PERSONA - distancia de la mejor
+        (inf si la galería tiene una sola persona). (None, inf, 0.0) si está vacía.
+        """
+        por_persona = self.distancias_por_persona(encoding)
+        n = len(por_persona)
+        if n == 0:
+            return None, float("inf"), 0.0
+        if n == 1:
+            return self._ruts[0], float(por_persona[0]), float("inf")
+        top2 = np.argpartition(por_persona, 1)[:2]
+        i1, i2 = (top2[0], top2[1]) if por_persona[top2[0]] <= por_persona[top2[1]] else (top2[1], top2[0])
+        best = float(por_persona[i1])
+        return self._ruts[int(i1)], best, float(por_persona[i2]) - best
+
+
+# ============== CACHÉ SOBRE LA GALERÍA ==============
+_cache = {"firma": None, "matcher": None}
+_cache_lock = threading.Lock()
+
+def matcher_desde_galeria(galeria) -> MatcherRostros:
+    """Matcher reconstruido solo cuando cambia la galería (misma firma de almacén)."""
+    matriz, ruts, filas, firma = galeria.instantanea()
+    with _cache_lock:
+        clave = (id(galeria), firma)
+        if _cache["firma"] != clave or _cache["matcher"] is None:
+            _cache["matcher"] = MatcherRostros(matriz, filas, ruts)
+            _cache["firma"] = clave
+        return _cache["matcher"]
@@ -0,0 +1,373 @@
+# modo_kiosco.py
+"""
+Modo kiosco: marcaje manos libres con la cámara siempre encendida.
+
+Sobre el mismo motor que reconocer_rostro_sin_rut (PipelineRostro + matcher 1:N +
+evidencia acumulada), pero sin botón ni ventana que se abre y se cierra por persona:
+
+  - la sesión de captura queda corriendo y reconoce a una persona tras otra;
+  - la evidencia se reinicia al decidir y cuando el rostro sale del cuadro, así
+    la siguiente persona no hereda votos de la anterior;
+  - ingreso o salida se decide con el registro del día (marcaje.estado_dia);
+  - un RUT recién marcado se ignora ENFRIAMIENTO_S segundos (sin doble marcaje);
+  - cada resultado llega a la UI como EventoKiosco vía despacho_ui.en_hilo_ui.
+
+Las reglas son las de registrar() en ingreso_salida, salvo que aquí no hay a quién
+pedirle el motivo: un atraso o una salida tardía se registran con una observación
+automática (la de la salida se suma a la del ingreso), y una salida ANTES de la
+hora pactada no se registra (se pide usar el marcaje manual, que exige el motivo).
+
+Uso (hilo de Tk):
+    kiosco = Kiosco(al_evento=mostrar, al_estado=estado).iniciar()
+    ...
+    kiosco.detener()
+"""
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from db import conectar
+from feriados import es_feriado
+from marcaje import registrar_marcaje, estado_dia, INGRESO, SALIDA
+from cache_horarios import obtener_horarios
+from captura_camara import SesionCaptura, obtener_gestor_camara
+from despacho_ui import en_hilo_ui
+from servidor_reconocimiento import nuevo_analizador
+from ingreso_salida import (
+    DB_PATH, DISTANCE_MARGIN, FRIDAY_FLEX_MINUTES, INGRESO_TOLERANCIA_MIN, LATE_AFTER_EXIT_MINUTES,
+    log, parse_hora, _dia_semana_es, _get_flag_salida_anticipada_local, _hora_salida_oficial_por_horario,
+    _consultar_galeria, _minutos_extra_sobre, _motor, _nuevo_acumulador, _rut_formatear, _rut_limpio,
+)
+
+ENFRIAMIENTO_S = 120          # un RUT recién marcado se ignora este tiempo
+AVISO_REPETIDO_S = 4          # mismo aviso para el mismo RUT como mucho cada N s
+SIN_ROSTRO_REINICIO = 3       # cuadros sin rostro para dar por terminada a la persona
+MOSTRAR_VISTA_PREVIA = True   # ventana OpenCV persistente (no se cierra entre personas)
+VENTANA = "Modo kiosco"
+
+REGISTRADO, ENFRIAMIENTO, COMPLETO, MANUAL, NO_ENCONTRADO, ERROR = (
+    "registrado", "enfriamiento", "completo", "manual", "no_encontrado", "error")
+
+
+class EventoKiosco:
+    """Resultado de una persona frente al kiosco."""
+    __slots__ = ("rut", "nombre", "tipo", "hora", "motivo", "texto")
+
+    def __init__(self, rut, nombre, tipo, hora, motivo, texto):
+        self.rut = rut
+        self.nombre = nombre or ""
+        self.tipo = tipo              # INGRESO | SALIDA | None
+        self.hora = hora              # 'HH:MM:SS'
+        self.motivo = motivo          # REGISTRADO | ENFRIAMIENTO | COMPLETO | MANUAL | ...
+        self.texto = texto
+
+    def __repr__(self):
+        return f"EventoKiosco({self.rut!r}, {self.tipo}, {self.motivo})"
+
+
+# ============== ENFRIAMIENTO POR RUT ==============
+class Enfriamiento:
+    def __init__(self, segundos: float = ENFRIAMIENTO_S):
+        self.segundos = segundos
+        self._hasta = {}              # rut -> time.monotonic() en que vuelve a aceptarse
+        self._lock = threading.Lock()
+
+    def restante(self, rut, ahora=None) -> float:
+        ahora = time.monotonic() if ahora is None else ahora
+        with self._lock:
+            return max(0.0, self._hasta.get(rut, 0.0) - ahora)
+
+    def marcar(self, rut, ahora=None):
+        ahora = time.monotonic() if ahora is None else ahora
+        with self._lock:
+            # Se podan los vencidos para que el dict no crezca en todo el turno
+            self._hasta = {r: t for r, t in self._hasta.items() if t > ahora}
+            self._hasta[rut] = ahora + self.segundos
+
+
+# ============== REGLAS DE MARCAJE ==============
+def _funcionario(rut):
+    """(rut canónico de la BD, nombre completo) o (None, '') si no existe."""
+    con = conectar(DB_PATH)
+    try:
+        fila = con.execute("""
+            SELECT rut, nombre, apellido FROM trabajadores
+            WHERE REPLACE(REPLACE(UPPER(rut),'.',''),'-','') = ?
+        """, (_rut_limpio(_rut_formatear(rut)),)).fetchone()
+    finally:
+        con.close()
+    if not fila:
+        return None, ""
+    return _rut_formatear(fila[0]), f"{fila[1]} {fila[2]}".strip()
+
+
+def marcar(rut: str, nombre: str = "", ahora: datetime | None = None) -> EventoKiosco:
+    """Decide ingreso/salida con el registro del día y lo registra (sin diálogos)."""
+    ahora = ahora or datetime.now()
+    fecha_iso = ahora.strftime("%Y-%m-%d")
+    hora_actual = ahora.strftime("%H:%M:%S")
+    hora_actual_dt = parse_hora(hora_actual)
+
+    previo = estado_dia(rut, fecha_iso)
+    if not previo.tiene_ingreso:
+        tipo = INGRESO
+    elif not previo.tiene_salida:
+        tipo = SALIDA
+    else:
+        return EventoKiosco(rut, nombre, None, hora_actual, COMPLETO,
+                            "Ya registraste ingreso y salida hoy.")
+
+    es_f, nombre_f, _ = es_feriado(ahora.date())
+    obs_feriado = f"Feriado: {nombre_f}" if es_f else ""
+    bloques = [tuple(b) for b in obtener_horarios().bloques(rut, _dia_semana_es(fecha_iso))]
+
+    def _obs(texto):
+        return " | ".join(t for t in (texto, obs_feriado) if t)
+
+    def _salida_oficial(hora_ingreso_hhmm):
+        return _hora_salida_oficial_por_horario(rut, fecha_iso, hora_ingreso_hhmm)
+
+    if tipo == INGRESO:
+        observacion = ""
+        entrada = next((e for e, _s in bloques if e), None)
+        if entrada and not es_f:
+            delta = (hora_actual_dt - parse_hora(entrada)).total_seconds()
+            if delta > INGRESO_TOLERANCIA_MIN * 60:
+                observacion = f"Atraso de {int(delta // 60)} min (kiosco, sin motivo)"
+        estado = registrar_marcaje(rut, fecha_iso, INGRESO, hora_actual, nombre=nombre,
+                                   observacion=_obs(observacion))
+    else:
+        flag, obs_aut = _get_flag_salida_anticipada_local()
+        usar_hora_oficial = False
+        observacion = ""
+        if flag and not es_f:
+            # Panel de salida anticipada: hora oficial y sin extras
+            estado = registrar_marcaje(rut, fecha_iso, SALIDA, hora_actual, nombre=nombre,
+                                       observacion=obs_aut or "Salida anticipada autorizada",
+                                       concatenar_observacion=True,
+                                       salida_oficial=_salida_oficial, usar_hora_oficial=True)
+            tipo_texto = "Salida anticipada registrada"
+        else:
+            if not es_f:
+                salidas = [s for _e, s in bloques if s and s.strip()]
+                if not salidas:
+                    observacion = "Sin horario definido para hoy (kiosco)"
+                else:
+                    ultima_dt = max(parse_hora(s) for s in salidas)
+                    margen = timedelta(minutes=FRIDAY_FLEX_MINUTES)
+                    if _dia_semana_es(fecha_iso) == "Viernes" and ultima_dt - margen <= hora_actual_dt < ultima_dt:
+                        usar_hora_oficial = True
+                    elif hora_actual_dt < ultima_dt:
+                        return EventoKiosco(rut, nombre, SALIDA, hora_actual, MANUAL,
+                                            f"Salida antes de la hora pactada ({ultima_dt.strftime('%H:%M')}).\n"
+                                            f"Regístrala en modo manual indicando el motivo.")
+                    else:
+                        delta_min = int((hora_actual_dt - ultima_dt).total_seconds() // 60)
+                        if delta_min >= LATE_AFTER_EXIT_MINUTES:
+                            observacion = (f"Salida {delta_min} min después de la hora pactada "
+                                           f"({ultima_dt.strftime('%H:%M')}) (kiosco, sin motivo)")
+            estado = registrar_marcaje(rut, fecha_iso, SALIDA, hora_actual, nombre=nombre,
+                                       observacion=_obs(observacion), concatenar_observacion=True,
+                                       salida_oficial=_salida_oficial,
+                                       usar_hora_oficial=usar_hora_oficial,
+                                       minutos_extra=lambda oficial: _minutos_extra_sobre(hora_actual_dt, oficial))
+            tipo_texto = "Salida registrada"
+
+    if not estado.registrado:
+        # Otro marcaje (manual u otro kiosco) se adelantó
+        return EventoKiosco(rut, nombre, tipo, hora_actual, COMPLETO,
+                            "Ya registraste un ingreso hoy." if tipo == INGRESO else "Ya registraste una salida hoy.")
+    texto = "Ingreso registrado" if tipo == INGRESO else tipo_texto
+    texto = f"{texto} ✅ {(estado.hora_registrada or hora_actual)[:5]}"
+    if es_f:
+        texto += f" (feriado: {nombre_f})"
+    return EventoKiosco(rut, nombre, tipo, hora_actual, REGISTRADO, texto)
+
+
+# ============== MOTOR CONTINUO ==============
+class Kiosco:
+    """
+    Hilo supervisor: mantiene la sesión de captura, atiende las decisiones del
+    trabajador de reconocimiento y dibuja la vista previa. al_evento(EventoKiosco)
+    y al_estado(texto | None) se llaman en el hilo de Tk; None = el hilo terminó
+    sin nada que informar. Tras detener() se crea otro Kiosco para reanudar.
+    """
+
+    def __init__(self, al_evento, al_estado=None, enfriamiento: Enfriamiento | None = None,
+                 vista_previa: bool = MOSTRAR_VISTA_PREVIA):
+        self._al_evento = al_evento
+        self._al_estado = al_estado
+        self.enfriamiento = enfriamiento or Enfriamiento()   # compartible entre pausas
+        self.vista_previa = vista_previa
+        self._decisiones = queue.SimpleQueue()
+        self._detener = threading.Event()
+        self._hilo = None
+        self._avisos = {}             # rut -> time.monotonic() del último aviso
+        self._ultimo = None           # (EventoKiosco, vence) para la vista previa
+        self.atendidos = 0
+
+    @property
+    def activo(self) -> bool:
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._correr, daemon=True, name="kiosco")
+            self._hilo.start()
+        return self
+
+    def detener(self):
+        """No espera al hilo: suelta la cámara en su próxima vuelta (< 50 ms)."""
+        self._detener.set()
+
+    # ---------- salida hacia la UI ----------
+    def _estado(self, texto):
+        if self._al_estado is not None:
+            en_hilo_ui(self._al_estado, texto)
+
+    def _emitir(self, evento):
+        self._ultimo = (evento, time.monotonic() + 3.0)
+        en_hilo_ui(self._al_evento, evento)
+
+    def _aviso_permitido(self, rut, ahora) -> bool:
+        if ahora - self._avisos.get(rut, -AVISO_REPETIDO_S) < AVISO_REPETIDO_S:
+            return False
+        self._avisos[rut] = ahora
+        return True
+
+    # ---------- hilo ----------
+    def _correr(self):
+        try:
+            self._bucle()
+        except Exception as e:
+            log(f"modo kiosco error: {e}")
+            print("Error en modo kiosco:", e, flush=True)
+            self._estado(f"❌ Modo kiosco detenido: {e}")
+        else:
+            self._estado(None)
+
+    def _bucle(self):
+        cv2 = _motor()
+        from pipeline_rostro import dibujar_resultado
+
+        galeria = _consultar_galeria()
+        if galeria is None:
+            log("modo kiosco: galería no disponible")
+            self._estado("❌ Reconocimiento facial no disponible.")
+            return
+        if not galeria["encodings"]:
+            log("modo kiosco: galería vacía")
+            self._estado("❌ No hay rostros enrolados.")
+            return
+
+        gestor = obtener_gestor_camara()
+        lector, info = gestor.adquirir()
+        if lector is None:
+            log("modo kiosco: cámara no abierta (" + info + ")")
+            self._estado("❌ No se pudo abrir la cámara.")
+            return
+
+        analizador = nuevo_analizador()
+        evidencia = _nuevo_acumulador(margen_min=DISTANCE_MARGIN)
+        sin_rostro = [0]
+
+        # Hilo de reconocimiento, siempre sobre el cuadro más reciente
+        def _procesar(frame):
+            res, match = analizador.analizar(frame)
+            if res.estado == "sin_rostro":
+                sin_rostro[0] += 1
+                if sin_rostro[0] == SIN_ROSTRO_REINICIO:
+                    evidencia.reiniciar()      # la persona se fue
+                return res, None
+            sin_rostro[0] = 0
+            rut = None
+            if match is not None:
+                rut_best, best_dist, margen = match
+                rut = evidencia.agregar(rut_best, best_dist, margen)
+                if rut:
+                    evidencia.reiniciar()
+                    self._decisiones.put(rut)
+            return res, rut
+
+        self._estado("🟢 Modo kiosco activo: acérquese a la cámara.")
+        log("modo kiosco: inicio")
+        t0 = time.monotonic()
+        sesion = SesionCaptura(lector, _procesar).iniciar()
+        try:
+            if self.vista_previa:
+                cv2.namedWindow(VENTANA, cv2.WINDOW_NORMAL)
+                cv2.resizeWindow(VENTANA, 800, 600)
+            while not self._detener.is_set():
+                if sesion.trabajador.error is not None:
+                    raise sesion.trabajador.error
+                self._atender_decisiones()
+
+                if not self.vista_previa:
+                    time.sleep(0.02)
+                    continue
+                frame = sesion.cuadro_preview()
+                if frame is None:
+                    time.sleep(0.01)
+                    continue
+                ultimo = sesion.trabajador.ultimo_resultado()
+                if ultimo:
+                    dibujar_resultado(frame, ultimo[0])
+                if self._ultimo and time.monotonic() < self._ultimo[1]:
+                    ev = self._ultimo[0]
+                    color = (0, 255, 0) if ev.motivo == REGISTRADO else (0, 200, 255)
+                    cv2.putText(frame, ev.nombre or ev.rut, (40, 380),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
+                    cv2.putText(frame, ev.texto.splitlines()[0], (40, 415),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+                cv2.putText(frame, evidencia.progreso(), (40, 445),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (124, 255, 124), 2)
+                _fps_cap, _fps_desc, _fps_rec = sesion.stats.por_segundo()
+                cv2.putText(frame, f"cam {_fps_cap:.0f}/s | desc {_fps_desc:.0f}/s | rec {_fps_rec:.1f}/s | marcajes {self.atendidos}",
+                            (40, 470), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
+                cv2.imshow(VENTANA, frame)
+                if cv2.waitKey(15) & 0xFF == ord('q'):
+                    break
+        finally:
+            sesion.detener()
+            analizador.cerrar()
+            gestor.soltar()
+            if self.vista_previa:
+                try:
+                    cv2.destroyWindow(VENTANA)
+                except Exception:
+                    pass
+            minutos = max(1e-6, (time.monotonic() - t0) / 60.0)
+            log(f"modo kiosco fin: {self.atendidos} marcajes en {minutos:.1f} min "
+                f"({self.atendidos / minutos:.1f}/min) | {sesion.stats.resumen()}")
+
+    def _atender_decisiones(self):
+        while True:
+            try:
+                rut = self._decisiones.get_nowait()
+            except queue.Empty:
+                return
+            ahora = time.monotonic()
+            hora = datetime.now().strftime("%H:%M:%S")
+            restante = self.enfriamiento.restante(rut, ahora)
+            if restante:
+                if self._aviso_permitido(rut, ahora):
+                    self._emitir(EventoKiosco(rut, "", None, hora, ENFRIAMIENTO,
+                                              f"Ya marcaste recién (espera {int(restante)} s)."))
+                continue
+            try:
+                rut_db, nombre = _funcionario(rut)
+                if rut_db is None:
+                    evento = EventoKiosco(rut, "", None, hora, NO_ENCONTRADO, "RUT no encontrado en la nómina.")
+                else:
+                    evento = marcar(rut_db, nombre)
+            except Exception as e:
+                log(f"modo kiosco: error marcando {rut}: {e}")
+                evento = EventoKiosco(rut, "", None, hora, ERROR, f"No se pudo registrar: {e}")
+            if evento.motivo == REGISTRADO:
+                self.enfriamiento.marcar(rut, ahora)
+                self._avisos[rut] = ahora
+                self.atendidos += 1
+            elif not self._aviso_permitido(rut, ahora):
+                continue
+            self._emitir(evento)
@@ -1,9 +1,9 @@
 # nomina.py
 import customtkinter as ctk
-import sqlite3
+from db import conectar, asegurar_esquema
+from despacho_ui import ejecutar
 import tkinter as tk
 import tkinter.ttk as ttk
-import threading
 import os
 import webbrowser
 import smtplib
@@ -62,16 +62,9 @@ def _open_file(path):
 
 # ---------- Utilidades DB ----------
 def _ensure_indexes():
-    """Crea índices para acelerar búsquedas/ordenamientos."""
+    """Los índices de búsqueda/orden vienen en el esquema versionado (db._migracion_2)."""
     try:
-        con = sqlite3.connect(DB)
-        cur = con.cursor()
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_trab_rut ON trabajadores (rut)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_trab_ap_nom ON trabajadores (apellido, nombre)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_trab_nom_busq ON trabajadores (nombre, apellido, rut)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_horarios_rut ON horarios (rut)")
-        con.commit()
-        con.close()
+        asegurar_esquema(DB)
     except Exception as e:
         print("No se pudieron crear índices:", e)
 
@@ -79,7 +72,7 @@ def _like_param(s: str) -> str:
     return f"%{(s or '').lower()}%"
 
 def _count_funcionarios(filtro: str) -> int:
-    con = sqlite3.connect(DB)
+    con = conectar(DB)
     cur = con.cursor()
     if filtro:
         cur.execute("""
@@ -104,7 +97,7 @@ def _fetch_page(filtro: str, sort_col: str, sort_dir_asc: bool, limit: int, offs
     order_by = sort_map.get(sort_col, "apellido, nombre")
     direction = "ASC" if sort_dir_asc else "DESC"
 
-    con = sqlite3.connect(DB)
+    con = conectar(DB)
     cur = con.cursor()
     base_sql = """
         SELECT nombre, apellido, rut, IFNULL(profesion,'-') AS profesion,
@@ -125,7 +118,7 @@ def _fetch_page(filtro: str, sort_col: str, sort_dir_asc: bool, limit: int, offs
 
 def _fetch_all_for_rollcall():
     """Lista completa para la 'lista manual': (nombre completo, rut, profesion, correo) A→Z."""
-    con = sqlite3.connect(DB)
+    con = conectar(DB)
     cur = con.cursor()
     cur.execute("""
         SELECT TRIM(IFNULL(nombre,'')) || ' ' || TRIM(IFNULL(apellido,''))  AS nombre,
@@ -146,7 +139,7 @@ def _fetch_matrix_por_rut_sql(rut: str):
     matrix = {dia: {'Mañana':(he,hs)|'-', 'Tarde':..., 'Nocturna':...}}
     Ignora filas con hora_entrada/salida vacías. Asigna por orden de inicio.
     """
-    con = sqlite3.connect(DB)
+    con = conectar(DB)
     cur = con.cursor()
 
     # total filas para este RUT
@@ -522,6 +515,7 @@ def construir_nomina(frame_padre):
         "loaded": 0,
         "total": 0,
         "search_after_id": None,
+        "tarea": None,         # consulta en curso (despacho_ui.Tarea)
         "selected": {  # datos del funcionario seleccionado
             "rut": None,
             "nombre": "",
@@ -783,28 +777,30 @@ def construir_nomina(frame_padre):
         sort_col = state["sort_col"]
         sort_asc = state["sort_asc"]
 
-        def work():
-            try:
-                total = _count_funcionarios(filtro)
-                offset = 0 if reset else state["loaded"]
-                rows = _fetch_page(filtro, sort_col, sort_asc, CHUNK_SIZE if next_chunk else offset, offset)
-            except Exception as e:
-                print("Error consultando nómina:", e)
-                return
+        offset = 0 if reset else state["loaded"]
 
-            def apply():
-                state["total"] = total
-                if reset:
-                    _fill_tree(rows, append=False)
-                    state["loaded"] = len(rows)
-                else:
-                    _fill_tree(rows, append=True)
-                    state["loaded"] += len(rows)
-                _update_count_label()
-
-            root.after(0, apply)
+        def work():
+            total = _count_funcionarios(filtro)
+            rows = _fetch_page(filtro, sort_col, sort_asc, CHUNK_SIZE if next_chunk else offset, offset)
+            return total, rows
+
+        def apply(resultado):
+            total, rows = resultado
+            state["total"] = total
+            if reset:
+                _fill_tree(rows, append=False)
+                state["loaded"] = len(rows)
+            else:
+                _fill_tree(rows, append=True)
+                state["loaded"] += len(rows)
+            _update_count_label()
 
-        threading.Thread(target=work, daemon=True).start()
+        # Una búsqueda nueva deja obsoleta la anterior (sus filas ya no se pintan)
+        if reset and state["tarea"] is not None:
+            state["tarea"].cancelar()
+        state["tarea"] = ejecutar(work, al_terminar=apply,
+                                  al_fallar=lambda e: print("Error consultando nómina:", e),
+                                  ambito=tree, nombre="nomina")
 
     # Búsqueda con debounce
     def _on_search_changed(_=None):
@@ -844,7 +840,7 @@ def construir_nomina(frame_padre):
         return None
 
     def _fetch_info_trabajador(rut: str):
-        con = sqlite3.connect(DB)
+        con = conectar(DB)
         cur = con.cursor()
         cur.execute("""
             SELECT nombre, apellido, IFNULL(profesion,'-'), IFNULL(correo,'-'), IFNULL(cumpleanos,'-')
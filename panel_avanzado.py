@@ -5,7 +5,10 @@ import smtplib
 import mimetypes
 import tempfile
 import customtkinter as ctk
-import sqlite3
+from db import conectar, asegurar_esquema, capacidades
+from despacho_ui import ejecutar
+from cache_horarios import obtener_horarios
+from hechos_asistencia import actualizar_dias, actualizar_fecha
 from tkinter import messagebox, ttk
 import importlib.util
 import importlib
@@ -33,18 +36,8 @@ def _diff_min(a: str, b: str) -> int | None:
     return int((ta - tb).total_seconds() // 60)
 
 def _fetch_horarios_dia_glob(con, rut: str, dia_es: str):
-    cur = con.cursor()
-    cur.execute("""
-        SELECT TRIM(IFNULL(hora_entrada,'')), TRIM(IFNULL(hora_salida,''))
-        FROM horarios
-        WHERE REPLACE(REPLACE(UPPER(IFNULL(rut,'')),'.',''),'-','')
-              = REPLACE(REPLACE(UPPER(?),'.',''),'-','')
-          AND LOWER(TRIM(IFNULL(dia,''))) = LOWER(TRIM(?))
-          AND TRIM(IFNULL(hora_entrada,'')) <> ''
-          AND TRIM(IFNULL(hora_salida ,'')) <> ''
-        ORDER BY time(hora_entrada) ASC
-    """, (rut, dia_es))
-    return cur.fetchall()
+    # Desde el horario compilado en memoria ('con' se mantiene por compatibilidad)
+    return [tuple(b) for b in obtener_horarios().bloques(rut, dia_es)]
 
 def _expected_ingreso_glob(con, rut: str, fecha_iso: str, hora_real: str) -> str:
     import datetime as _dt
@@ -92,7 +85,7 @@ SMTP_FALLBACK = {
 def _smtp_load_config():
     cfg = {}
     try:
-        con = sqlite3.connect(DB_PATH); cur = con.cursor()
+        con = conectar(DB_PATH); cur = con.cursor()
         try:
             cur.execute("SELECT host, port, user, password, use_tls, use_ssl, remitente FROM smtp_config LIMIT 1")
             row = cur.fetchone()
@@ -168,9 +161,11 @@ def _smtp_send(to_list, cc_list, subject, body_text, html_body=None, attachment_
 
 # --- Feriados opcional ---
 try:
-    from feriados import sincronizar_feriados_chile
+    from feriados import sincronizar_feriados_chile, invalidar_feriados
 except Exception:
     sincronizar_feriados_chile = None
+    def invalidar_feriados():
+        pass
 
 # --- tkcalendar (versión ya utilizada) ---
 try:
@@ -267,41 +262,16 @@ def _style_dark_treeview():
     )
     return "Dark.Treeview"
 
-# --- Esquema panel/flags ---
+# --- Esquema panel/flags y feriados (db._migracion_2) ---
 def _ensure_panel_schema():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS panel_flags (
-            fecha TEXT PRIMARY KEY,
-            salida_anticipada INTEGER NOT NULL DEFAULT 0,
-            salida_anticipada_obs TEXT,
-            cierre_forzado INTEGER NOT NULL DEFAULT 0,
-            cierre_forzado_obs TEXT
-        );
-    """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_registros_fecha_tipo ON registros(fecha, tipo);")
-    con.commit()
-    con.close()
+    asegurar_esquema(DB_PATH)
 
-# --- Esquema feriados (asegurar) ---
-def _ensure_feriados_schema():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS feriados (
-            fecha TEXT PRIMARY KEY,         -- YYYY-MM-DD
-            nombre TEXT,
-            irrenunciable INTEGER NOT NULL DEFAULT 0
-        );
-    """)
-    con.commit()
-    con.close()
+_ensure_feriados_schema = _ensure_panel_schema
 
 # --- Acciones panel ---
 def _set_flag_salida_anticipada_activa(obs: str):
     _ensure_panel_schema()
-    con = sqlite3.connect(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
     cur.execute("""
         INSERT INTO panel_flags (fecha, salida_anticipada, salida_anticipada_obs)
@@ -312,6 +282,8 @@ def _set_flag_salida_anticipada_activa(obs: str):
     """, (_hoy_iso(), obs))
     con.commit()
     con.close()
+    # Los pendientes de hoy pasan de "sin salida" a "salida autorizada"
+    actualizar_fecha(_hoy_iso())
 
 def habilitar_salida_anticipada_todos(observacion):
     try:
@@ -325,14 +297,13 @@ def habilitar_salida_anticipada_todos(observacion):
         messagebox.showerror("Error", f"No se pudo activar la salida anticipada:\n{e}")
 
 def cerrar_dia_para_todos(observacion):
-    import datetime as _dt
     try:
-        con = sqlite3.connect(DB_PATH)
+        con = conectar(DB_PATH)
         cur = con.cursor()
         cur.execute("""
             SELECT id, rut, fecha, hora_ingreso, COALESCE(observacion, '')
             FROM registros
-            WHERE DATE(fecha) = DATE('now')
+            WHERE fecha = DATE('now')
               AND hora_ingreso IS NOT NULL AND TRIM(hora_ingreso) <> ''
               AND (hora_salida IS NULL OR TRIM(hora_salida) = '')
         """)
@@ -342,31 +313,13 @@ def cerrar_dia_para_todos(observacion):
             con.close()
             return
 
-        def _dia_semana_es(fecha_iso: str) -> str:
-            d = _dt.datetime.strptime(fecha_iso, "%Y-%m-%d").date()
-            return _DIAS_ES[d.weekday()]
-
         def _calc_salida(cursor, rut: str, fecha_iso: str, hora_ingreso_hhmm: str) -> str:
-            dia = _dia_semana_es(fecha_iso)
-            cursor.execute("""
-                SELECT hora_entrada, hora_salida FROM horarios
-                WHERE rut = ? AND dia = ?
-            """, (rut, dia))
-            turnos = cursor.fetchall()
-            if not turnos:
-                return "17:30"
-            h_ing = _dt.datetime.strptime((hora_ingreso_hhmm or "08:00")[:5], "%H:%M")
-            for h_e, h_s in turnos:
-                if not h_e or not h_s: continue
-                h_ini = _dt.datetime.strptime(h_e, "%H:%M")
-                h_fin = _dt.datetime.strptime(h_s, "%H:%M")
-                if h_fin < h_ini:
-                    h_fin += _dt.timedelta(days=1)
-                    if h_ing < h_ini: h_ing += _dt.timedelta(days=1)
-                if h_ini <= h_ing <= h_fin:
-                    return h_s[:5]
-            salidas = [t[1] for t in turnos if t[1]]
-            return (max(salidas)[:5] if salidas else "17:30")
+            # Salida del bloque que contiene el ingreso; si ninguno, fin de jornada
+            horarios = obtener_horarios()
+            bloque = horarios.bloque_en(rut, fecha_iso, (hora_ingreso_hhmm or "08:00")[:5])
+            if bloque is not None:
+                return bloque.salida
+            return horarios.salida_esperada(rut, fecha_iso) or "17:30"
 
         for reg_id, rut, fecha, hora_ingreso, _ in pendientes:
             hsal = _calc_salida(cur, rut, fecha, hora_ingreso or "08:00")
@@ -389,6 +342,7 @@ def cerrar_dia_para_todos(observacion):
               cierre_forzado_obs=excluded.cierre_forzado_obs
         """, (observacion,))
         con.commit(); con.close()
+        actualizar_dias([(rut, fecha) for _id, rut, fecha, _h, _o in pendientes])
         messagebox.showinfo("Cierre de Jornada", f"Se cerró la jornada de {len(pendientes)} funcionario(s).")
     except Exception as e:
         messagebox.showerror("Error", f"Error al cerrar jornada:\n{e}")
@@ -405,7 +359,7 @@ def _sincronizar_feriados_anios(anios):
 # --- CRUD feriados ---
 def _upsert_feriado_manual(fecha_iso: str, nombre: str, irrenunciable: bool):
     _ensure_feriados_schema()
-    con = sqlite3.connect(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
     cur.execute("""
         INSERT INTO feriados (fecha, nombre, irrenunciable)
@@ -416,15 +370,17 @@ def _upsert_feriado_manual(fecha_iso: str, nombre: str, irrenunciable: bool):
     """, (fecha_iso, nombre, 1 if irrenunciable else 0))
     con.commit()
     con.close()
+    invalidar_feriados()
 
 def _delete_feriado(fecha_iso: str):
-    con = sqlite3.connect(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
-    cur.execute("DELETE FROM feriados WHERE DATE(fecha) = DATE(?)", (fecha_iso,))
+    cur.execute("DELETE FROM feriados WHERE fecha = DATE(?)", (fecha_iso,))
     con.commit(); con.close()
+    invalidar_feriados()
 
 def _fetch_feriados(filtro_texto=""):
-    con = sqlite3.connect(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
     if filtro_texto:
         like = f"%{filtro_texto.lower()}%"
@@ -848,16 +804,16 @@ def _abrir_resumen_global(parent):
         except Exception:
             messagebox.showerror("Fechas", "Usa formato YYYY-MM-DD."); return
 
-        con = sqlite3.connect(DB_PATH); cur = con.cursor()
+        con = conectar(DB_PATH); cur = con.cursor()
 
         # ------- INGRESOS: tardanzas
         cur.execute("""
-            SELECT DATE(fecha) AS f, IFNULL(rut,''), IFNULL(nombre,''),
+            SELECT fecha AS f, IFNULL(rut,''), IFNULL(nombre,''),
                    COALESCE(NULLIF(hora_ingreso,''), CASE WHEN lower(IFNULL(tipo,''))='ingreso' THEN IFNULL(hora,'') ELSE '' END) AS h_real
             FROM registros
-            WHERE DATE(fecha) BETWEEN DATE(?) AND DATE(?)
+            WHERE fecha BETWEEN DATE(?) AND DATE(?)
               AND TRIM(COALESCE(hora_ingreso, CASE WHEN lower(IFNULL(tipo,''))='ingreso' THEN IFNULL(hora,'') ELSE '' END))<>''
-            ORDER BY DATE(fecha) ASC
+            ORDER BY fecha ASC
         """, (f1, f2))
         ingresos = cur.fetchall()
 
@@ -887,9 +843,9 @@ def _abrir_resumen_global(parent):
 
         # ------- SIN SALIDA
         cur.execute("""
-            SELECT DATE(fecha), IFNULL(rut,''), IFNULL(nombre,'')
+            SELECT fecha, IFNULL(rut,''), IFNULL(nombre,'')
             FROM registros
-            WHERE DATE(fecha) BETWEEN DATE(?) AND DATE(?)
+            WHERE fecha BETWEEN DATE(?) AND DATE(?)
               AND TRIM(IFNULL(hora_ingreso,'')) <> ''
               AND (hora_salida IS NULL OR TRIM(hora_salida)='')
         """, (f1, f2))
@@ -897,17 +853,16 @@ def _abrir_resumen_global(parent):
 
         # ------- OBSERVACIONES (de registros)
         cur.execute("""
-            SELECT DATE(fecha), IFNULL(rut,''), IFNULL(nombre,''), IFNULL(observacion,'')
+            SELECT fecha, IFNULL(rut,''), IFNULL(nombre,''), IFNULL(observacion,'')
             FROM registros
-            WHERE DATE(fecha) BETWEEN DATE(?) AND DATE(?)
+            WHERE fecha BETWEEN DATE(?) AND DATE(?)
               AND TRIM(IFNULL(observacion,'')) <> ''
-            ORDER BY DATE(fecha) ASC
+            ORDER BY fecha ASC
         """, (f1, f2))
         obs_rows = cur.fetchall()
 
         # ------- PERMISOS/LICENCIAS (dias_libres)
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND lower(name)='dias_libres'")
-        has_dl = cur.fetchone() is not None
+        has_dl = capacidades(DB_PATH).tiene_tabla("dias_libres")
         permisos = []
         per_by_mot = {}
         if has_dl:
@@ -1123,22 +1078,35 @@ def _abrir_resumen_global(parent):
             subject = ent_sub.get().strip() or "Resumen Global"
             body = tb.get("1.0", "end").strip()
 
-            tmp = tempfile.NamedTemporaryFile(prefix="resumen_global_", suffix=".pdf", delete=False)
-            tmp.close()
-            try:
-                _build_pdf_to(tmp.name)
-                _smtp_send(to, [], subject, body, html_body=None, attachment_path=tmp.name)
+            if btn_enviar.cget("state") == "disabled":
+                return      # ya se está enviando
+
+            def trabajo():
+                # Hilo trabajador: PDF temporal + SMTP
+                tmp = tempfile.NamedTemporaryFile(prefix="resumen_global_", suffix=".pdf", delete=False)
+                tmp.close()
+                try:
+                    _build_pdf_to(tmp.name)
+                    _smtp_send(to, [], subject, body, html_body=None, attachment_path=tmp.name)
+                finally:
+                    try: os.remove(tmp.name)
+                    except Exception: pass
+
+            def enviado(_):
                 messagebox.showinfo("Enviar", "Correo enviado correctamente.")
                 win_mail.destroy()
-            except Exception as e:
+
+            def fallo(e):
+                btn_enviar.configure(state="normal", text="Enviar")
                 messagebox.showerror("Enviar", f"No fue posible enviar el correo:\n{e}")
-            finally:
-                try: os.remove(tmp.name)
-                except Exception: pass
+
+            btn_enviar.configure(state="disabled", text="Enviando...")
+            ejecutar(trabajo, al_terminar=enviado, al_fallar=fallo, ambito=win_mail, nombre="enviar_resumen_global")
 
         btns = ctk.CTkFrame(cont, fg_color="transparent"); btns.grid(row=3, column=0, columnspan=2, pady=(10,0))
         ctk.CTkButton(btns, text="Cancelar", fg_color="#6b7280", width=120, command=win_mail.destroy).pack(side="left", padx=6)
-        ctk.CTkButton(btns, text="Enviar", fg_color="#22c55e", width=140, command=_do_send).pack(side="left", padx=6)
+        btn_enviar = ctk.CTkButton(btns, text="Enviar", fg_color="#22c55e", width=140, command=_do_send)
+        btn_enviar.pack(side="left", padx=6)
 
         _center_on_parent(win_mail, win)
         _lift_and_focus(win_mail, win)
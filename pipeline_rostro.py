@@ -0,0 +1,145 @@
+# pipeline_rostro.py
+"""
+Pipeline por etapas para el loop de verificación facial.
+
+En vez de llamar face_recognition.face_encodings(rgb) sobre cada cuadro completo
+(detección HOG + 68 landmarks + ResNet en cada frame), se hace:
+
+  1) detección sobre una copia reducida del cuadro,
+  2) seguimiento de la caja entre cuadros (se busca primero en una región
+     ampliada alrededor de la caja anterior),
+  3) landmarks + encoder SOLO cuando hay un único rostro, estable y nítido
+     (mismos chequeos de calidad que enrolar_funcionaria._quality_ok),
+  4) las cajas se devuelven en coordenadas del cuadro completo.
+
+face_recognition se importa al crear un PipelineRostro: la UI solo usa
+dibujar_resultado (OpenCV) cuando el reconocimiento corre en el servidor aparte.
+"""
+import cv2
+
+# ---------- parámetros ----------
+ESCALA_DETECCION = 0.5       # 640x480 -> 320x240 para HOG
+UPSAMPLE_DETECCION = 1       # compensa ESCALA_DETECCION para rostros pequeños (lejos de la cámara)
+MARGEN_SEGUIMIENTO = 0.6     # ROI = caja anterior ampliada un 60% por lado
+IOU_ESTABLE = 0.55           # solape mínimo entre cuadros para considerar la caja estable
+FRAMES_ESTABLES = 2          # cuadros consecutivos estables antes de codificar
+REDETECTAR_CADA = 15         # forzar detección completa cada N cuadros
+
+
+def _iou(a, b) -> float:
+    at, ar, ab, al = a
+    bt, br, bb, bl = b
+    it, il = max(at, bt), max(al, bl)
+    ib, ir = min(ab, bb), min(ar, br)
+    inter = max(0, ib - it) * max(0, ir - il)
+    if inter <= 0:
+        return 0.0
+    area_a = (ab - at) * (ar - al)
+    area_b = (bb - bt) * (br - bl)
+    return inter / float(area_a + area_b - inter)
+
+
+class ResultadoFrame:
+    """Salida de una etapa del pipeline para un cuadro."""
+    __slots__ = ("cajas", "caja", "encoding", "estado", "motivo")
+
+    def __init__(self, cajas=(), caja=None, encoding=None, estado="sin_rostro", motivo=""):
+        self.cajas = list(cajas)    # todas las cajas detectadas (coord. completas)
+        self.caja = caja            # caja seguida (top, right, bottom, left) o None
+        self.encoding = encoding    # vector 128-d solo si se codificó en este cuadro
+        self.estado = estado        # sin_rostro | multiples | calidad | inestable | codificado
+        self.motivo = motivo        # texto para el HUD
+
+
+class PipelineRostro:
+    def __init__(self, escala: float = ESCALA_DETECCION,
+                 frames_estables: int = FRAMES_ESTABLES,
+                 verificar_calidad: bool = True):
+        self.escala = escala
+        self.frames_estables = frames_estables
+        self.verificar_calidad = verificar_calidad
+        import face_recognition
+        from enrolar_funcionaria import _quality_ok
+        self._fr = face_recognition
+        self._quality_ok = _quality_ok
+        self.reiniciar()
+
+    def reiniciar(self):
+        self._caja_prev = None
+        self._estables = 0
+        self._n = 0
+
+    # ---------- etapa 1+2: detección reducida con seguimiento ----------
+    def _detectar_en(self, rgb, top=0, left=0):
+        """Detecta en 'rgb' (recorte del cuadro completo) y devuelve cajas en coord. completas."""
+        h, w = rgb.shape[:2]
+        if h < 8 or w < 8:
+            return []
+        s = self.escala
+        small = cv2.resize(rgb, (max(1, int(w * s)), max(1, int(h * s))), interpolation=cv2.INTER_AREA)
+        locs = self._fr.face_locations(small, number_of_times_to_upsample=UPSAMPLE_DETECCION,
+                                       model="hog")
+        cajas = []
+        for (t, r, b, l) in locs:
+            cajas.append((int(t / s) + top, int(r / s) + left, int(b / s) + top, int(l / s) + left))
+        return cajas
+
+    def _roi_seguimiento(self, shape):
+        t, r, b, l = self._caja_prev
+        h, w = shape[:2]
+        mh, mw = int((b - t) * MARGEN_SEGUIMIENTO), int((r - l) * MARGEN_SEGUIMIENTO)
+        return max(0, t - mh), min(w, r + mw), min(h, b + mh), max(0, l - mw)
+
+    def _detectar(self, rgb):
+        self._n += 1
+        if self._caja_prev is not None and self._n % REDETECTAR_CADA:
+            t, r, b, l = self._roi_seguimiento(rgb.shape)
+            cajas = self._detectar_en(rgb[t:b, l:r], top=t, left=l)
+            if len(cajas) == 1:
+                return cajas
+        # Sin caja previa, cuadro de re-chequeo o se perdió el rostro: cuadro completo
+        return self._detectar_en(rgb)
+
+    # ---------- etapa 3+4: calidad, estabilidad y encoder ----------
+    def procesar(self, frame_bgr, rgb=None) -> ResultadoFrame:
+        if rgb is None:
+            rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+        cajas = self._detectar(rgb)
+
+        if not cajas:
+            self.reiniciar()
+            return ResultadoFrame(estado="sin_rostro", motivo="Ubique su rostro")
+        if len(cajas) > 1:
+            self._caja_prev, self._estables = None, 0
+            return ResultadoFrame(cajas, estado="multiples",
+                                  motivo="Por favor, solo 1 persona frente a la camara")
+
+        caja = cajas[0]
+        if self._caja_prev is not None and _iou(caja, self._caja_prev) >= IOU_ESTABLE:
+            self._estables += 1
+        else:
+            self._estables = 1
+        self._caja_prev = caja
+
+        if self.verificar_calidad:
+            ok, motivo = self._quality_ok(frame_bgr, caja)
+            if not ok:
+                return ResultadoFrame(cajas, caja, estado="calidad", motivo=motivo)
+
+        if self._estables < self.frames_estables:
+            return ResultadoFrame(cajas, caja, estado="inestable", motivo="Mire al frente sin moverse")
+
+        encs = self._fr.face_encodings(rgb, known_face_locations=[caja])
+        if not encs:
+            return ResultadoFrame(cajas, caja, estado="calidad", motivo="Reencuadra")
+        return ResultadoFrame(cajas, caja, encoding=encs[0], estado="codificado")
+
+
+def dibujar_resultado(frame_bgr, res: ResultadoFrame):
+    """Dibuja la caja seguida y el motivo (si lo hay) sobre el cuadro de vista previa."""
+    for (t, r, b, l) in res.cajas:
+        color = (0, 255, 0) if res.estado == "codificado" else (0, 255, 255)
+        cv2.rectangle(frame_bgr, (l, t), (r, b), color, 2)
+    if res.motivo:
+        color = (0, 0, 255) if res.estado == "multiples" else (0, 255, 255)
+        cv2.putText(frame_bgr, res.motivo, (40, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
@@ -1,7 +1,9 @@
 # principal.py
+import multiprocessing
+multiprocessing.freeze_support()   # .exe: el proceso de reconocimiento arranca aquí y no abre otra ventana
+
 import os
 import sys
-import sqlite3
 import tkinter as tk
 import customtkinter as ctk
 from tkinter import messagebox
@@ -9,12 +11,10 @@ import traceback
 import threading
 from datetime import datetime
 
-from db import crear_bd
-from panel_avanzado import construir_panel_avanzado
-from solicitudes import construir_solicitudes
-from cambio_clave_admin import abrir_cambio_clave
-from dia_administrativo import construir_dia_administrativo
-from resumen_dia import construir_resumen_dia
+from db import crear_bd, conectar
+from despacho_ui import iniciar_despacho, cancelar_ambito
+# Las pantallas se importan al abrirlas (ver mostrar_*): así la ventana aparece
+# sin esperar dlib/OpenCV/reportlab/tkcalendar.
 
 # ========== Hook global de errores ==========
 LOG_FILE = os.path.join(os.path.expanduser("~"), "Reloj_Control_error.log")
@@ -78,6 +78,8 @@ app.title("BioAccess/Control de Horarios | www.bioaccess.cl")
 
 # Instalar hook de excepciones para Tk/CTk
 _install_tk_exception_hook(app)
+# Resultados de hilos trabajadores/cámara -> hilo de Tk (ver despacho_ui.py)
+iniciar_despacho(app)
 
 # Tamaño mínimo si se desmaximiza (opcional pero recomendado)
 app.minsize(1200, 700)  # ← NUEVO
@@ -109,6 +111,14 @@ except Exception as e:
     app.destroy()
     sys.exit(1)
 
+# ========== Motor biométrico y reportes (carga en segundo plano) ==========
+# dlib/face_recognition en un proceso aparte (ver servidor_reconocimiento.py);
+# con el servidor arriba la UI solo precarga OpenCV para la cámara
+from servidor_reconocimiento import iniciar_servidor
+_servidor_reconocimiento = iniciar_servidor()
+from carga_diferida import iniciar_precarga
+iniciar_precarga(biometria=_servidor_reconocimiento is None)
+
 # ========== Helpers ==========
 def safe_focus(widget):
     """Intenta enfocar un widget sin reventar si ya no existe."""
@@ -125,7 +135,7 @@ label_contador = ctk.CTkLabel(app, text="", font=("Arial", 13), text_color="gray
 label_contador.pack(pady=(5, 10))
 
 def actualizar_contador():
-    con = sqlite3.connect(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
     cur.execute("SELECT COUNT(*) FROM trabajadores")
     total = cur.fetchone()[0]
@@ -156,6 +166,8 @@ frame_contenedor.pack(fill="both", expand=True, padx=20, pady=(5, 20))
 
 # ========== Funciones de navegación ==========
 def limpiar_frame():
+    # Lo que la pantalla anterior dejó corriendo ya no debe tocar la UI
+    cancelar_ambito(frame_contenedor)
     for widget in frame_contenedor.winfo_children():
         widget.destroy()
 
@@ -191,6 +203,32 @@ def mostrar_editar_usuario():
         ]
     )
 
+def mostrar_solicitudes():
+    from solicitudes import construir_solicitudes
+    construir_solicitudes(
+        frame_contenedor,
+        on_volver=lambda: [mostrar_ingreso_salida(), resaltar_boton_activo("ingreso")]
+    )
+
+def mostrar_dia_administrativo():
+    limpiar_frame()
+    from dia_administrativo import construir_dia_administrativo
+    construir_dia_administrativo(frame_contenedor)
+
+def mostrar_panel_avanzado():
+    limpiar_frame()
+    from panel_avanzado import construir_panel_avanzado
+    construir_panel_avanzado(frame_contenedor)
+
+def mostrar_resumen_dia():
+    limpiar_frame()
+    from resumen_dia import construir_resumen_dia
+    construir_resumen_dia(frame_contenedor)
+
+def abrir_cambio_clave():
+    from cambio_clave_admin import abrir_cambio_clave as _abrir
+    _abrir()
+
 # ========== Ventana de Bienvenida ==========
 def mostrar_bienvenida(nombre: str, autoclose_ms: int = 2500):
     TopLevelCls = getattr(ctk, "CTkToplevel", None) or tk.Toplevel
@@ -268,13 +306,7 @@ botones_menu["ingreso"] = btn_ingreso
 
 btn_solicitud = ctk.CTkButton(
     menu, text="Solicitar Permiso",
-    command=lambda: [
-        construir_solicitudes(
-            frame_contenedor,
-            on_volver=lambda: [mostrar_ingreso_salida(), resaltar_boton_activo("ingreso")]
-        ),
-        resaltar_boton_activo("solicitud")
-    ]
+    command=lambda: [mostrar_solicitudes(), resaltar_boton_activo("solicitud")]
 )
 btn_solicitud.pack(side="left", padx=5)
 botones_menu["solicitud"] = btn_solicitud
@@ -289,12 +321,12 @@ btn_nomina = ctk.CTkButton(menu, text="Nómina ICP",
 btn_editar = ctk.CTkButton(menu, text="Editar Usuario",
                            command=lambda: [mostrar_editar_usuario(), resaltar_boton_activo("editar")])
 btn_dia_admin = ctk.CTkButton(menu, text="Administrativos/Permisos",
-                              command=lambda: [limpiar_frame(), construir_dia_administrativo(frame_contenedor), resaltar_boton_activo("diaadmin")])
+                              command=lambda: [mostrar_dia_administrativo(), resaltar_boton_activo("diaadmin")])
 botones_menu["diaadmin"] = btn_dia_admin
 
 btn_clave = ctk.CTkButton(menu, text="Cambiar Clave Administrador", command=abrir_cambio_clave)
 btn_panel_avanzado = ctk.CTkButton(menu, text="Panel Avanzado",
-                                   command=lambda: [limpiar_frame(), construir_panel_avanzado(frame_contenedor), resaltar_boton_activo("panelavanzado")])
+                                   command=lambda: [mostrar_panel_avanzado(), resaltar_boton_activo("panelavanzado")])
 botones_menu["panelavanzado"] = btn_panel_avanzado
 
 # Ocultar inicialmente los de admin
@@ -378,7 +410,7 @@ def abrir_login_admin():
         def validar_admin():
             rut = entry_rut.get().strip()
             clave = entry_clave.get().strip()
-            con = sqlite3.connect(DB_PATH)
+            con = conectar(DB_PATH)
             cur = con.cursor()
             cur.execute("SELECT * FROM admins WHERE rut = ? AND clave = ?", (rut, clave))
             admin = cur.fetchone()
@@ -425,7 +457,7 @@ def abrir_login_admin():
         def validar_admin():
             rut = entry_rut.get().strip()
             clave = entry_clave.get().strip()
-            con = sqlite3.connect(DB_PATH)
+            con = conectar(DB_PATH)
             cur = con.cursor()
             cur.execute("SELECT * FROM admins WHERE rut = ? AND clave = ?", (rut, clave))
             admin = cur.fetchone()
@@ -477,7 +509,7 @@ btn_salir.pack(side="right", padx=5)
 # Botón Resumen Diario (visible para todos)
 btn_resumen = ctk.CTkButton(
     menu, text="Resumen Diario",
-    command=lambda: [limpiar_frame(), construir_resumen_dia(frame_contenedor), resaltar_boton_activo("resumen")]
+    command=lambda: [mostrar_resumen_dia(), resaltar_boton_activo("resumen")]
 )
 btn_resumen.pack(side="left", padx=5)
 botones_menu["resumen"] = btn_resumen
@@ -0,0 +1,217 @@
+# reconstruir_galeria.py
+"""
+Reconstrucción por lotes de la galería de rostros desde las fotos de referencia.
+
+Para cuando cambian los parámetros del encoder (num_jitters, modelo de landmarks)
+o hay que recuperar una carpeta 'rostros/' dañada, sin volver a enrolar a cada
+persona frente a la cámara.
+
+Fotos que se leen (RUT sacado del nombre, con o sin guion, K/k):
+  - rostros/<rut>.jpg|.jpeg|.png            foto de referencia (editar_usuario, registrar)
+  - rostros/capturas/<rut>/*.jpg|.jpeg|.png  cuadros archivados de enrolamiento
+
+Cada foto se detecta y codifica en un ProcessPoolExecutor (todos los núcleos por
+defecto); las muestras de cada persona se condensan a lo más k medoides
+(condensacion_plantillas). Al final la galería se escribe de una vez con
+AlmacenPlantillas.reemplazar_todo (generación nueva + os.replace del índice): la
+app ve la galería anterior o la nueva, nunca una mezcla.
+
+Quien no obtiene ninguna plantilla (sin rostro, varias caras, archivo ilegible) o
+no tiene fotos conserva sus plantillas actuales, salvo con --descartar.
+
+La app puede seguir enrolando mientras tanto: se toma una instantánea al empezar y
+al publicar (con el candado de la galería) lo que cambió desde entonces para una
+persona gana sobre lo reconstruido.
+
+Uso:
+    python reconstruir_galeria.py                       # reconstruye y escribe
+    python reconstruir_galeria.py --simular             # solo informa
+    python reconstruir_galeria.py --jitters 5 --modelo large --procesos 6
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from almacen_plantillas import AlmacenPlantillas, ROSTROS_DIR, clave_rut, rut_desde_clave
+from condensacion_plantillas import K_PLANTILLAS, condensar
+
+EXTENSIONES = (".jpg", ".jpeg", ".png")
+CARPETA_CAPTURAS = "capturas"
+
+
+# ============== INVENTARIO DE FOTOS ==============
+def _es_foto(nombre: str) -> bool:
+    return nombre.lower().endswith(EXTENSIONES)
+
+def fotos_por_rut(carpeta: str = ROSTROS_DIR) -> dict:
+    """{clave: [rutas]} con la foto de referencia primero y luego las capturas archivadas."""
+    fotos = {}
+    try:
+        entradas = sorted(os.scandir(carpeta), key=lambda e: e.name)
+    except FileNotFoundError:
+        return fotos
+    for e in entradas:
+        if e.is_file() and _es_foto(e.name):
+            fotos.setdefault(clave_rut(os.path.splitext(e.name)[0]), []).append(e.path)
+
+    capturas = os.path.join(carpeta, CARPETA_CAPTURAS)
+    if os.path.isdir(capturas):
+        for d in sorted(os.scandir(capturas), key=lambda e: e.name):
+            if not d.is_dir():
+                continue
+            rutas = sorted(os.path.join(d.path, n) for n in os.listdir(d.path) if _es_foto(n))
+            if rutas:
+                fotos.setdefault(clave_rut(d.name), []).extend(rutas)
+    return fotos
+
+
+# ============== TRABAJADORES (un proceso por núcleo) ==============
+_fr = None
+
+def _iniciar_trabajador():
+    """Una vez por proceso: modelos dlib (copia a %TEMP% si hace falta) + face_recognition."""
+    global _fr
+    from carga_diferida import _preparar_modelos_dlib
+    _preparar_modelos_dlib()
+    import face_recognition
+    _fr = face_recognition
+
+def _area(caja) -> int:
+    t, r, b, l = caja
+    return max(0, b - t) * max(0, r - l)
+
+def codificar_foto(ruta: str, jitters: int = 1, modelo: str = "small",
+                   deteccion: str = "hog", upsample: int = 1):
+    """(ruta, encoding float32 | None, motivo). Corre dentro de un proceso del pool."""
+    try:
+        rgb = _fr.load_image_file(ruta)
+    except Exception as e:
+        return ruta, None, f"no se pudo leer ({e})"
+    cajas = _fr.face_locations(rgb, number_of_times_to_upsample=upsample, model=deteccion)
+    if not cajas:
+        return ruta, None, "sin rostro"
+    if len(cajas) > 1:
+        # Foto de referencia con gente detrás: vale la cara dominante si lo es claramente
+        cajas = sorted(cajas, key=_area, reverse=True)
+        if _area(cajas[1]) * 2 > _area(cajas[0]):
+            return ruta, None, f"{len(cajas)} rostros"
+    encs = _fr.face_encodings(rgb, known_face_locations=[cajas[0]], num_jitters=jitters, model=modelo)
+    if not encs:
+        return ruta, None, "no se pudo codificar"
+    return ruta, np.asarray(encs[0], dtype=np.float32), ""
+
+
+# ============== RECONSTRUCCIÓN ==============
+def reconstruir(carpeta: str = ROSTROS_DIR, procesos: int | None = None, jitters: int = 1,
+                modelo: str = "small", deteccion: str = "hog", upsample: int = 1, k: int = K_PLANTILLAS,
+                descartar: bool = False, simular: bool = False, progreso=print) -> dict:
+    """
+    Re-codifica todas las fotos en paralelo y publica la galería completa.
+    Devuelve un informe {personas, fotos, plantillas, fallos: {rut: [(ruta, motivo)]}, ...}.
+    """
+    t0 = time.perf_counter()
+    almacen = AlmacenPlantillas(carpeta)
+    # Galería al empezar: se conserva a quien no se pudo reconstruir y, al publicar,
+    # sirve de base para no pisar lo que la app escriba mientras tanto
+    try:
+        base = almacen.instantanea()
+    except Exception as e:
+        progreso(f"[galeria] ⚠️ galería actual ilegible ({e}); se parte de cero")
+        base = None
+    actuales = base[0] if base else {}
+    fotos = fotos_por_rut(carpeta)
+    rutas = [(clave, r) for clave, lista in fotos.items() for r in lista]
+    procesos = procesos or os.cpu_count() or 1
+    progreso(f"[galeria] {len(rutas)} foto(s) de {len(fotos)} persona(s) con {procesos} proceso(s)")
+
+    por_clave = {clave: [] for clave in fotos}
+    fallos = {}
+    clave_de = {r: clave for clave, r in rutas}
+    hechas = 0
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_trabajador) as pool:
+        futuros = [pool.submit(codificar_foto, r, jitters, modelo, deteccion, upsample) for _c, r in rutas]
+        for fut in as_completed(futuros):
+            ruta, enc, motivo = fut.result()
+            clave = clave_de[ruta]
+            if enc is None:
+                fallos.setdefault(clave, []).append((ruta, motivo))
+            else:
+                por_clave[clave].append((ruta, enc))
+            hechas += 1
+            if hechas % 50 == 0:
+                progreso(f"[galeria] {hechas}/{len(rutas)} foto(s)")
+    t_codificar = time.perf_counter() - t0
+
+    nueva, conservadas = {}, []
+    for clave, lista in por_clave.items():
+        # Orden estable (foto de referencia primero) antes de condensar
+        if lista:
+            encs = [enc for _r, enc in sorted(lista, key=lambda x: fotos[clave].index(x[0]))]
+            nueva[rut_desde_clave(clave)] = condensar(np.vstack(encs), k)
+    for clave, (rut, m) in actuales.items():
+        if rut_desde_clave(clave) not in nueva and not descartar and len(m):
+            nueva[rut] = m
+            conservadas.append(rut)
+
+    concurrentes = []
+    if simular:
+        plantillas, personas = sum(len(m) for m in nueva.values()), len(nueva)
+    else:
+        concurrentes = almacen.reemplazar_todo(nueva, base)
+        matriz, publicadas = almacen.cargar()
+        plantillas, personas = int(len(matriz)), len(publicadas)
+
+    total = time.perf_counter() - t0
+    return {
+        "personas": personas,
+        "reconstruidas": sum(1 for lista in por_clave.values() if lista),
+        "conservadas": sorted(conservadas),
+        "concurrentes": concurrentes,
+        "fotos": len(rutas),
+        "plantillas": plantillas,
+        "fallos": {rut_desde_clave(c): v for c, v in sorted(fallos.items())},
+        "segundos": total,
+        "fotos_por_segundo": len(rutas) / t_codificar if t_codificar > 0 else 0.0,
+        "procesos": procesos,
+        "escrita": not simular,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Reconstruye la galería de rostros desde las fotos de referencia")
+    ap.add_argument("--carpeta", default=ROSTROS_DIR, help=f"carpeta de rostros (por defecto {ROSTROS_DIR})")
+    ap.add_argument("--procesos", type=int, help="procesos del pool (por defecto: todos los núcleos)")
+    ap.add_argument("--jitters", type=int, default=1, help="num_jitters del encoder (más = más lento y estable)")
+    ap.add_argument("--modelo", choices=("small", "large"), default="small", help="landmarks del encoder (5 o 68 puntos)")
+    ap.add_argument("--deteccion", choices=("hog", "cnn"), default="hog", help="detector de rostros")
+    ap.add_argument("--upsample", type=int, default=1, help="number_of_times_to_upsample del detector")
+    ap.add_argument("--k", type=int, default=K_PLANTILLAS, help="plantillas máximas por persona (condensación)")
+    ap.add_argument("--descartar", action="store_true", help="no conservar plantillas de quien no se pudo reconstruir")
+    ap.add_argument("--simular", action="store_true", help="no escribir la galería, solo informar")
+    args = ap.parse_args(argv)
+
+    inf = reconstruir(args.carpeta, args.procesos, args.jitters, args.modelo, args.deteccion,
+                      args.upsample, args.k, args.descartar, args.simular)
+
+    for rut, lista in inf["fallos"].items():
+        for ruta, motivo in lista:
+            print(f"  ❌ {rut}: {os.path.basename(ruta)} -> {motivo}")
+    if inf["conservadas"]:
+        print(f"  ↺ se conservan las plantillas actuales de: {', '.join(inf['conservadas'])}")
+    if inf["concurrentes"]:
+        print(f"  ⚠️ cambiaron durante la reconstrucción (se respeta lo vigente): {', '.join(inf['concurrentes'])}")
+    print(f"{'✅' if inf['escrita'] else 'ℹ️ (simulación)'} {inf['plantillas']} plantilla(s) de "
+          f"{inf['personas']} persona(s) | {inf['reconstruidas']} reconstruida(s), "
+          f"{len(inf['fallos'])} con fallos | {inf['fotos']} foto(s) en {inf['segundos']:.1f}s "
+          f"({inf['fotos_por_segundo']:.1f} fotos/s, {inf['procesos']} procesos)")
+    return 0 if inf["reconstruidas"] or not inf["fotos"] else 1
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -1,15 +1,16 @@
 import customtkinter as ctk
 import sqlite3
-from db import crear_bd
+from db import crear_bd, conectar
+from cache_horarios import invalidar_horarios
 from tkcalendar import DateEntry
 from datetime import datetime
 import tkinter as tk
 import face_recognition
 import cv2
 import os
-import pickle
 from tkinter import messagebox
 from PIL import Image, ImageTk  # ← para mostrar la foto
+from galeria_rostros import obtener_galeria
 
 crear_bd()
 
@@ -69,21 +70,19 @@ def construir_registro(frame_padre, on_guardado=None):
 
                     # normaliza para archivos
                     rut_norm = rut.replace(".", "").replace(" ", "")
-                    ruta_pkl = os.path.join("rostros", f"{rut_norm}.pkl")
                     ruta_jpg = os.path.join("rostros", f"{rut_norm}.jpg")
 
-                    # guarda encoding y foto
-                    with open(ruta_pkl, "wb") as f:
-                        pickle.dump(encodings[0], f)
+                    # guarda encoding (almacén de plantillas) y foto
+                    obtener_galeria().guardar_rut(rut, [encodings[0]])
                     try:
                         cv2.imwrite(ruta_jpg, frame)
                     except Exception:
                         pass
 
                     # guarda referencia en la BD (mantén el rut “tal cual” para compatibilidad)
-                    con = sqlite3.connect("reloj_control.db")
+                    con = conectar()
                     cur = con.cursor()
-                    cur.execute("UPDATE trabajadores SET verificacion_facial = ? WHERE rut = ?", (f"{rut}.pkl", rut))
+                    cur.execute("UPDATE trabajadores SET verificacion_facial = ? WHERE rut = ?", (f"galeria:{rut_norm}", rut))
                     con.commit()
                     con.close()
 
@@ -154,7 +153,7 @@ def construir_registro(frame_padre, on_guardado=None):
             label_estado.configure(text="❌ Faltan campos obligatorios", text_color="red")
             return
 
-        con = sqlite3.connect("reloj_control.db")
+        con = conectar()
         cur = con.cursor()
         try:
             cur.execute('''
@@ -174,6 +173,7 @@ def construir_registro(frame_padre, on_guardado=None):
                     ''', (rut, dia, turno, h_in, h_out))
 
             con.commit()
+            invalidar_horarios()
             label_estado.configure(text="✅ Nuevo Usuario registrado correctamente", text_color="green")
 
             # limpiar
@@ -1,20 +1,23 @@
 # reportes.py (actualizado con buscador por NOMBRE + colores/leyenda PDF + atrasos persistentes)
 import customtkinter as ctk
-import sqlite3
+from db import conectar, asegurar_esquema, capacidades
+from cache_horarios import obtener_horarios, a_minutos, a_segundos, a_texto
 from datetime import datetime, timedelta, date
 from tkcalendar import Calendar
 import tkinter as tk
 import pandas as pd
 import os
 from tkinter import messagebox
-import math
 from collections import Counter
 import smtplib
 import ssl
 import mimetypes
 from email.message import EmailMessage
 
-from feriados import es_feriado  # tu módulo de feriados
+from feriados import feriados_en_rango  # tu módulo de feriados
+from hechos_asistencia import leer_rango
+from despacho_ui import ejecutar
+from libro_extras import leer_libro
 
 # ======== PDF ========
 try:
@@ -61,54 +64,36 @@ def parse_hora_flexible(hora_str):
             continue
     return None
 
-def _ph_any(s):
-    if not s:
-        return None
-    for f in ("%H:%M:%S", "%H:%M"):
-        try:
-            return datetime.strptime(s.strip(), f)
-        except Exception:
-            pass
-    return None
+# Horas enteras: registros.seg_ingreso/seg_salida (segundos) y los bloques del
+# horario compilado (minutos) -> atraso y trabajado se calculan restando enteros.
+def _seg(info, clave):
+    """Segundos desde medianoche de info['ingreso'|'salida'] (registros.seg_* si vino de la BD)."""
+    seg = info.get("seg_" + clave)
+    return seg if seg is not None else a_segundos(info.get(clave))
+
+def _esperados_min(rut, fecha):
+    """(primera entrada, fin de jornada) del día en minutos desde medianoche; (None, None) sin horario."""
+    bloques = obtener_horarios().bloques(rut, fecha)
+    if not bloques:
+        return None, None
+    return bloques[0].inicio, max(b.fin for b in bloques) % (24 * 60)
+
+def _min_atraso_seg(seg_ingreso, min_esperado, toler=None) -> int:
+    """Minutos de atraso (hacia arriba) descontando tolerancia. 0 si no corresponde."""
+    if toler is None:
+        toler = TOLERANCIA_MIN
+    if seg_ingreso is None or min_esperado is None:
+        return 0
+    delta = seg_ingreso - min_esperado * 60
+    if delta > 60 * toler:
+        return (delta - 60 * toler + 59) // 60
+    return 0
 
 # ===================== BD: tablas de atrasos =====================
 
 def crear_tablas_atrasos(db_path="reloj_control.db"):
-    con = sqlite3.connect(db_path)
-    cur = con.cursor()
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS atrasos_diarios (
-      rut             TEXT    NOT NULL,
-      fecha           DATE    NOT NULL,
-      minutos_atraso  INTEGER NOT NULL,
-      hora_esperada   TEXT,
-      hora_ingreso    TEXT,
-      tolerancia_min  INTEGER NOT NULL DEFAULT 5,
-      calculado_en    TEXT    NOT NULL DEFAULT (datetime('now')),
-      PRIMARY KEY (rut, fecha)
-    )""")
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS atrasos_mensuales (
-      rut                     TEXT    NOT NULL,
-      anio                    INTEGER NOT NULL,
-      mes                     INTEGER NOT NULL,
-      minutos_atraso_total    INTEGER NOT NULL,
-      tolerancia_min          INTEGER NOT NULL DEFAULT 5,
-      cerrado_en              TEXT    NOT NULL DEFAULT (datetime('now')),
-      PRIMARY KEY (rut, anio, mes)
-    )""")
-
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_atrasos_m_rut ON atrasos_mensuales(rut)")
-    con.commit()
-    con.close()
-
-# Asegura las tablas al importar el módulo
-try:
-    crear_tablas_atrasos()
-except Exception as _e:
-    print("Aviso: no se pudo crear/verificar tablas de atrasos:", _e)
+    """atrasos_diarios / atrasos_mensuales son parte del esquema versionado (db._migracion_2)."""
+    asegurar_esquema(db_path)
 
 
 # ====== ATRASOS: cálculo y persistencia ======
@@ -119,23 +104,14 @@ def _calcular_min_atraso(ingreso_str, esperado_str, fecha_iso, toler=None):
         toler = TOLERANCIA_MIN
     if not ingreso_str or ingreso_str == "--" or not esperado_str:
         return 0
-    ti = _ph_any(ingreso_str); te = _ph_any(esperado_str)
-    if not ti or not te:
-        return 0
-    base = datetime.strptime(fecha_iso, "%Y-%m-%d").date()
-    di = datetime.combine(base, ti.time())
-    de = datetime.combine(base, te.time())
-    delta = (di - de).total_seconds()
-    if delta > 60 * toler:
-        return int(math.ceil((delta - 60 * toler) / 60.0))
-    return 0
+    return _min_atraso_seg(a_segundos(ingreso_str), a_minutos(esperado_str), toler)
 
 
 def guardar_atraso_diario(rut, fecha_iso, minutos, hora_esperada, hora_ingreso, toler=None):
     """UPSERT de atraso diario para (rut, fecha)."""
     if toler is None:
         toler = TOLERANCIA_MIN
-    con = sqlite3.connect("reloj_control.db")
+    con = conectar()
     cur = con.cursor()
     cur.execute("""
         INSERT INTO atrasos_diarios (rut, fecha, minutos_atraso, hora_esperada, hora_ingreso, tolerancia_min, calculado_en)
@@ -150,12 +126,112 @@ def guardar_atraso_diario(rut, fecha_iso, minutos, hora_esperada, hora_ingreso,
     con.commit(); con.close()
 
 
+def _consolidar_meses(cur, rut, desde_iso, hasta_iso, toler):
+    """
+    UPSERT agrupado: un total por cada mes de [desde, hasta] (0 si el mes no tiene
+    atrasos_diarios, como consolidar_atrasos_mensuales); no reescribe lo igual.
+    """
+    cur.execute("""
+        WITH RECURSIVE meses(inicio) AS (
+            SELECT date(?, 'start of month')
+            UNION ALL
+            SELECT date(inicio, '+1 month') FROM meses WHERE date(inicio, '+1 month') <= ?
+        ),
+        sumas(periodo, total) AS (
+            SELECT strftime('%Y-%m', fecha), SUM(minutos_atraso)
+            FROM atrasos_diarios
+            WHERE rut=? AND fecha BETWEEN ? AND ?
+            GROUP BY 1
+        )
+        INSERT INTO atrasos_mensuales (rut, anio, mes, minutos_atraso_total, tolerancia_min, cerrado_en)
+        SELECT ?,
+               CAST(strftime('%Y', m.inicio) AS INTEGER),
+               CAST(strftime('%m', m.inicio) AS INTEGER),
+               COALESCE(s.total, 0), ?, datetime('now')
+        FROM meses m
+        LEFT JOIN sumas s ON s.periodo = strftime('%Y-%m', m.inicio)
+        WHERE true
+        ON CONFLICT(rut, anio, mes) DO UPDATE SET
+          minutos_atraso_total=excluded.minutos_atraso_total,
+          tolerancia_min=excluded.tolerancia_min,
+          cerrado_en=excluded.cerrado_en
+        WHERE minutos_atraso_total <> excluded.minutos_atraso_total
+           OR tolerancia_min <> excluded.tolerancia_min
+    """, (desde_iso, hasta_iso, rut, desde_iso, hasta_iso, rut, int(toler)))
+
+
+def guardar_atrasos_periodo(rut, filas, toler=None):
+    """
+    Persiste los atrasos de un período completo en UNA transacción.
+
+    filas: [(fecha_iso, minutos, hora_esperada, hora_ingreso), ...]
+    Solo escribe los días que cambiaron (executemany) y, si hubo cambios, actualiza
+    atrasos_mensuales de los meses tocados con un único UPSERT agrupado.
+    Devuelve cuántos días se escribieron (0 = nada cambió, no se abrió transacción de escritura).
+    """
+    if toler is None:
+        toler = TOLERANCIA_MIN
+    filas = [(f, int(m), he, hi) for f, m, he, hi in filas]
+    if not filas:
+        return 0
+    fechas = sorted(f for f, _m, _he, _hi in filas)
+    desde, hasta = date.fromisoformat(fechas[0]), date.fromisoformat(fechas[-1])
+    mes_desde = desde.replace(day=1).isoformat()
+    mes_hasta = _month_range(hasta.year, hasta.month)[1].isoformat()
+
+    con = conectar()
+    try:
+        cur = con.cursor()
+        cur.execute("""
+            SELECT fecha, minutos_atraso, hora_esperada, hora_ingreso, tolerancia_min
+            FROM atrasos_diarios
+            WHERE rut=? AND fecha BETWEEN ? AND ?
+        """, (rut, fechas[0], fechas[-1]))
+        previos = {r[0]: tuple(r[1:]) for r in cur.fetchall()}
+        cambios = [(rut, f, m, he, hi, int(toler)) for f, m, he, hi in filas
+                   if previos.get(f) != (m, he, hi, int(toler))]
+
+        cur.execute("""
+            SELECT anio, mes FROM atrasos_mensuales
+            WHERE rut=? AND (anio * 100 + mes) BETWEEN ? AND ?
+        """, (rut, desde.year * 100 + desde.month, hasta.year * 100 + hasta.month))
+        consolidados = {(int(a), int(m)) for a, m in cur.fetchall()}
+        faltan_meses = any((int(f[:4]), int(f[5:7])) not in consolidados for f in fechas)
+        if not cambios and not faltan_meses:
+            return 0
+
+        propia = not con.in_transaction
+        if propia:
+            cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.executemany("""
+                INSERT INTO atrasos_diarios (rut, fecha, minutos_atraso, hora_esperada, hora_ingreso, tolerancia_min, calculado_en)
+                VALUES (?,?,?,?,?,?, datetime('now'))
+                ON CONFLICT(rut, fecha) DO UPDATE SET
+                  minutos_atraso=excluded.minutos_atraso,
+                  hora_esperada=excluded.hora_esperada,
+                  hora_ingreso=excluded.hora_ingreso,
+                  tolerancia_min=excluded.tolerancia_min,
+                  calculado_en=datetime('now')
+            """, cambios)
+            _consolidar_meses(cur, rut, mes_desde, mes_hasta, toler)
+            if propia:
+                con.commit()
+        except Exception:
+            if propia and con.in_transaction:
+                con.rollback()
+            raise
+        return len(cambios)
+    finally:
+        con.close()
+
+
 def consolidar_atrasos_mensuales(rut, anio, mes, toler=None):
     """Suma atrasos_diarios del mes y los guarda/actualiza en atrasos_mensuales."""
     if toler is None:
         toler = TOLERANCIA_MIN
     desde, hasta = _month_range(anio, mes)
-    con = sqlite3.connect("reloj_control.db"); cur = con.cursor()
+    con = conectar(); cur = con.cursor()
     cur.execute("""
         SELECT COALESCE(SUM(minutos_atraso),0)
         FROM atrasos_diarios
@@ -175,20 +251,22 @@ def consolidar_atrasos_mensuales(rut, anio, mes, toler=None):
     return total
 
 
-def consolidar_atrasos_por_rango(rut, desde_dt, hasta_dt):
-    """Consolida todos los meses que tocan el rango [desde_dt, hasta_dt]."""
-    y, m = desde_dt.year, desde_dt.month
-    end_y, end_m = hasta_dt.year, hasta_dt.month
-    while (y < end_y) or (y == end_y and m <= end_m):
-        consolidar_atrasos_mensuales(rut, y, m)
-        if m == 12:
-            y += 1; m = 1
-        else:
-            m += 1
+def consolidar_atrasos_por_rango(rut, desde_dt, hasta_dt, toler=None):
+    """Consolida todos los meses que tocan el rango [desde_dt, hasta_dt] (un solo UPSERT agrupado)."""
+    if toler is None:
+        toler = TOLERANCIA_MIN
+    desde = date(desde_dt.year, desde_dt.month, 1)
+    hasta = _month_range(hasta_dt.year, hasta_dt.month)[1]
+    con = conectar()
+    try:
+        _consolidar_meses(con.cursor(), rut, desde.isoformat(), hasta.isoformat(), toler)
+        con.commit()
+    finally:
+        con.close()
 
 
 def leer_total_atraso_mensual(rut, anio, mes):
-    con = sqlite3.connect("reloj_control.db"); cur = con.cursor()
+    con = conectar(); cur = con.cursor()
     cur.execute("""SELECT minutos_atraso_total
                    FROM atrasos_mensuales
                    WHERE rut=? AND anio=? AND mes=?""", (rut, int(anio), int(mes)))
@@ -201,33 +279,13 @@ def leer_total_atraso_mensual(rut, anio, mes):
 def obtener_horario_del_dia(rut, fecha_dt):
     if isinstance(fecha_dt, str):
         fecha_dt = datetime.strptime(fecha_dt, "%Y-%m-%d")
-
-    dias_en = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    dias_es = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo']
-    dia_norm = dias_es[dias_en.index(fecha_dt.strftime("%A"))]
-
-    con = sqlite3.connect("reloj_control.db")
-    cur = con.cursor()
-    cur.execute("""
-        SELECT hora_entrada, hora_salida
-        FROM horarios
-        WHERE rut = ?
-          AND lower(replace(replace(replace(replace(replace(dia,'á','a'),'é','e'),'í','i'),'ó','o'),'ú','u')) = ?
-        ORDER BY time(hora_entrada)
-    """, (rut, dia_norm))
-    filas = cur.fetchall()
-    con.close()
-
-    if not filas:
-        return (None, None)
-
-    he = filas[0][0].strip() if filas[0][0] else None
-    hs = filas[-1][1].strip() if filas[-1][1] else None  # ÚLTIMA SALIDA (fin de jornada)
-    return (he, hs)
+    # Primer ingreso y ÚLTIMA SALIDA (fin de jornada) desde el horario compilado
+    horarios = obtener_horarios()
+    return (horarios.entrada_esperada(rut, fecha_dt), horarios.salida_esperada(rut, fecha_dt))
 
 def obtener_horario_base(rut):
     try:
-        con = sqlite3.connect("reloj_control.db")
+        con = conectar()
         cur = con.cursor()
         cur.execute("""
             SELECT MIN(time(hora_entrada)), MAX(time(hora_salida))
@@ -244,12 +302,8 @@ def obtener_horario_base(rut):
 
 def get_info_trabajador(conn, rut):
     cur = conn.cursor()
-    try:
-        cur.execute("PRAGMA table_info(trabajadores)")
-        cols = {c[1].lower() for c in cur.fetchall()}
-    except Exception:
-        cols = set()
-    if "correo" in cols:
+    tiene_correo = capacidades().tiene_columna("trabajadores", "correo")
+    if tiene_correo:
         cur.execute("""
             SELECT nombre, apellido, profesion, correo
             FROM trabajadores
@@ -264,13 +318,13 @@ def get_info_trabajador(conn, rut):
     row = cur.fetchone()
     if not row:
         return None
-    if "correo" in cols:
+    if tiene_correo:
         return row
     return (row[0], row[1], row[2], None)
 
 def cargar_trabajadores():
     try:
-        con = sqlite3.connect("reloj_control.db")
+        con = conectar()
         cur = con.cursor()
         cur.execute("SELECT rut, nombre, apellido FROM trabajadores ORDER BY apellido, nombre")
         lista = []
@@ -287,14 +341,14 @@ def cargar_trabajadores():
 # ===================== Carga Horaria (semanal) =====================
 
 def calcular_carga_horaria_semana(rut):
-    con = sqlite3.connect("reloj_control.db")
+    con = conectar()
     cur = con.cursor()
     cur.execute("""
         SELECT lower(replace(replace(replace(replace(replace(dia,'á','a'),'é','e'),'í','i'),'ó','o'),'ú','u')) AS d,
-               hora_entrada, hora_salida
+               min_entrada, min_salida
         FROM horarios
         WHERE rut = ?
-        ORDER BY d, time(hora_entrada)
+        ORDER BY d, min_entrada
     """, (rut,))
     filas = cur.fetchall()
     con.close()
@@ -308,11 +362,9 @@ def calcular_carga_horaria_semana(rut):
 
     for d, bloques in bloques_por_dia.items():
         bloques_validos = 0
-        for he, hs in bloques:
-            t1 = parse_hora_flexible(he)
-            t2 = parse_hora_flexible(hs)
-            if t1 and t2:
-                mins = int((t2 - t1).total_seconds() // 60)
+        for m1, m2 in bloques:
+            if m1 is not None and m2 is not None:
+                mins = m2 - m1
                 if mins > 0:
                     total_min += mins
                     bloques_validos += 1
@@ -329,7 +381,7 @@ def calcular_carga_horaria_semana(rut):
 
 def obtener_cupo_admin_para_rut(rut):
     try:
-        con = sqlite3.connect("reloj_control.db")
+        con = conectar()
         cur = con.cursor()
         cur.execute("""
             SELECT valor FROM parametros_trabajador
@@ -347,7 +399,7 @@ def contar_admin_anio(rut: str, anio: int | None = None) -> int:
     try:
         if anio is None:
             anio = datetime.now().year
-        con = sqlite3.connect("reloj_control.db")
+        con = conectar()
         cur = con.cursor()
         cur.execute("""
             SELECT COUNT(*)
@@ -361,95 +413,33 @@ def contar_admin_anio(rut: str, anio: int | None = None) -> int:
     except Exception:
         return 0
 
-# ===================== Extras mensuales (detección flexible) =====================
-
-def _detectar_tabla_extras(conn):
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tablas = [r[0] for r in cur.fetchall()]
-    except Exception:
-        return None
-
-    candidatos = [
-        "extras_mensuales", "extras_mensual", "minutos_extra_mensual",
-        "minutos_extras_mensuales", "saldo_extras_mensual", "acumulado_extras_mensual"
-    ]
-    for t in tablas:
-        if t.lower() in candidatos:
-            try:
-                cur.execute(f"PRAGMA table_info({t})")
-                cols = {c[1].lower() for c in cur.fetchall()}
-            except Exception:
-                cols = set()
-            col_min = next((c for c in ["minutos_extra","minutos","min_extras","minutos_extras","total_minutos"] if c in cols), None)
-            col_anio = "anio" if "anio" in cols else ("year" if "year" in cols else None)
-            col_mes  = "mes"  if "mes"  in cols else ("month" if "month" in cols else None)
-            if col_min and col_anio and col_mes and "rut" in cols:
-                return {"tabla": t, "col_min": col_min, "col_anio": col_anio, "col_mes": col_mes}
-    for t in tablas:
-        try:
-            cur.execute(f"PRAGMA table_info({t})")
-            cols = {c[1].lower() for c in cur.fetchall()}
-        except Exception:
-            continue
-        if "rut" in cols and (("anio" in cols) or ("year" in cols)) and (("mes" in cols) or ("month" in cols)):
-            col_min = next((c for c in ["minutos_extra","minutos","min_extras","minutos_extras","total_minutos"] if c in cols), None)
-            if col_min:
-                return {
-                    "tabla": t,
-                    "col_min": col_min,
-                    "col_anio": "anio" if "anio" in cols else "year",
-                    "col_mes":  "mes"  if "mes"  in cols else "month"
-                }
-    return None
+# ===================== Extras mensuales (libro_extras) =====================
 
 def leer_minutos_extra_mes(rut, anio, mes):
     try:
-        con = sqlite3.connect("reloj_control.db")
-        meta = _detectar_tabla_extras(con)
-        if not meta:
-            con.close()
-            return None
-        t, cmin, canio, cmes = meta["tabla"], meta["col_min"], meta["col_anio"], meta["col_mes"]
-        cur = con.cursor()
-        cur.execute(f"SELECT {cmin} FROM {t} WHERE rut=? AND {canio}=? AND {cmes}=?", (rut, int(anio), int(mes)))
-        row = cur.fetchone()
-        con.close()
-        if row and row[0] is not None:
-            try:
-                return int(row[0])
-            except Exception:
-                val = str(row[0])
-                if ":" in val:
-                    hh, mm = val.split(":")
-                    return int(hh) * 60 + int(mm)
-        return None
+        libro = leer_libro([rut], anio)[rut]
+        return libro.meses.get((int(anio), int(mes)))
     except Exception:
         return None
 
 def sumar_minutos_extras_anio(rut, anio):
-    total = 0
-    for m in range(1, 13):
-        mins = leer_minutos_extra_mes(rut, anio, m)
-        if mins:
-            total += int(mins)
-    return total
+    try:
+        return leer_libro([rut], anio)[rut].anio(anio)
+    except Exception:
+        return 0
 
 def sumar_minutos_extras_hasta_mes(rut, anio, mes):
-    total = 0
-    for m in range(1, mes+1):
-        mins = leer_minutos_extra_mes(rut, anio, m)
-        if mins:
-            total += int(mins)
-    return total
+    try:
+        return leer_libro([rut], anio)[rut].acumulado(anio, mes)
+    except Exception:
+        return 0
 
 # ===================== Email (HTML simple) =====================
 
 def _smtp_load_config():
     cfg = {}
     try:
-        con = sqlite3.connect("reloj_control.db")
+        con = conectar()
         cur = con.cursor()
         try:
             cur.execute("SELECT host, port, user, password, use_tls, use_ssl, remitente FROM smtp_config LIMIT 1")
@@ -576,90 +566,41 @@ def _month_range(anio, mes):
         last = date(anio, mes+1, 1) - timedelta(days=1)
     return first, last
 
-def _obtener_registros_mes(rut, anio, mes):
-    con = sqlite3.connect("reloj_control.db")
-    cur = con.cursor()
-    desde, hasta = _month_range(anio, mes)
-    cur.execute("""
-        SELECT fecha, hora_ingreso, hora_salida, observacion
-        FROM registros
-        WHERE rut=? AND fecha BETWEEN ? AND ?
-        ORDER BY fecha
-    """, (rut, desde.isoformat(), hasta.isoformat()))
-    rows = cur.fetchall()
-    con.close()
-    reg = {}
-    for fecha, hi, hs, obs in rows:
-        reg[fecha] = {"ingreso": hi or "--", "salida": hs or "--", "obs": obs or ""}
-    dia = desde
-    while dia <= hasta:
-        fiso = dia.isoformat()
-        if fiso not in reg:
-            reg[fiso] = {"ingreso": "--", "salida": "--", "obs": ""}
-        dia += timedelta(days=1)
-    return reg
-
 def _calcular_metricas_mes(rut, anio, mes):
-    registros = _obtener_registros_mes(rut, anio, mes)
+    """Métricas del mes desde asistencia_dia (un escaneo por rango, sin recalcular día a día)."""
+    desde, hasta = _month_range(anio, mes)
+    hechos = leer_rango(desde, hasta, [rut])
     total_min_atraso = 0
-    ci_cumple = 0
-    ci_total = 0
-    cs_cumple = 0
-    cs_total = 0
+    ci_cumple = ci_total = 0
+    cs_cumple = cs_total = 0
     filas_diarias = []
 
-    for fiso in sorted(registros.keys()):
-        info = registros[fiso]
-        ingreso = info["ingreso"] or "--"
-        salida = info["salida"] or "--"
-        obs = info["obs"] or ""
-
-        he, hs = obtener_horario_del_dia(rut, fiso)
-        atraso_min = 0
-        if ingreso != "--" and he:
-            t_i = _ph_any(ingreso)
-            t_e = _ph_any(he)
-            if t_i and t_e:
-                base = datetime.strptime(fiso, "%Y-%m-%d").date()
-                di = datetime.combine(base, t_i.time())
-                de = datetime.combine(base, t_e.time())
-                delta = (di - de).total_seconds()
-                if delta > 60 * TOLERANCIA_MIN:
-                    atraso_min = math.ceil((delta - 60 * TOLERANCIA_MIN) / 60.0)
-                    total_min_atraso += atraso_min
+    dia = desde
+    while dia <= hasta:
+        h = hechos.get((rut, dia.isoformat())) or {}
+        ingreso = h.get("hora_ingreso") or "--"
+        salida = h.get("hora_salida") or "--"
+        atraso_min = int(h.get("min_atraso") or 0)
+        total_min_atraso += atraso_min
 
         cumpl_i = "—"
-        if he and ingreso != "--":
+        if h.get("entrada_esperada") and ingreso != "--":
             ci_total += 1
-            try:
-                t_i = _ph_any(ingreso); t_e = _ph_any(he)
-                base = datetime.strptime(fiso, "%Y-%m-%d").date()
-                di = datetime.combine(base, t_i.time())
-                de = datetime.combine(base, t_e.time())
-                cumpl = di <= (de + timedelta(minutes=TOLERANCIA_MIN))
-                cumpl_i = "Sí" if cumpl else "No"
-                if cumpl: ci_cumple += 1
-            except Exception:
-                pass
+            cumpl_i = "Sí" if atraso_min == 0 else "No"
+            if atraso_min == 0: ci_cumple += 1
 
         cumpl_s = "—"
-        if hs and salida != "--":
+        if h.get("salida_esperada") and salida != "--":
             cs_total += 1
-            try:
-                t_s = _ph_any(salida); t_e = _ph_any(hs)
-                base = datetime.strptime(fiso, "%Y-%m-%d").date()
-                ds = datetime.combine(base, t_s.time())
-                de = datetime.combine(base, t_e.time())
-                cumpl = ds >= (de - timedelta(minutes=SALIDA_TOLERANCIA_MIN))
-                cumpl_s = "Sí" if cumpl else "No"
-                if cumpl: cs_cumple += 1
-            except Exception:
-                pass
+            cumpl = int(h.get("min_salida_anticipada") or 0) <= SALIDA_TOLERANCIA_MIN
+            cumpl_s = "Sí" if cumpl else "No"
+            if cumpl: cs_cumple += 1
 
         filas_diarias.append([
-            datetime.strptime(fiso, "%Y-%m-%d").strftime("%d/%m/%Y"),
-            ingreso, salida, cumpl_i, cumpl_s, atraso_min, obs
+            dia.strftime("%d/%m/%Y"),
+            ingreso, salida, cumpl_i, cumpl_s, atraso_min, h.get("observacion") or ""
         ])
+        dia += timedelta(days=1)
 
     return {
         "total_min_atraso": int(total_min_atraso),
@@ -928,6 +869,7 @@ def exportar_pdf(rut, nombre, apellido, cargo, periodo, datos_tabla, resumen, ab
 # ===================== Construir Reportes (UI + lógica) =====================
 
 def construir_reportes(frame_padre):
+    crear_tablas_atrasos()
     registros_por_dia = {}
     # Elementos UI que se usan en callbacks
     label_estado = None
@@ -972,36 +914,7 @@ def construir_reportes(frame_padre):
             else:
                 fecha_dt = fecha_str_o_dt
 
-            nombre_dia = fecha_dt.strftime("%A")
-            dias_map = {
-                'Monday': 'lunes', 'Tuesday': 'martes', 'Wednesday': 'miercoles',
-                'Thursday': 'jueves', 'Friday': 'viernes', 'Saturday': 'sabado', 'Sunday': 'domingo'
-            }
-            dia = dias_map.get(nombre_dia, '').lower()
-            dia_norm = (dia
-                        .replace('á', 'a').replace('é', 'e')
-                        .replace('í', 'i').replace('ó', 'o').replace('ú', 'u'))
-
-            conexion = sqlite3.connect("reloj_control.db")
-            cursor = conexion.cursor()
-            cursor.execute("""
-                SELECT hora_entrada, hora_salida FROM horarios
-                WHERE rut = ?
-                  AND lower(replace(replace(replace(replace(replace(dia,'á','a'),'é','e'),'í','i'),'ó','o'),'ú','u')) = ?
-            """, (rut, dia_norm))
-            filas = cursor.fetchall()
-            conexion.close()
-
-            total_minutos = 0
-            for entrada_str, salida_str in filas:
-                if not entrada_str or not salida_str:
-                    continue
-                entrada = parse_hora_flexible(entrada_str)
-                salida = parse_hora_flexible(salida_str)
-                if not entrada or not salida:
-                    continue
-                minutos = int((salida - entrada).total_seconds() // 60)
-                total_minutos += int(minutos)
+            total_minutos = obtener_horarios().minutos_programados(rut, fecha_dt)
 
             if como_minutos:
                 return int(total_minutos)
@@ -1015,7 +928,7 @@ def construir_reportes(frame_padre):
 
     # -------- mezcla administrativos --------
     def agregar_dias_administrativos(regs_por_dia, rut, desde_dt, hasta_dt):
-        conexion = sqlite3.connect("reloj_control.db")
+        conexion = conectar()
         cursor = conexion.cursor()
         desde_str = desde_dt.strftime('%Y-%m-%d')
         hasta_str = hasta_dt.strftime('%Y-%m-%d')
@@ -1076,40 +989,17 @@ def construir_reportes(frame_padre):
 
             if ingreso != "--":
                 try:
-                    fecha_dt = datetime.strptime(fecha, "%Y-%m-%d")
-                    nombre_dia = fecha_dt.strftime("%A")
-                    dias_map = {"Monday":"Lunes","Tuesday":"Martes","Wednesday":"Miércoles",
-                                "Thursday":"Jueves","Friday":"Viernes","Saturday":"Sábado","Sunday":"Domingo"}
-                    nombre_dia_es = dias_map.get(nombre_dia, "")
-                    conexion = sqlite3.connect("reloj_control.db")
-                    cursor = conexion.cursor()
-                    cursor.execute("""
-                        SELECT hora_entrada FROM horarios
-                        WHERE rut = ? AND dia = ?
-                    """, (rut, nombre_dia_es))
-                    resultado = cursor.fetchone()
-                    conexion.close()
-                    if resultado:
-                        hora_esperada_entrada = resultado[0]
-                        t_ingreso = _ph_any(ingreso)
-                        t_esperada = _ph_any(hora_esperada_entrada)
-                        if t_ingreso and t_esperada:
-                            base_date = fecha_dt.date()
-                            t_i = datetime.combine(base_date, t_ingreso.time())
-                            t_e = datetime.combine(base_date, t_esperada.time())
-                            delta = (t_i - t_e).total_seconds()
-                            if delta > 300:
-                                total_min_atraso += math.ceil((delta - 300) / 60.0)
+                    min_esperado, _fin = _esperados_min(rut, fecha)
+                    total_min_atraso += _min_atraso_seg(_seg(info, "ingreso"), min_esperado, 5)
                 except Exception:
                     pass
 
             trabajado_str = info.get("trabajado")
             if not trabajado_str or trabajado_str == "0h 0min":
                 if ingreso != "--" and salida != "--":
-                    t1 = parse_hora_flexible(ingreso)
-                    t2 = parse_hora_flexible(salida)
-                    if t1 and t2:
-                        mins = int((t2 - t1).total_seconds() // 60)
+                    s1, s2 = _seg(info, "ingreso"), _seg(info, "salida")
+                    if s1 is not None and s2 is not None:
+                        mins = (s2 - s1) // 60
                         total_min_trabajados += mins
                         info["trabajado"] = f"{mins//60}h {mins%60}min"
                 elif es_admin:
@@ -1158,8 +1048,14 @@ def construir_reportes(frame_padre):
     # -------- Construir filas para PDF (detalle período visible) --------
     def construir_datos_pdf(regs_por_dia, rut):
         datos = []
-        extras_mes_cache = {}
-        extras_ytd_cache = {}
+        atrasos_periodo = []
+        # Min. Extra Mes / Año: todos los meses del período en una consulta
+        anios = sorted({int(f[:4]) for f in regs_por_dia}) or [datetime.now().year]
+        try:
+            libro = leer_libro([rut], anios[0], anios[-1])[rut]
+        except Exception as e:
+            print("WARN leer_libro extras:", e)
+            libro = None
         for fecha in sorted(regs_por_dia):
             info = regs_por_dia[fecha]
             ingreso = info.get("ingreso", "--") or "--"
@@ -1168,42 +1064,28 @@ def construir_reportes(frame_padre):
             obs_salida = info.get("obs_salida", "") or ""
             obs_txt = (obs_ingreso + (" | " if obs_ingreso and obs_salida else "") + obs_salida).strip()
 
-            he, hs = obtener_horario_del_dia(rut, fecha)
+            min_ent, min_fin = _esperados_min(rut, fecha)
+            he = a_texto(min_ent) if min_ent is not None else None
+            hs = a_texto(min_fin) if min_fin is not None else None
             esp_ing = he or "—"
             esp_sal = hs or "—"
 
             # atraso del día
             min_atraso = 0
             if ingreso != "--" and he:
-                try:
-                    fecha_dt = datetime.strptime(fecha, "%Y-%m-%d")
-                    t_i = _ph_any(ingreso)
-                    t_e = _ph_any(he)
-                    if t_i and t_e:
-                        base = fecha_dt.date()
-                        t_i2 = datetime.combine(base, t_i.time())
-                        t_e2 = datetime.combine(base, t_e.time())
-                        delta = (t_i2 - t_e2).total_seconds()
-                        if delta > 60 * TOLERANCIA_MIN:
-                            min_atraso = math.ceil((delta - 60 * TOLERANCIA_MIN) / 60.0)
-                except Exception:
-                    pass
+                min_atraso = _min_atraso_seg(_seg(info, "ingreso"), min_ent)
 
-            # persistimos el atraso del día
-            try:
-                if ingreso != "--" and he:
-                    guardar_atraso_diario(rut, fecha, int(min_atraso), he, ingreso, TOLERANCIA_MIN)
-            except Exception as e:
-                print("WARN guardar_atraso_diario:", e)
+            # atraso del día: se persiste todo el período junto al final
+            if ingreso != "--" and he:
+                atrasos_periodo.append((fecha, int(min_atraso), he, ingreso))
 
             # trabajado
             trabajado = info.get("trabajado", "")
             if not trabajado or trabajado == "0h 0min":
                 if ingreso != "--" and salida != "--":
-                    t1 = parse_hora_flexible(ingreso)
-                    t2 = parse_hora_flexible(salida)
-                    if t1 and t2:
-                        mins = int((t2 - t1).total_seconds() // 60)
+                    s1, s2 = _seg(info, "ingreso"), _seg(info, "salida")
+                    if s1 is not None and s2 is not None:
+                        mins = (s2 - s1) // 60
                         h_, m_ = divmod(mins, 60)
                         trabajado = f"{h_:02d}:{m_:02d}"
                     else:
@@ -1218,30 +1100,21 @@ def construir_reportes(frame_padre):
                     except Exception:
                         pass
 
-            # Min. Extra Mes
-            try:
-                fdt = datetime.strptime(fecha, "%Y-%m-%d").date()
-                key = (fdt.year, fdt.month)
-                if key not in extras_mes_cache:
-                    val = leer_minutos_extra_mes(rut, fdt.year, fdt.month)
-                    extras_mes_cache[key] = int(val) if val is not None else 0
-                min_extra_mes = extras_mes_cache[key]
-            except Exception:
-                min_extra_mes = 0
-
-            # Min. Extra Año (YTD: enero..mes)
-            try:
-                key2 = (fdt.year, fdt.month)
-                if key2 not in extras_ytd_cache:
-                    extras_ytd_cache[key2] = int(sumar_minutos_extras_hasta_mes(rut, fdt.year, fdt.month))
-                min_extra_ytd = extras_ytd_cache[key2]
-            except Exception:
-                min_extra_ytd = 0
+            # Min. Extra Mes / Min. Extra Año (YTD: enero..mes)
+            fdt = datetime.strptime(fecha, "%Y-%m-%d").date()
+            min_extra_mes = libro.mes(fdt.year, fdt.month) if libro else 0
+            min_extra_ytd = libro.acumulado(fdt.year, fdt.month) if libro else 0
 
             datos.append([
                 datetime.strptime(fecha, "%Y-%m-%d").strftime("%d/%m/%Y"),
                 ingreso, esp_ing, salida, esp_sal, trabajado, min_atraso, min_extra_mes, min_extra_ytd, obs_txt
             ])
+
+        # Una transacción para todo el período (y atrasos_mensuales de los meses tocados)
+        try:
+            guardar_atrasos_periodo(rut, atrasos_periodo, TOLERANCIA_MIN)
+        except Exception as e:
+            print("WARN guardar_atrasos_periodo:", e)
         return datos
 
     # -------- Ventana "Enviar por Correo" --------
@@ -1292,11 +1165,9 @@ def construir_reportes(frame_padre):
         entry_cc.grid(row=2, column=1, sticky="w", pady=(0,6))
 
         try:
-            conx = sqlite3.connect("reloj_control.db")
+            conx = conectar()
             curx = conx.cursor()
-            curx.execute("PRAGMA table_info(trabajadores)")
-            cols = {c[1].lower() for c in curx.fetchall()}
-            if "correo" in cols:
+            if capacidades().tiene_columna("trabajadores", "correo"):
                 curx.execute("SELECT correo FROM trabajadores WHERE rut=?", (ctx["rut"],))
                 row = curx.fetchone()
                 if row and row[0] and "@" in row[0]:
@@ -1336,6 +1207,8 @@ def construir_reportes(frame_padre):
         ctk.CTkButton(btns, text="Cancelar", fg_color="#475569", command=win.destroy, width=120).pack(side="left", padx=(0,6))
 
         def _enviar():
+            if btn_enviar.cget("state") == "disabled":
+                return      # ya se está enviando
             to_raw = entry_to.get().strip()
             cc_raw = entry_cc.get().strip()
             subject = entry_subject.get().strip() or "Reporte de asistencia"
@@ -1345,27 +1218,28 @@ def construir_reportes(frame_padre):
                 return
             to_list = [p.strip() for p in to_raw.replace(",", ";").split(";") if p.strip()]
             cc_list = [c.strip() for c in cc_raw.replace(",", ";").split(";") if c.strip()]
-            attach_path = None
-            if var_adj.get():
-                nonlocal_pdf = getattr(frame, "_ultimo_pdf_path", None)
-                if not nonlocal_pdf or not os.path.exists(nonlocal_pdf):
-                    try:
-                        nonlocal_pdf = exportar_pdf(
-                            rut=ctx["rut"],
-                            nombre=ctx["nombre"],
-                            apellido=ctx["apellido"],
-                            cargo=ctx["cargo"],
-                            periodo=ctx["periodo"],
-                            datos_tabla=ctx["datos_tabla"],
-                            resumen=ctx["resumen"],
-                            abrir=False
-                        )
-                    except Exception as e:
-                        messagebox.showerror("PDF", f"No se pudo generar el PDF para adjuntar:\n{e}")
-                        return
-                attach_path = nonlocal_pdf
-
-            try:
+            adjuntar = bool(var_adj.get())
+            pdf_previo = getattr(frame, "_ultimo_pdf_path", None)
+
+            def trabajo():
+                # Hilo trabajador: PDF + SMTP (no tocan widgets)
+                attach_path = None
+                if adjuntar and HAS_PDF:       # sin reportlab se envía sin adjunto (nada de diálogos aquí)
+                    attach_path = pdf_previo
+                    if not attach_path or not os.path.exists(attach_path):
+                        try:
+                            attach_path = exportar_pdf(
+                                rut=ctx["rut"],
+                                nombre=ctx["nombre"],
+                                apellido=ctx["apellido"],
+                                cargo=ctx["cargo"],
+                                periodo=ctx["periodo"],
+                                datos_tabla=ctx["datos_tabla"],
+                                resumen=ctx["resumen"],
+                                abrir=False
+                            )
+                        except Exception as e:
+                            raise RuntimeError(f"No se pudo generar el PDF para adjuntar:\n{e}") from e
                 html = _html_email_informe(ctx["periodo"], ctx["identidad"])
                 _smtp_send(
                     to_list=to_list,
@@ -1375,16 +1249,24 @@ def construir_reportes(frame_padre):
                     html_body=html,
                     attachment_path=attach_path
                 )
+
+            def enviado(_):
                 messagebox.showinfo("Envío exitoso", "Correo enviado correctamente.")
                 try:
                     win.grab_release()
                 except Exception:
                     pass
                 win.destroy()
-            except Exception as e:
+
+            def fallo(e):
+                btn_enviar.configure(state="normal", text="Enviar")
                 messagebox.showerror("Error al enviar", f"No fue posible enviar el correo:\n{e}")
 
-        ctk.CTkButton(btns, text="Enviar", fg_color="#22c55e", command=_enviar, width=160).pack(side="right", padx=(6,0))
+            btn_enviar.configure(state="disabled", text="Enviando...")
+            ejecutar(trabajo, al_terminar=enviado, al_fallar=fallo, ambito=win, nombre="enviar_reporte")
+
+        btn_enviar = ctk.CTkButton(btns, text="Enviar", fg_color="#22c55e", command=_enviar, width=160)
+        btn_enviar.pack(side="right", padx=(6,0))
         cont.grid_columnconfigure(1, weight=1)
         master.update_idletasks()
         w, h = 640, 460
@@ -1440,7 +1322,7 @@ def construir_reportes(frame_padre):
             entry_rut.insert(0, item["rut"])
             _cerrar_popup()
             try:
-                con = sqlite3.connect("reloj_control.db")
+                con = conectar()
                 info = get_info_trabajador(con, item["rut"])
                 con.close()
                 if info:
@@ -1505,7 +1387,7 @@ def construir_reportes(frame_padre):
             label_estado.configure(text="⚠️ Selecciona un funcionario (nombre) o ingresa un RUT", text_color="red")
             return
 
-        conexion = sqlite3.connect("reloj_control.db")
+        conexion = conectar()
         info_trabajador = get_info_trabajador(conexion, rut)
 
         if info_trabajador:
@@ -1532,7 +1414,7 @@ def construir_reportes(frame_padre):
 
         cursor = conexion.cursor()
         cursor.execute("""
-            SELECT fecha, hora_ingreso, hora_salida, observacion
+            SELECT fecha, hora_ingreso, hora_salida, observacion, seg_ingreso, seg_salida
             FROM registros
             WHERE rut = ? AND fecha BETWEEN ? AND ?
             ORDER BY fecha
@@ -1540,7 +1422,7 @@ def construir_reportes(frame_padre):
         registros = cursor.fetchall()
         conexion.close()
 
-        for fecha, hora_ingreso, hora_salida, observacion in registros:
+        for fecha, hora_ingreso, hora_salida, observacion, seg_ingreso, seg_salida in registros:
             if fecha not in registros_por_dia:
                 registros_por_dia[fecha] = {
                     "ingreso": "--", "salida": "--",
@@ -1548,19 +1430,22 @@ def construir_reportes(frame_padre):
                 }
             if hora_ingreso:
                 registros_por_dia[fecha]["ingreso"] = hora_ingreso
+                registros_por_dia[fecha]["seg_ingreso"] = seg_ingreso
                 registros_por_dia[fecha]["obs_ingreso"] = observacion or registros_por_dia[fecha]["obs_ingreso"]
             if hora_salida:
                 registros_por_dia[fecha]["salida"] = hora_salida
+                registros_por_dia[fecha]["seg_salida"] = seg_salida
                 registros_por_dia[fecha]["obs_salida"] = observacion or registros_por_dia[fecha]["obs_salida"]
 
         agregar_dias_administrativos(registros_por_dia, rut, desde_dt, hasta_dt)
 
-        # feriados + días vacíos
+        # feriados + días vacíos (feriados del período en una sola consulta al calendario)
+        feriados_periodo = {f.isoformat(): n for f, n, _irr in feriados_en_rango(desde_dt.date(), hasta_dt.date())}
         dia = desde_dt.date()
         while dia <= hasta_dt.date():
             fiso = dia.isoformat()
-            es_f, nombre_f, _ = es_feriado(dia)
-            if es_f and fiso not in registros_por_dia:
+            nombre_f = feriados_periodo.get(fiso)
+            if nombre_f is not None and fiso not in registros_por_dia:
                 registros_por_dia[fiso] = {
                     "ingreso": "--", "salida": "--",
                     "obs_ingreso": f"Feriado: {nombre_f}",
@@ -1590,15 +1475,15 @@ def construir_reportes(frame_padre):
                 except Exception:
                     continue
 
-                _, salida_horario = obtener_horario_del_dia(rut, fecha_dt)
-                if not salida_horario:
+                _, min_fin = _esperados_min(rut, fecha_dt)
+                if min_fin is None:
                     continue
 
-                info["salida"] = salida_horario
-                t1 = parse_hora_flexible(info.get("ingreso")) if info.get("ingreso") and info.get("ingreso") != "--" else None
-                t2 = parse_hora_flexible(salida_horario)
-                if t1 and t2:
-                    mins = int((t2 - t1).total_seconds() // 60)
+                info["salida"] = a_texto(min_fin)
+                info["seg_salida"] = min_fin * 60
+                s1 = _seg(info, "ingreso")
+                if s1 is not None:
+                    mins = (min_fin * 60 - s1) // 60
                     h_, m_ = divmod(mins, 60)
                     info["trabajado"] = f"{h_}h {m_}min"
                 else:
@@ -1638,17 +1523,16 @@ def construir_reportes(frame_padre):
                     fecha_dt = datetime.strptime(fecha, "%Y-%m-%d")
                 except Exception:
                     fecha_dt = None
-                he, hs = obtener_horario_del_dia(rut, fecha_dt if fecha_dt else fecha)
-                esp_ing = he or "—"
-                esp_sal = hs or "—"
+                info = registros_por_dia[fecha]
+                min_ent, min_fin = _esperados_min(rut, fecha_dt if fecha_dt else fecha)
+                esp_ing = a_texto(min_ent) if min_ent is not None else "—"
+                esp_sal = a_texto(min_fin) if min_fin is not None else "—"
 
                 # Calcular trabajado efectivo
                 if not es_admin and ingreso not in (None, "--") and salida not in (None, "--"):
-                    t1 = parse_hora_flexible(ingreso)
-                    t2 = parse_hora_flexible(salida)
-                    if t1 and t2:
-                        duracion = (t2 - t1)
-                        minutos = int(duracion.total_seconds() // 60)
+                    s1, s2 = _seg(info, "ingreso"), _seg(info, "salida")
+                    if s1 is not None and s2 is not None:
+                        minutos = (s2 - s1) // 60
                         h_, m_ = divmod(minutos, 60)
                         trabajado = f"{int(h_)}h {int(m_)}min"
                         registros_por_dia[fecha]["trabajado"] = trabajado
@@ -1665,20 +1549,20 @@ def construir_reportes(frame_padre):
                 ingreso_color = None
                 salida_color = None
                 try:
-                    if ingreso and ingreso != "--" and esp_ing and esp_ing != "—":
-                        ti = parse_hora_flexible(ingreso); te = parse_hora_flexible(esp_ing)
-                        if ti and te:
-                            if ti > (te + timedelta(minutes=TOLERANCIA_MIN)):
+                    if ingreso and ingreso != "--" and min_ent is not None:
+                        ti = _seg(info, "ingreso")
+                        if ti is not None:
+                            if ti > (min_ent + TOLERANCIA_MIN) * 60:
                                 ingreso_color = "red"
                             else:
                                 ingreso_color = "green"
                 except Exception:
                     pass
                 try:
-                    if salida and salida != "--" and esp_sal and esp_sal != "—":
-                        ts = parse_hora_flexible(salida); to = parse_hora_flexible(esp_sal)
-                        if ts and to:
-                            if ts < (to - timedelta(minutes=SALIDA_TOLERANCIA_MIN)):
+                    if salida and salida != "--" and min_fin is not None:
+                        ts = _seg(info, "salida")
+                        if ts is not None:
+                            if ts < (min_fin - SALIDA_TOLERANCIA_MIN) * 60:
                                 salida_color = "red"
                             else:
                                 salida_color = "green"
@@ -1771,16 +1655,10 @@ def construir_reportes(frame_padre):
             )
 
             # --- NUEVO BLOQUE FINAL ORDENADO DENTRO DE if registros_por_dia ---
-            # 1) Construir datos PDF (esto persiste atrasos_diarios día a día)
+            # 1) Construir datos PDF (persiste atrasos_diarios y consolida los meses en una transacción)
             datos_pdf = construir_datos_pdf(registros_por_dia, rut)
 
-            # 2) Consolidar todos los meses que toca el rango
-            try:
-                consolidar_atrasos_por_rango(rut, desde_dt, hasta_dt)
-            except Exception as e:
-                print("WARN consolidar_atrasos_por_rango:", e)
-
-            # 3) Si el período visible es un único mes, usar el total mensual desde BD
+            # 2) Si el período visible es un único mes, usar el total mensual desde BD
             if desde_dt.year == hasta_dt.year and desde_dt.month == hasta_dt.month:
                 try:
                     total_mes_bd = leer_total_atraso_mensual(rut, desde_dt.year, desde_dt.month)
@@ -1788,7 +1666,7 @@ def construir_reportes(frame_padre):
                 except Exception as _e:
                     pass
 
-            # 4) Contexto para exportar y estado
+            # 3) Contexto para exportar y estado
             frame._ultimo_contexto_pdf = {
                 "rut": rut,
                 "nombre": nombre,
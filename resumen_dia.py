@@ -8,7 +8,9 @@ import tempfile
 import customtkinter as ctk
 import tkinter as tk
 import tkinter.ttk as ttk
-import sqlite3
+from db import conectar, capacidades
+from cache_horarios import obtener_horarios
+from despacho_ui import ejecutar
 from datetime import datetime, date, timedelta
 from email.message import EmailMessage
 from xml.sax.saxutils import escape
@@ -45,7 +47,7 @@ SMTP_FALLBACK = {
 def _smtp_load_config():
     cfg = {}
     try:
-        con = sqlite3.connect(DB); cur = con.cursor()
+        con = conectar(DB); cur = con.cursor()
         try:
             cur.execute("SELECT host, port, user, password, use_tls, use_ssl, remitente FROM smtp_config LIMIT 1")
             row = cur.fetchone()
@@ -149,11 +151,7 @@ def _diff_minutes(a: str, b: str) -> int | None:
 # ================= Atrasos mensuales =================
 def _table_exists(tabla: str) -> bool:
     try:
-        con = sqlite3.connect(DB); cur = con.cursor()
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND lower(name)=lower(?)", (tabla,))
-        ok = cur.fetchone() is not None
-        con.close()
-        return ok
+        return capacidades(DB).tiene_tabla(tabla)
     except Exception:
         return False
 
@@ -172,12 +170,12 @@ def _read_atraso_mensual_db(rut: str, fecha: date) -> int | None:
     per = fecha.strftime("%Y-%m")
     anio, mes = fecha.year, fecha.month
 
-    con = sqlite3.connect(DB); cur = con.cursor()
-    cur.execute("PRAGMA table_info(atrasos_mensuales)")
-    cols = [c[1].lower() for c in cur.fetchall()]
+    cols = [c.lower() for c in capacidades(DB).columnas("atrasos_mensuales")]
     minutos_col = "minutos" if "minutos" in cols else ("total_minutos" if "total_minutos" in cols else None)
     if not minutos_col:
-        con.close(); return None
+        return None
+
+    con = conectar(DB); cur = con.cursor()
 
     result = None
     try:
@@ -208,34 +206,36 @@ def _read_atraso_mensual_db(rut: str, fecha: date) -> int | None:
     return result
 
 def _calc_atraso_mensual_on_the_fly(rut: str, fecha_corte: date) -> int:
+    # Mismo criterio que las cifras diarias de esta pantalla (bloque más cercano,
+    # minutos truncados, RUT normalizado); todo el mes en una sola consulta.
     first, _last = _month_bounds(fecha_corte)
-    total = 0
-    con = sqlite3.connect(DB); cur = con.cursor()
+    con = conectar(DB); cur = con.cursor()
     try:
-        d = first
-        while d <= fecha_corte:
-            fecha_iso = _date_to_iso(d)
-            cur.execute("""
-                SELECT COALESCE(NULLIF(hora_ingreso,''), 
-                                CASE WHEN lower(IFNULL(tipo,''))='ingreso' THEN IFNULL(hora,'') ELSE '' END)
-                FROM registros
-                WHERE DATE(fecha)=? 
-                  AND REPLACE(REPLACE(UPPER(IFNULL(rut,'')),'.',''),'-','')
-                      = REPLACE(REPLACE(UPPER(?),'.',''),'-','')
-                  AND TRIM(COALESCE(hora_ingreso, CASE WHEN lower(IFNULL(tipo,''))='ingreso' THEN IFNULL(hora,'') ELSE '' END))<>''
-                ORDER BY time(COALESCE(hora_ingreso, hora)) ASC
-                LIMIT 1
-            """, (fecha_iso, rut))
-            r = cur.fetchone()
-            h_real = r[0] if r and r[0] else ""
-            if h_real:
-                h_esp = _expected_ingreso(rut, d, h_real) or ""
-                dm = _diff_minutes(h_real or "", h_esp or "")
-                if dm is not None and dm > TOL_INGRESO_MIN:
-                    total += (dm - TOL_INGRESO_MIN)
-            d += timedelta(days=1)
+        cur.execute("""
+            SELECT fecha,
+                   COALESCE(NULLIF(hora_ingreso,''),
+                            CASE WHEN lower(IFNULL(tipo,''))='ingreso' THEN IFNULL(hora,'') ELSE '' END)
+            FROM registros
+            WHERE fecha BETWEEN ? AND ?
+              AND REPLACE(REPLACE(UPPER(IFNULL(rut,'')),'.',''),'-','')
+                  = REPLACE(REPLACE(UPPER(?),'.',''),'-','')
+              AND TRIM(COALESCE(hora_ingreso, CASE WHEN lower(IFNULL(tipo,''))='ingreso' THEN IFNULL(hora,'') ELSE '' END))<>''
+            ORDER BY fecha, time(COALESCE(hora_ingreso, hora)) ASC
+        """, (_date_to_iso(first), _date_to_iso(fecha_corte), rut))
+        primeros = {}
+        for fecha_iso, h_real in cur.fetchall():
+            primeros.setdefault(fecha_iso, h_real)
     finally:
         con.close()
+
+    total = 0
+    for fecha_iso, h_real in primeros.items():
+        if not h_real:
+            continue
+        h_esp = _expected_ingreso(rut, date.fromisoformat(fecha_iso), h_real) or ""
+        dm = _diff_minutes(h_real or "", h_esp or "")
+        if dm is not None and dm > TOL_INGRESO_MIN:
+            total += (dm - TOL_INGRESO_MIN)
     return total
 
 def _get_atraso_mensual(rut: str, fecha: date) -> int:
@@ -246,7 +246,7 @@ def _get_atraso_mensual(rut: str, fecha: date) -> int:
 
 # ================= Consultas =================
 def _fetch_ingresos(fecha_iso: str):
-    con = sqlite3.connect(DB); cur = con.cursor()
+    con = conectar(DB); cur = con.cursor()
     cur.execute("""
         WITH rows AS (
           SELECT
@@ -257,7 +257,7 @@ def _fetch_ingresos(fecha_iso: str):
             IFNULL(rut,'')  AS rut,
             IFNULL(nombre,'') AS nombre
           FROM registros
-          WHERE DATE(fecha)=?
+          WHERE fecha=?
         )
         SELECT h_real, rut, nombre, h_ing_col
         FROM rows
@@ -268,7 +268,7 @@ def _fetch_ingresos(fecha_iso: str):
     return rows
 
 def _fetch_salidas(fecha_iso: str):
-    con = sqlite3.connect(DB); cur = con.cursor()
+    con = conectar(DB); cur = con.cursor()
     cur.execute("""
         WITH rows AS (
           SELECT
@@ -279,7 +279,7 @@ def _fetch_salidas(fecha_iso: str):
             IFNULL(rut,'')  AS rut,
             IFNULL(nombre,'') AS nombre
           FROM registros
-          WHERE DATE(fecha)=?
+          WHERE fecha=?
         )
         SELECT h_real, rut, nombre, h_ing_col
         FROM rows
@@ -293,9 +293,8 @@ def _fetch_observaciones(fecha_iso: str):
     """
     Observaciones/permisos del día (registros + dias_libres si existe)
     """
-    con = sqlite3.connect(DB); cur = con.cursor()
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND lower(name)='dias_libres'")
-    has_dl = cur.fetchone() is not None
+    con = conectar(DB); cur = con.cursor()
+    has_dl = _table_exists("dias_libres")
 
     if has_dl:
         sql = """
@@ -309,7 +308,7 @@ def _fetch_observaciones(fecha_iso: str):
                 IFNULL(hora,'')         AS hx,
                 IFNULL(tipo,'')         AS tp
               FROM registros
-              WHERE DATE(fecha)=?
+              WHERE fecha=?
             ),
             rows_reg AS (
               SELECT
@@ -365,7 +364,7 @@ def _fetch_observaciones(fecha_iso: str):
                 IFNULL(hora,'')         AS hx,
                 IFNULL(tipo,'')         AS tp
               FROM registros
-              WHERE DATE(fecha)=?
+              WHERE fecha=?
             ),
             rows AS (
               SELECT
@@ -395,24 +394,8 @@ def _fetch_observaciones(fecha_iso: str):
 
 # ================= Horarios esperados =================
 def _fetch_horarios_dia(rut: str, dia_es: str):
-    con = sqlite3.connect(DB); cur = con.cursor()
-    cur.execute("""
-        SELECT TRIM(IFNULL(hora_entrada,'')) AS he,
-               TRIM(IFNULL(hora_salida ,'')) AS hs
-        FROM horarios
-        WHERE REPLACE(REPLACE(UPPER(IFNULL(rut,'')),'.',''),'-','')
-              = REPLACE(REPLACE(UPPER(?),'.',''),'-','')
-          AND LOWER(TRIM(IFNULL(dia,''))) = LOWER(TRIM(?))
-        ORDER BY time(
-            CASE
-              WHEN instr(he, ':')>0 THEN
-                printf('%02d:%s', CAST(substr(he,1,instr(he,':')-1) AS INT), substr(he,instr(he,':')+1))
-              ELSE he
-            END
-        ) ASC
-    """, (rut, dia_es))
-    rows = cur.fetchall(); con.close()
-    return rows
+    # (entrada, salida) 'HH:MM' ordenados por entrada, desde el horario compilado en memoria
+    return [tuple(b) for b in obtener_horarios().bloques(rut, dia_es)]
 
 def _ultima_salida_programada(rut: str, fecha: date) -> str:
     dia = DAYS_ES[fecha.weekday()]
@@ -639,12 +622,12 @@ def _pdf_resumen_dia(path, fecha_dt: date, combinados_pdf, observs_pdf, resumen_
 # ================= Ventana detalle (persona) =================
 def _open_person_detail(parent, fecha: date, rut: str, nombre: str):
     fecha_iso = _date_to_iso(fecha)
-    con = sqlite3.connect(DB); cur = con.cursor()
+    con = conectar(DB); cur = con.cursor()
 
     cur.execute("""
         SELECT COALESCE(NULLIF(hora_ingreso,''), CASE WHEN lower(IFNULL(tipo,''))='ingreso' THEN IFNULL(hora,'') ELSE '' END)
         FROM registros
-        WHERE DATE(fecha)=? AND rut=? AND TRIM(COALESCE(hora_ingreso, CASE WHEN lower(IFNULL(tipo,''))='ingreso' THEN IFNULL(hora,'') ELSE '' END))<>''
+        WHERE fecha=? AND rut=? AND TRIM(COALESCE(hora_ingreso, CASE WHEN lower(IFNULL(tipo,''))='ingreso' THEN IFNULL(hora,'') ELSE '' END))<>''
         ORDER BY time(COALESCE(hora_ingreso, hora)) ASC LIMIT 1
     """, (fecha_iso, rut))
     row_in = cur.fetchone()
@@ -653,7 +636,7 @@ def _open_person_detail(parent, fecha: date, rut: str, nombre: str):
     cur.execute("""
         SELECT COALESCE(NULLIF(hora_salida,''), CASE WHEN lower(IFNULL(tipo,''))='salida' THEN IFNULL(hora,'') ELSE '' END)
         FROM registros
-        WHERE DATE(fecha)=? AND rut=? AND TRIM(COALESCE(hora_salida, CASE WHEN lower(IFNULL(tipo,''))='salida' THEN IFNULL(hora,'') ELSE '' END))<>''
+        WHERE fecha=? AND rut=? AND TRIM(COALESCE(hora_salida, CASE WHEN lower(IFNULL(tipo,''))='salida' THEN IFNULL(hora,'') ELSE '' END))<>''
         ORDER BY time(COALESCE(hora_salida, hora)) DESC LIMIT 1
     """, (fecha_iso, rut))
     row_out = cur.fetchone()
@@ -666,7 +649,7 @@ def _open_person_detail(parent, fecha: date, rut: str, nombre: str):
                     WHEN TRIM(hora_salida)<>'' THEN 'Salida'
                     ELSE 'Otro' END AS tipo
         FROM registros
-        WHERE DATE(fecha)=? AND rut=? AND TRIM(COALESCE(observacion,''))<>''
+        WHERE fecha=? AND rut=? AND TRIM(COALESCE(observacion,''))<>''
         ORDER BY CASE WHEN TRIM(h)<>'' THEN time(h) ELSE time('23:59:59') END
     """, (fecha_iso, rut))
     obs_rows = cur.fetchall(); con.close()
@@ -1076,28 +1059,37 @@ def construir_resumen_dia(frame_padre):
             subject = ent_sub.get().strip() or "Resumen Diario"
             body = tb.get("1.0", "end").strip()
 
-            tmp = tempfile.NamedTemporaryFile(prefix="resumen_", suffix=".pdf", delete=False)
-            tmp.close()
-            try:
-                _pdf_resumen_dia(
-                    tmp.name,
-                    state["fecha"],
-                    last_pdf_payload["combined"],
-                    last_pdf_payload["obs"],
-                    last_pdf_payload["resume"]
-                )
-                _smtp_send(to, [], subject, body, html_body=None, attachment_path=tmp.name)
+            if btn_enviar.cget("state") == "disabled":
+                return      # ya se está enviando
+            fecha = state["fecha"]
+            payload = dict(last_pdf_payload)
+
+            def trabajo():
+                # Hilo trabajador: PDF temporal + SMTP
+                tmp = tempfile.NamedTemporaryFile(prefix="resumen_", suffix=".pdf", delete=False)
+                tmp.close()
+                try:
+                    _pdf_resumen_dia(tmp.name, fecha, payload["combined"], payload["obs"], payload["resume"])
+                    _smtp_send(to, [], subject, body, html_body=None, attachment_path=tmp.name)
+                finally:
+                    try: os.remove(tmp.name)
+                    except Exception: pass
+
+            def enviado(_):
                 tk.messagebox.showinfo("Enviar", "Correo enviado correctamente.")
                 win.destroy()
-            except Exception as e:
+
+            def fallo(e):
+                btn_enviar.configure(state="normal", text="Enviar")
                 tk.messagebox.showerror("Enviar", f"No fue posible enviar el correo:\n{e}")
-            finally:
-                try: os.remove(tmp.name)
-                except Exception: pass
+
+            btn_enviar.configure(state="disabled", text="Enviando...")
+            ejecutar(trabajo, al_terminar=enviado, al_fallar=fallo, ambito=win, nombre="enviar_resumen")
 
         btns = ctk.CTkFrame(cont, fg_color="transparent"); btns.grid(row=3, column=0, columnspan=2, pady=(10,0))
         ctk.CTkButton(btns, text="Cancelar", fg_color="#6b7280", width=120, command=win.destroy).pack(side="left", padx=6)
-        ctk.CTkButton(btns, text="Enviar", fg_color="#22c55e", width=140, command=enviar).pack(side="left", padx=6)
+        btn_enviar = ctk.CTkButton(btns, text="Enviar", fg_color="#22c55e", width=140, command=enviar)
+        btn_enviar.pack(side="left", padx=6)
 
         try:
             root.update_idletasks()
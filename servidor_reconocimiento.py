@@ -0,0 +1,467 @@
+# servidor_reconocimiento.py
+"""
+Reconocimiento facial en un proceso aparte.
+
+El proceso servidor (multiprocessing, 'spawn') es dueño de dlib/face_recognition,
+del PipelineRostro de cada sesión y de la galería de encodings. La app le pasa
+los cuadros por memoria compartida y recibe los resultados por una cola:
+
+  - SLOTS ranuras de TAM_SLOT bytes en un SharedMemory; el cliente copia el
+    cuadro en una ranura libre y encola solo (id, sesión, ranura, forma, rut);
+  - el servidor procesa la vista numpy sobre esa ranura y devuelve cajas,
+    estado, motivo y el match (rut, distancia, margen), sin el cuadro;
+  - estado_galeria() pide al servidor los conteos de la galería, así la UI no
+    la carga (ni a dlib/face_recognition) mientras el servidor esté en uso;
+  - la ranura se libera al llegar la respuesta. Si la solicitud venció, la ranura
+    queda retenida hasta que llegue la respuesta tardía de ese id o muera el
+    proceso: el servidor podría seguir leyéndola.
+
+Un hilo supervisor espera la muerte del proceso (crash de dlib/OpenCV): falla las
+solicitudes pendientes con ServidorCaido, crea colas nuevas y lo vuelve a lanzar
+con espera creciente. El hilo de Tk nunca espera al servidor: quien llama a
+procesar() es el TrabajadorReconocimiento de captura_camara.
+
+Uso:
+    analizador = nuevo_analizador(rut=None)    # remoto si el servidor está arriba, si no local
+    res, match = analizador.analizar(frame)    # match = (rut, distancia, margen) | None
+    analizador.cerrar()
+    estado_galeria(rut=None)                   # {"personas", "encodings", "del_rut"}
+"""
+import atexit
+import itertools
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+USAR_PROCESO_APARTE = True     # False: todo en el proceso de la UI, como antes
+SLOTS = 4                      # cuadros en vuelo a la vez (una sesión usa uno)
+TAM_SLOT = 1280 * 720 * 3      # cuadros más grandes viajan por la cola (pickle)
+TIMEOUT_S = 5.0                # respuesta de un cuadro (y espera máxima al arranque)
+ARRANQUE_S = 60.0              # espera al arranque antes de consultar la galería (carga de dlib)
+REINTENTO_S = (1, 2, 5, 10)    # espera antes de cada relanzamiento
+
+
+class ServidorCaido(RuntimeError):
+    """El proceso de reconocimiento no está disponible (cargando, caído o reiniciándose)."""
+
+
+class ResultadoRemoto:
+    """Misma forma que pipeline_rostro.ResultadoFrame (sirve a dibujar_resultado), sin encoding."""
+    __slots__ = ("cajas", "caja", "encoding", "estado", "motivo")
+
+    def __init__(self, cajas=(), caja=None, estado="sin_rostro", motivo=""):
+        self.cajas = list(cajas)
+        self.caja = caja
+        self.encoding = None
+        self.estado = estado
+        self.motivo = motivo
+
+
+# ============== ANÁLISIS DE UN CUADRO (común a ambos lados) ==============
+def _analizar(pipeline, frame, rut=None):
+    """(ResultadoFrame, match) con match = (rut, distancia, margen) si el cuadro se codificó."""
+    from galeria_rostros import obtener_galeria
+    from matcher_rostros import matcher_desde_galeria
+
+    res = pipeline.procesar(frame)
+    if res.encoding is None:
+        return res, None
+    galeria = obtener_galeria()
+    if rut is not None:
+        # 1:1 (verificar_rostro): misma distancia euclidiana que face_distance
+        encs = galeria.encodings_de(rut)
+        best = float(np.min(np.linalg.norm(encs - res.encoding, axis=1))) if len(encs) else 1.0
+        return res, (rut, best, float("inf"))
+    return res, matcher_desde_galeria(galeria).mejor(res.encoding)
+
+
+def _estado_galeria(rut=None):
+    """Conteos de la galería de este proceso (del_rut solo si se pide un RUT)."""
+    from galeria_rostros import obtener_galeria
+    galeria = obtener_galeria()
+    return {
+        "personas": len(galeria.filas_por_rut()),
+        "encodings": len(galeria),
+        "del_rut": len(galeria.encodings_de(rut)) if rut is not None else None,
+    }
+
+
+class AnalizadorLocal:
+    """En el proceso de la UI (USAR_PROCESO_APARTE=False o servidor sin arrancar)."""
+
+    def __init__(self, rut=None):
+        from pipeline_rostro import PipelineRostro
+        self.rut = rut
+        self._pipeline = PipelineRostro()
+
+    def analizar(self, frame):
+        return _analizar(self._pipeline, frame, self.rut)
+
+    def cerrar(self):
+        pass
+
+
+# ============== PROCESO SERVIDOR ==============
+def _servir(nombre_shm, slots, tam_slot, solicitudes, respuestas):
+    """Punto de entrada del proceso hijo."""
+    from multiprocessing import shared_memory
+    from carga_diferida import BIOMETRIA
+
+    BIOMETRIA.obtener()                 # modelos dlib + galería, como en la app
+    from pipeline_rostro import PipelineRostro
+
+    shm = shared_memory.SharedMemory(name=nombre_shm)
+    pipelines = {}                      # sesión -> PipelineRostro (seguimiento entre cuadros)
+    respuestas.put(("listo", os.getpid(), None))
+    try:
+        while True:
+            msg = solicitudes.get()
+            if msg is None:
+                break
+            if msg[0] == "cerrar":
+                pipelines.pop(msg[1], None)
+                continue
+            if msg[0] == "galeria":
+                _tipo, id_sol, rut = msg
+                try:
+                    respuestas.put(("ok", id_sol, _estado_galeria(rut)))
+                except Exception as e:
+                    respuestas.put(("error", id_sol, f"{type(e).__name__}: {e}"))
+                continue
+            _tipo, id_sol, sesion, ranura, forma, rut, cuadro = msg
+            frame = None
+            try:
+                if cuadro is None:
+                    frame = np.ndarray(forma, dtype=np.uint8, buffer=shm.buf, offset=ranura * tam_slot)
+                else:
+                    frame = cuadro
+                pipeline = pipelines.get(sesion)
+                if pipeline is None:
+                    pipeline = pipelines[sesion] = PipelineRostro()
+                res, match = _analizar(pipeline, frame, rut)
+                respuestas.put(("ok", id_sol, (res.cajas, res.caja, res.estado, res.motivo, match)))
+            except Exception as e:
+                respuestas.put(("error", id_sol, f"{type(e).__name__}: {e}"))
+            finally:
+                del frame               # suelta la vista antes de cerrar el SharedMemory
+    finally:
+        shm.close()
+
+
+_arranque_lock = threading.Lock()
+
+@contextmanager
+def _sin_reejecutar_principal():
+    """
+    Con 'spawn' el hijo vuelve a ejecutar el script principal (principal.py crea la
+    ventana a nivel de módulo). Mientras se lanza el proceso se le indica que su
+    módulo principal es este, que no tiene efectos al importarse. En el .exe esto
+    no aplica: ahí lo resuelve multiprocessing.freeze_support() en principal.py.
+    """
+    import importlib.util
+    principal = sys.modules.get("__main__")
+    with _arranque_lock:
+        if principal is None or getattr(sys, "frozen", False):
+            yield
+            return
+        previo = getattr(principal, "__spec__", None)
+        principal.__spec__ = importlib.util.find_spec(__name__)
+        try:
+            yield
+        finally:
+            principal.__spec__ = previo
+
+
+# ============== CLIENTE + SUPERVISOR (proceso de la UI) ==============
+class _Generacion:
+    """Un proceso servidor y sus colas; se descarta entero al caer."""
+
+    def __init__(self, ctx, nombre_shm, slots, tam_slot):
+        self.solicitudes = ctx.Queue()
+        self.respuestas = ctx.Queue()
+        self.listo = threading.Event()
+        self.proceso = ctx.Process(target=_servir, name="reconocimiento", daemon=True,
+                                   args=(nombre_shm, slots, tam_slot, self.solicitudes, self.respuestas))
+
+    def iniciar(self):
+        with _sin_reejecutar_principal():
+            self.proceso.start()
+        return self
+
+
+class ServidorReconocimiento:
+    def __init__(self, slots: int = SLOTS, tam_slot: int = TAM_SLOT):
+        self.slots = slots
+        self.tam_slot = tam_slot
+        self._ctx = multiprocessing.get_context("spawn")
+        self._shm = None
+        self._gen = None
+        self._lock = threading.Lock()
+        self._pendientes = {}            # id -> [Event, ranura, respuesta]
+        self._vencidas = {}              # id -> (generación, ranura) retenida hasta su respuesta
+        self._libres = queue.SimpleQueue()
+        self._ids = itertools.count(1)
+        self._sesiones = itertools.count(1)
+        self._detener = threading.Event()
+        self.reinicios = 0
+
+    # ---------- ciclo de vida ----------
+    def iniciar(self):
+        from multiprocessing import shared_memory
+        if self._shm is not None:
+            return self
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slots * self.tam_slot)
+        for i in range(self.slots):
+            self._libres.put(i)
+        self._lanzar()
+        threading.Thread(target=self._supervisar, daemon=True, name="supervisor-reconocimiento").start()
+        return self
+
+    def _lanzar(self):
+        gen = _Generacion(self._ctx, self._shm.name, self.slots, self.tam_slot).iniciar()
+        self._gen = gen
+        threading.Thread(target=self._recibir, args=(gen,), daemon=True, name="respuestas-reconocimiento").start()
+        print(f"[reconocimiento] servidor lanzado pid={gen.proceso.pid}", flush=True)
+
+    def detener(self):
+        self._detener.set()
+        gen = self._gen
+        if gen is not None:
+            try:
+                gen.solicitudes.put(None)
+                gen.proceso.join(2)
+                if gen.proceso.is_alive():
+                    gen.proceso.terminate()
+            except Exception:
+                pass
+        self._fallar_pendientes("servidor detenido", gen)
+        if self._shm is not None:
+            try:
+                self._shm.close()
+                self._shm.unlink()
+            except Exception:
+                pass
+
+    @property
+    def listo(self) -> bool:
+        gen = self._gen
+        return gen is not None and gen.listo.is_set() and gen.proceso.is_alive()
+
+    def _supervisar(self):
+        from multiprocessing.connection import wait
+        intentos = 0
+        while not self._detener.is_set():
+            gen = self._gen
+            wait([gen.proceso.sentinel])
+            if self._detener.is_set():
+                return
+            gen.proceso.join(1)
+            codigo = gen.proceso.exitcode
+            print(f"[reconocimiento] el servidor terminó (código {codigo}); se relanza", flush=True)
+            self._fallar_pendientes(f"servidor caído (código {codigo})", gen)
+            # Si alcanzó a estar listo fue una caída puntual: se reinicia la espera
+            intentos = 0 if gen.listo.is_set() else intentos + 1
+            time.sleep(REINTENTO_S[min(intentos, len(REINTENTO_S) - 1)])
+            if self._detener.is_set():
+                return
+            self.reinicios += 1
+            try:
+                self._lanzar()
+            except Exception as e:
+                print(f"[reconocimiento] no se pudo relanzar: {e}", flush=True)
+                return
+
+    def _recibir(self, gen):
+        while not self._detener.is_set() and gen is self._gen:
+            try:
+                tipo, id_sol, dato = gen.respuestas.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            if tipo == "listo":
+                gen.listo.set()
+                print(f"[reconocimiento] servidor listo pid={id_sol}", flush=True)
+                continue
+            self._entregar(id_sol, (tipo, dato))
+
+    def _entregar(self, id_sol, respuesta):
+        with self._lock:
+            pendiente = self._pendientes.pop(id_sol, None)
+            vencida = self._vencidas.pop(id_sol, None) if pendiente is None else None
+        if pendiente is None:
+            # Respuesta tardía: el servidor ya terminó con esa ranura
+            if vencida is not None and vencida[1] is not None:
+                self._libres.put(vencida[1])
+            return
+        evento, ranura, _ = pendiente
+        pendiente[2] = respuesta
+        if ranura is not None:
+            self._libres.put(ranura)
+        evento.set()
+
+    def _fallar_pendientes(self, motivo, gen=None):
+        """Con el proceso de 'gen' ya muerto: falla lo pendiente y recupera sus ranuras vencidas."""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            muertas = [i for i, (g, _r) in self._vencidas.items() if gen is None or g is gen]
+            vencidas = [self._vencidas.pop(i)[1] for i in muertas]
+        for evento, ranura, _ in pendientes.values():
+            if ranura is not None:
+                self._libres.put(ranura)
+        for ranura in vencidas:
+            if ranura is not None:
+                self._libres.put(ranura)
+        for p in pendientes.values():
+            p[2] = ("caido", motivo)
+            p[0].set()
+
+    # ---------- solicitudes ----------
+    def _disponible(self, espera: float):
+        """Generación actual, esperando hasta 'espera' segundos a que quede lista."""
+        gen = self._gen
+        if gen is None or not gen.proceso.is_alive() or not gen.listo.wait(espera):
+            raise ServidorCaido("servidor de reconocimiento no disponible")
+        return gen
+
+    def _esperar(self, gen, id_sol, pendiente, timeout):
+        """Dato de la respuesta a 'id_sol'; ServidorCaido/RuntimeError si no llegó o falló."""
+        if not pendiente[0].wait(timeout):
+            with self._lock:
+                # El servidor puede seguir leyendo la ranura: se retiene hasta su respuesta
+                # tardía (_entregar) o hasta que el proceso muera (_fallar_pendientes)
+                if self._pendientes.pop(id_sol, None) is not None:
+                    self._vencidas[id_sol] = (gen, pendiente[1])
+            if pendiente[2] is None:
+                raise ServidorCaido("el servidor no respondió a tiempo")
+        tipo, dato = pendiente[2]
+        if tipo == "caido":
+            raise ServidorCaido(dato)
+        if tipo == "error":
+            raise RuntimeError(f"reconocimiento: {dato}")
+        return dato
+
+    def procesar(self, sesion: int, frame, rut=None, timeout: float = TIMEOUT_S):
+        """(ResultadoRemoto, match). Bloquea al hilo que llama (nunca llamar desde Tk)."""
+        gen = self._disponible(timeout)
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        ranura, cuadro = None, None
+        if frame.nbytes <= self.tam_slot:
+            try:
+                ranura = self._libres.get(timeout=timeout)
+            except queue.Empty:
+                self._si_colgado(gen)
+                raise ServidorCaido("sin ranuras libres")
+            destino = np.ndarray(frame.shape, dtype=np.uint8, buffer=self._shm.buf,
+                                 offset=ranura * self.tam_slot)
+            destino[...] = frame
+            del destino
+        else:
+            cuadro = frame
+        id_sol = next(self._ids)
+        pendiente = [threading.Event(), ranura, None]
+        with self._lock:
+            self._pendientes[id_sol] = pendiente
+        gen.solicitudes.put(("cuadro", id_sol, sesion, ranura, frame.shape, rut, cuadro))
+        cajas, caja, estado, motivo, match = self._esperar(gen, id_sol, pendiente, timeout)
+        return ResultadoRemoto(cajas, caja, estado, motivo), match
+
+    def estado_galeria(self, rut=None, timeout: float = TIMEOUT_S, espera: float = ARRANQUE_S):
+        """Conteos de la galería del servidor; espera su arranque hasta 'espera' segundos."""
+        gen = self._disponible(espera)
+        id_sol = next(self._ids)
+        pendiente = [threading.Event(), None, None]
+        with self._lock:
+            self._pendientes[id_sol] = pendiente
+        gen.solicitudes.put(("galeria", id_sol, rut))
+        return self._esperar(gen, id_sol, pendiente, timeout)
+
+    def _si_colgado(self, gen):
+        """Todas las ranuras retenidas por solicitudes vencidas de 'gen': se termina y el supervisor relanza."""
+        with self._lock:
+            retenidas = sum(1 for g, r in self._vencidas.values() if g is gen and r is not None)
+        if retenidas >= self.slots and gen.proceso.is_alive():
+            print(f"[reconocimiento] servidor sin responder ({retenidas} cuadros vencidos); se termina", flush=True)
+            gen.proceso.terminate()
+
+    def abrir_sesion(self, rut=None):
+        return SesionRemota(self, next(self._sesiones), rut)
+
+    def cerrar_sesion(self, sesion: int):
+        gen = self._gen
+        if gen is not None and gen.proceso.is_alive():
+            try:
+                gen.solicitudes.put(("cerrar", sesion))
+            except Exception:
+                pass
+
+
+class SesionRemota:
+    """Analizador con su PipelineRostro en el servidor (el seguimiento vive allá)."""
+
+    def __init__(self, servidor: ServidorReconocimiento, sesion: int, rut=None):
+        self.servidor = servidor
+        self.sesion = sesion
+        self.rut = rut
+
+    def analizar(self, frame):
+        try:
+            return self.servidor.procesar(self.sesion, frame, self.rut)
+        except ServidorCaido as e:
+            # La sesión de captura sigue; el supervisor relanza el proceso
+            return ResultadoRemoto(estado="sin_rostro", motivo=f"Reconocimiento no disponible ({e})"), None
+
+    def cerrar(self):
+        self.servidor.cerrar_sesion(self.sesion)
+
+
+# ============== INSTANCIA DE PROCESO ==============
+_servidor = None
+_servidor_lock = threading.Lock()
+
+def iniciar_servidor():
+    """Lanza el servidor (idempotente). Si no se puede, se sigue en el proceso de la UI."""
+    global _servidor
+    if not USAR_PROCESO_APARTE:
+        return None
+    with _servidor_lock:
+        if _servidor is None:
+            try:
+                _servidor = ServidorReconocimiento().iniciar()
+                atexit.register(detener_servidor)
+            except Exception as e:
+                print(f"[reconocimiento] sin proceso aparte, se usa el local: {e}", flush=True)
+                _servidor = False
+        return _servidor or None
+
+def detener_servidor():
+    global _servidor
+    with _servidor_lock:
+        if _servidor:
+            _servidor.detener()
+        _servidor = None
+
+def servidor_activo():
+    """El servidor lanzado en este proceso, o None si se reconoce en el proceso de la UI."""
+    return _servidor or None
+
+def estado_galeria(rut=None):
+    """
+    {"personas", "encodings", "del_rut"} de la galería. Con el servidor lanzado se
+    consulta allá (puede lanzar ServidorCaido); si no, se lee la galería local.
+    """
+    if _servidor:
+        return _servidor.estado_galeria(rut)
+    return _estado_galeria(rut)
+
+def nuevo_analizador(rut=None):
+    """Analizador remoto si el servidor está lanzado; local en otro caso."""
+    if _servidor:
+        return _servidor.abrir_sesion(rut)
+    return AnalizadorLocal(rut)
@@ -1,5 +1,7 @@
 # solicitudes.py
-import os, sys, sqlite3, datetime, mimetypes, smtplib, ssl, traceback
+import os, sys, datetime, mimetypes, smtplib, ssl, traceback
+from db import conectar, asegurar_esquema, capacidades
+from despacho_ui import ejecutar
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import messagebox
@@ -68,38 +70,11 @@ USAR_SMTP = True  # True para envío real
 #                 ESQUEMA / UTILIDADES BD
 # =========================================================
 def _ensure_schema():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS folios (
-            id INTEGER PRIMARY KEY CHECK (id = 1),
-            ultimo_folio INTEGER NOT NULL DEFAULT 0
-        );
-    """)
-    cur.execute("INSERT OR IGNORE INTO folios (id, ultimo_folio) VALUES (1, 0);")
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS solicitudes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            folio INTEGER NOT NULL,
-            rut TEXT NOT NULL,
-            nombre TEXT NOT NULL,
-            tipo_permiso TEXT NOT NULL,
-            fecha_desde TEXT NOT NULL,    -- ISO YYYY-MM-DD
-            fecha_hasta TEXT NOT NULL,    -- ISO YYYY-MM-DD
-            observacion TEXT,
-            pdf_path TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        );
-    """)
-    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_solicitudes_folio ON solicitudes(folio);")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_solicitudes_rut ON solicitudes(rut);")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_solicitudes_created_at ON solicitudes(created_at);")
-    con.commit()
-    con.close()
+    """folios / solicitudes vienen en el esquema versionado (db._migracion_2)."""
+    asegurar_esquema(DB_PATH)
 
 def get_next_folio():
-    con = sqlite3.connect(DB_PATH)
+    con = conectar(DB_PATH)
     try:
         con.execute("BEGIN IMMEDIATE;")
         row = con.execute("SELECT ultimo_folio FROM folios WHERE id=1").fetchone()
@@ -115,7 +90,7 @@ def get_next_folio():
         con.close()
 
 def guardar_solicitud_en_bd(folio, rut, nombre, tipo, desde, hasta, obs, pdf_path):
-    con = sqlite3.connect(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
     cur.execute("""
         INSERT INTO solicitudes (folio, rut, nombre, tipo_permiso, fecha_desde, fecha_hasta, observacion, pdf_path, created_at)
@@ -132,18 +107,13 @@ def guardar_solicitud_en_bd(folio, rut, nombre, tipo, desde, hasta, obs, pdf_pat
 #          NOMBRES / RUT y datos extra (cargo/profesión)
 # =========================================================
 def _cols_trabajadores():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    try:
-        return [r[1] for r in cur.execute("PRAGMA table_info(trabajadores);").fetchall()]
-    finally:
-        con.close()
+    return list(capacidades(DB_PATH).columnas("trabajadores"))
 
 def _trabajadores_tiene(col_name: str) -> bool:
     return col_name in _cols_trabajadores()
 
 def cargar_nombres_ruts():
-    con = sqlite3.connect(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
     try:
         if _trabajadores_tiene("apellido"):
@@ -170,7 +140,7 @@ def obtener_cargo_por_rut(rut: str) -> str:
             cand = c; break
     if not cand:
         return ""
-    con = sqlite3.connect(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
     try:
         cur.execute(f"SELECT {cand} FROM trabajadores WHERE rut=?", (rut,))
@@ -183,12 +153,10 @@ def obtener_correo_por_rut(rut: str) -> str:
     """Retorna correo del trabajador si existe columna 'correo'."""
     if not rut:
         return ""
-    con = sqlite3.connect(DB_PATH)
+    con = conectar(DB_PATH)
     cur = con.cursor()
     try:
-        cur.execute("PRAGMA table_info(trabajadores)")
-        cols = {c[1].lower() for c in cur.fetchall()}
-        if "correo" not in cols:
+        if not capacidades(DB_PATH).tiene_columna("trabajadores", "correo"):
             return ""
         cur.execute("SELECT correo FROM trabajadores WHERE rut=?", (rut,))
         row = cur.fetchone()
@@ -380,7 +348,7 @@ def _smtp_load_config():
     """
     cfg = {}
     try:
-        con = sqlite3.connect(DB_PATH)
+        con = conectar(DB_PATH)
         cur = con.cursor()
         # Opción 1
         try:
@@ -915,23 +883,30 @@ def construir_solicitudes(frame_padre, on_volver=None):
         if correo_func and "@" in correo_func:
             cc_list.append(correo_func)
 
-        try:
-            _smtp_send(
-                to_list=to_list,
-                cc_list=cc_list,
-                subject=asunto,
-                body_text=cuerpo_txt,
-                html_body=cuerpo_html,
-                attachment_path=pdf_path
-            )
+        def enviado(_):
+            btn_enviar.configure(state="normal")
             msg_ok = f"Reserva registrada (Folio {folio:06d}).\nSe envió el aviso por correo."
             if pdf_path is None:
                 msg_ok += "\n(Nota: No se pudo adjuntar PDF; ver consola para detalle)."
             messagebox.showinfo("Listo", msg_ok)
-        except Exception as e:
-            traceback.print_exc()
+
+        def fallo(e):
+            btn_enviar.configure(state="normal")
             messagebox.showerror("Envío", f"No se pudo enviar el correo:\n{e}")
 
+        if not USAR_SMTP:
+            # Envío simulado: muestra un diálogo, va en el hilo de Tk
+            try:
+                _smtp_send(to_list, cc_list, asunto, cuerpo_txt, cuerpo_html, pdf_path)
+            except Exception as e:
+                return fallo(e)
+            return enviado(None)
+
+        # SMTP en un trabajador: la ventana no se congela mientras responde el servidor
+        btn_enviar.configure(state="disabled")
+        ejecutar(_smtp_send, to_list, cc_list, asunto, cuerpo_txt, cuerpo_html, pdf_path,
+                 al_terminar=enviado, al_fallar=fallo, ambito=btn_enviar, nombre="enviar_solicitud")
+
     btn_enviar.configure(command=do_enviar)
 
     # ---------- Limpiar / Cancelar ----------